@@ -58,6 +58,12 @@ DEFAULT_PARAMS = {
     'backup_name': False, 'quiet': False,
     'container': 'freezer_backups', 'no_incremental': False,
     'max_segment_size': 33554432, 'lvm_srcvol': False,
+    'upload_workers': 1, 'download_workers': 1, 'queue_max_bytes': None,
+    'restore_prefetch': 1, 'engine_name': 'tar', 'compression_workers': 0,
+    'encryption_workers': 1, 'catalog_ttl': 0, 'swift_index': False,
+    'swift_slo': False,
+    'remove_orphans': False, 'orphans_grace_period': 86400,
+    'collect_chunks': False,
     'download_limit': -1, 'hostname': False, 'remove_from_date': False,
     'restart_always_level': False, 'lvm_dirmount': None,
     'dereference_symlink': '',
@@ -195,6 +201,33 @@ _COMMON = [
                     "than the provided datetime in the form "
                     "'YYYY-MM-DDThh:mm:ss' i.e. '1974-03-25T23:23:23'. "
                     "Make sure the 'T' is between date and time "),
+    cfg.BoolOpt('remove-orphans',
+                dest='remove_orphans',
+                help="With the admin action, removes the segments left in the "
+                     "storage by backups that failed before they were "
+                     "completed, for all the backup names of the container. "
+                     "Chunks of dedup backups are removed by "
+                     "--collect-chunks. Use --dry-run to only report them."
+                ),
+    cfg.BoolOpt('collect-chunks',
+                dest='collect_chunks',
+                help="With the admin action, removes the chunks that no "
+                     "dedup backup of the storage refers to anymore, after "
+                     "the backups older than --remove-older-than or "
+                     "--remove-from are removed. Chunks are kept for "
+                     "--orphans-grace-period seconds. No dedup backup of "
+                     "the storage must run meanwhile. Use --dry-run to only "
+                     "report them."
+                ),
+    cfg.IntOpt('orphans-grace-period',
+               dest='orphans_grace_period',
+               min=0,
+               help="Seconds after which the segments of a backup without "
+                    "manifest are considered orphaned by --remove-orphans, "
+                    "and unreferenced chunks by --collect-chunks, it must "
+                    "be longer than the longest running backup. "
+                    "Default 86400 (one day)."
+               ),
     cfg.StrOpt('no-incremental',
                dest='no_incremental',
                help="Disable incremental feature. By default freezer build the"
@@ -242,11 +275,82 @@ _COMMON = [
                     "to encrypt the files before to be uploaded in Swift. "
                     "Default do not encrypt."
                ),
+    cfg.IntOpt('encryption-workers',
+               dest='encryption_workers',
+               min=1,
+               help="Number of threads encrypting the backup stream, or "
+                    "decrypting it during restore, with --encrypt-pass-file. "
+                    "Default 1."
+               ),
     cfg.IntOpt('max-segment-size',
                short='M',
                dest='max_segment_size',
                help="Set the maximum file chunk size in bytes to upload to "
-                    "swift Default 33554432 bytes (32MB)"
+                    "swift Default 33554432 bytes (32MB). Segments larger "
+                    "than 32MB, up to the 5GB limit of swift, are spooled in "
+                    "the work dir while they are uploaded"
+               ),
+    cfg.IntOpt('upload-workers',
+               dest='upload_workers',
+               min=1,
+               help="Number of segments uploaded to swift in parallel. Every "
+                    "worker uses its own swift connection, segments larger "
+                    "than 32MB are spooled in the work dir while they are "
+                    "uploaded. Default 1."
+               ),
+    cfg.IntOpt('download-workers',
+               dest='download_workers',
+               min=1,
+               help="Number of segments downloaded from swift in parallel "
+                    "during restore, in ranges of at most 32MB. Segments "
+                    "are still restored in order, at most one range per "
+                    "worker is read ahead. Default 1."
+               ),
+    cfg.IntOpt('queue-max-bytes',
+               dest='queue_max_bytes',
+               help="Maximum number of bytes buffered in memory between the "
+                    "backup stream and every storage, and for every level "
+                    "downloaded during restore, the rest of a level is "
+                    "spooled in the work dir. At least one segment is "
+                    "always buffered. Default two segments per queue."
+               ),
+    cfg.IntOpt('catalog-ttl',
+               dest='catalog_ttl',
+               min=0,
+               help="Seconds a listing of the backups of a backup name is "
+                    "trusted. The backups found are kept in a sqlite "
+                    "catalog in the work dir, updated by every backup and "
+                    "removal, and the storage is listed again once the "
+                    "listing is older. Backups made by other agents may not "
+                    "be seen until then. Default 0, the storage is listed "
+                    "every time."
+               ),
+    cfg.BoolOpt('swift-index',
+                dest='swift_index',
+                help="Keep an index object of the backups of every backup "
+                     "name in the swift container, rewritten by every "
+                     "backup and removal, so finding the backups of a name "
+                     "is a single request instead of a listing. Backups made "
+                     "by agents that do not use the index are not seen by "
+                     "the ones that do. Default False."
+                ),
+    cfg.BoolOpt('swift-slo',
+                dest='swift_slo',
+                help="Upload backups to swift as static large objects, "
+                     "whose manifest lists the size and etag of every "
+                     "segment. Restores fetch the segments from the "
+                     "manifest instead of a listing and verify them. "
+                     "Dynamic large objects are uploaded when the cluster "
+                     "does not support static ones. Default False."
+                ),
+    cfg.IntOpt('restore-prefetch',
+               dest='restore_prefetch',
+               min=1,
+               help="Number of incremental levels downloaded ahead of the "
+                    "level being extracted during restore. Levels are always "
+                    "extracted in order, the part of the levels downloaded "
+                    "ahead that does not fit in --queue-max-bytes is spooled "
+                    "in the work dir. Default 1."
                ),
     cfg.StrOpt('restore-abs-path',
                dest='restore_abs_path',
@@ -340,6 +444,30 @@ _COMMON = [
                choices=['gzip', 'bzip2', 'xz'],
                help="compression algorithm to use. gzip is default algorithm"
                ),
+    cfg.IntOpt('compression-workers',
+               dest='compression_workers',
+               min=0,
+               help="Number of threads compressing the backup stream in "
+                    "independent frames, which are decompressed in parallel "
+                    "during restore. Frames of incompressible data, like "
+                    "media or encrypted files, are stored. Default 0 lets "
+                    "the engine compress the stream with a single process."
+               ),
+    cfg.StrOpt('engine',
+               dest='engine_name',
+               choices=['tar', 'native', 'dedup', 'delta', 'hardlink',
+                        'image'],
+               help="Engine used to backup and restore. tar invokes gnutar, "
+                    "native builds the tar stream in process with its own "
+                    "incremental manifest, dedup splits the stream of the "
+                    "native engine in content defined chunks stored once "
+                    "and shared by all backups, delta is the native engine "
+                    "storing only the changed blocks of modified files, "
+                    "hardlink stores every backup as a directory tree of a "
+                    "local storage, hard linking unchanged files to the "
+                    "previous tree, image stores only the changed fixed "
+                    "size blocks of large image files. Default tar."
+               ),
     cfg.StrOpt('storage',
                dest='storage',
                choices=['local', 'swift', 'ssh'],
@@ -0,0 +1,450 @@
+"""
+(c) Copyright 2016 Hewlett-Packard Enterprise Development Company, L.P.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Freezer deduplication engine
+"""
+import binascii
+import errno
+import functools
+import hashlib
+import io
+import math
+from multiprocessing.pool import ThreadPool
+import os
+import struct
+import threading
+import time
+import uuid
+import zlib
+
+from oslo_log import log
+
+from freezer.engine.native import native_engine
+from freezer.storage import multiple
+from freezer.utils import compress
+from freezer.utils import streaming
+from freezer.utils import utils
+
+LOG = log.getLogger(__name__)
+
+RECIPE_MAGIC = b'FRZRCP\x00\x01'
+# sha256 digest and size of every chunk of the stream
+RECIPE_ENTRY = struct.Struct('>32sI')
+
+# Chunk holding the generation of the last collection of the chunks of a
+# storage, it is not a digest so no recipe refers to it
+GC_MARKER = 'collected'
+
+MIN_CHUNK_SIZE = 256 * 1024
+AVG_CHUNK_SIZE = 1024 * 1024
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Boundaries are searched after ANCHOR bytes, by the hash of the WINDOW
+# bytes that end with the anchor
+ANCHOR = b'\n'
+ANCHOR_FREQUENCY = 256
+WINDOW = 64
+
+
+class Chunker(object):
+    """
+    Splits a stream in content defined chunks. Candidate boundaries
+    follow an anchor byte, a candidate is a boundary when the crc32 of
+    the window of bytes before it has its top bits cleared. Boundaries
+    depend only on the bytes around them, so an insertion or a removal
+    in the stream only changes the chunks around it.
+
+    Anchors are found with bytearray.find and windows hashed by zlib, a
+    per byte rolling hash in python would be an order of magnitude
+    slower. Data without anchors, like runs of zeros, is cut at
+    max_size.
+    """
+
+    def __init__(self, min_size=MIN_CHUNK_SIZE, avg_size=AVG_CHUNK_SIZE,
+                 max_size=MAX_CHUNK_SIZE):
+        """
+        :param min_size: no boundary is searched in the first min_size
+            bytes of a chunk
+        :param avg_size: expected size of the chunks of random data
+        :param max_size: chunks are cut at max_size bytes if no boundary
+            was found
+        """
+        self.min_size = min_size
+        self.max_size = max_size
+        candidates = float(avg_size - min_size) / ANCHOR_FREQUENCY
+        bits = max(int(round(math.log(max(candidates, 1), 2))), 0)
+        self.mask = ((1 << bits) - 1) << (32 - bits)
+
+    def find_boundary(self, data, start, end):
+        """
+        :return: the end of the first chunk in data[start:end], None if
+            there is no boundary
+        """
+        view = memoryview(data)
+        position = data.find(ANCHOR, start, end)
+        while position >= 0:
+            position += 1
+            window = view[max(position - WINDOW, 0):position]
+            if not zlib.crc32(window) & self.mask:
+                return position
+            position = data.find(ANCHOR, position, end)
+        return None
+
+    def split(self, messages):
+        """
+        :param messages: stream to split, messages are released once they
+            are copied
+        :return: the chunks of the stream
+        """
+        buf = bytearray()
+        scanned = 0
+        for message in messages:
+            buf += streaming.message_view(message)
+            streaming.release(message)
+            while len(buf) > self.min_size:
+                end = min(len(buf), self.max_size)
+                cut = self.find_boundary(buf, max(scanned, self.min_size),
+                                         end)
+                scanned = end
+                if cut is None:
+                    if end < self.max_size:
+                        break
+                    cut = end
+                yield bytes(buf[:cut])
+                del buf[:cut]
+                scanned = 0
+        if buf:
+            yield bytes(buf)
+
+
+class ChunkIndex(object):
+    """
+    Local cache of the names of the chunks a storage already has, one
+    name per line in the work dir, so backups do not upload them again.
+    The first line holds the generation of the chunks it was built from.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.names = set()
+        self.added = []
+        self.generation = ''
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        :return: False if there is no cache yet
+        """
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path) as index_file:
+            lines = [line.strip() for line in index_file]
+        if lines and lines[0].startswith('#'):
+            self.generation = lines.pop(0)[1:].strip()
+        self.names = set(lines)
+        self.names.discard('')
+        return True
+
+    def reset(self, names, generation=''):
+        self.names = set(names)
+        self.added = []
+        self.generation = generation
+        part_path = '{0}.part'.format(self.path)
+        with open(part_path, 'w') as index_file:
+            index_file.write('# {0}\n'.format(generation))
+            index_file.writelines('{0}\n'.format(name)
+                                  for name in sorted(self.names))
+        os.rename(part_path, self.path)
+
+    def __contains__(self, name):
+        with self._lock:
+            return name in self.names
+
+    def add(self, name):
+        with self._lock:
+            if name not in self.names:
+                self.names.add(name)
+                self.added.append(name)
+
+    def save(self):
+        with self._lock:
+            added, self.added = self.added, []
+        if added:
+            with open(self.path, 'a') as index_file:
+                index_file.writelines('{0}\n'.format(name)
+                                      for name in added)
+
+
+class DedupBackupEngine(native_engine.NativeBackupEngine):
+    """
+    Deduplicating engine built on the native engine: its tar stream is
+    split in content defined chunks, every chunk is stored once, named
+    after its sha256, in the content addressed area of the storage. The
+    backup itself is only the recipe of the stream, the list of its
+    chunks.
+
+    Chunks are compressed one by one, incompressible ones are stored as
+    they are. A local index of the chunks in the storage avoids uploading
+    them again, the index is rebuilt from the storage for every level 0
+    and after the chunks were collected. Chunks are shared by all backups
+    and are not removed with them, collect_chunks removes the ones no
+    backup refers to anymore.
+    """
+
+    engine_name = 'dedup'
+
+    def __init__(
+            self, compression_algo, dereference_symlink, exclude, storage,
+            chunk_size, encrypt_pass_file=None, dry_run=False,
+            queue_max_bytes=None, restore_prefetch=1, upload_workers=1,
+            download_workers=1):
+        """
+            :type storage: freezer.storage.base.Storage
+        :param upload_workers: number of chunks stored in parallel
+        :param download_workers: number of chunks fetched in parallel
+        :return:
+        """
+        if encrypt_pass_file:
+            raise ValueError("Encryption is not supported by the dedup "
+                             "engine")
+        super(DedupBackupEngine, self).__init__(
+            compression_algo, dereference_symlink, exclude, storage,
+            chunk_size, dry_run=dry_run, queue_max_bytes=queue_max_bytes,
+            restore_prefetch=restore_prefetch)
+        self.codec = compress.CODECS[compression_algo]
+        self.upload_workers = max(upload_workers, 1)
+        self.download_workers = max(download_workers, 1)
+        self.chunker = Chunker()
+        self.index = None
+
+    def tar_mode(self):
+        # chunks are compressed one by one
+        return 'w|'
+
+    def chunk_index(self):
+        location = self.storage.chunks_location().encode('utf-8')
+        return ChunkIndex(utils.path_join(
+            self.storage.work_dir,
+            'chunks_{0}.idx'.format(hashlib.sha1(location).hexdigest())))
+
+    def store_chunk(self, chunk):
+        """
+        :return: the recipe entry of the chunk and whether it was stored
+        """
+        digest = hashlib.sha256(chunk).digest()
+        name = binascii.hexlify(digest).decode('ascii')
+        entry = RECIPE_ENTRY.pack(digest, len(chunk))
+        if name in self.index:
+            return entry, False
+        self.storage.put_chunk(name, compress.encode_frame(self.codec, chunk))
+        self.index.add(name)
+        return entry, True
+
+    def recipe(self, backup_path, manifest_path):
+        yield RECIPE_MAGIC
+        stats = {'chunks': 0, 'chunks_stored': 0, 'bytes_stored': 0}
+        pool = ThreadPool(self.upload_workers)
+        try:
+            tar_stream = super(DedupBackupEngine, self).backup_data(
+                backup_path, manifest_path)
+            for entry, stored in streaming.ordered_map(
+                    pool, self.store_chunk, self.chunker.split(tar_stream),
+                    self.upload_workers):
+                stats['chunks'] += 1
+                if stored:
+                    stats['chunks_stored'] += 1
+                    stats['bytes_stored'] += RECIPE_ENTRY.unpack(entry)[1]
+                yield entry
+        finally:
+            pool.terminate()
+            self.index.save()
+        self.stats.update(stats)
+
+    def backup_data(self, backup_path, manifest_path):
+        LOG.info("Dedup engine backup stream enter")
+        self.index = self.chunk_index()
+        # a level 0 has no previous manifest, the chunks of the storage
+        # are listed again in case some were removed
+        generation = collection_generation(self.storage)
+        if (not os.path.exists(manifest_path) or not self.index.load() or
+                self.index.generation != generation):
+            self.index.reset(self.storage.list_chunks(), generation)
+        return streaming.join_blocks(
+            self.recipe(backup_path, manifest_path), self.chunk_size)
+
+    @staticmethod
+    def read_recipe(read_pipe):
+        """
+        :return: the entries of the recipe read from read_pipe
+        """
+        # buffered, so entries are read whole
+        read_file = io.open(read_pipe.fileno(), 'rb', closefd=False)
+        try:
+            if read_file.read(len(RECIPE_MAGIC)) != RECIPE_MAGIC:
+                raise ValueError("Not a dedup recipe")
+            while True:
+                entry = read_file.read(RECIPE_ENTRY.size)
+                if not entry:
+                    return
+                if len(entry) != RECIPE_ENTRY.size:
+                    raise ValueError("Truncated dedup recipe")
+                yield RECIPE_ENTRY.unpack(entry)
+        finally:
+            read_file.close()
+
+    @staticmethod
+    def load_chunk(storage, entry):
+        digest, size = entry
+        name = binascii.hexlify(digest).decode('ascii')
+        chunk = compress.decode_frame(storage.get_chunk(name))
+        if len(chunk) != size or hashlib.sha256(chunk).digest() != digest:
+            raise ValueError("Corrupted chunk {0}".format(name))
+        return chunk
+
+    def write_chunks(self, read_pipe, storage, write_pipe, errors):
+        """
+        Writes the chunks of the recipe read from read_pipe into
+        write_pipe, fetching them on download_workers threads.
+        :type errors: list
+        """
+        pool = ThreadPool(self.download_workers)
+        try:
+            for chunk in streaming.ordered_map(
+                    pool, functools.partial(self.load_chunk, storage),
+                    self.read_recipe(read_pipe), self.download_workers):
+                write_pipe.write(chunk)
+        except IOError as e:
+            # tarfile stops reading at the end of the archive, or exits
+            # on errors it reports itself
+            if e.errno != errno.EPIPE:
+                LOG.exception(e)
+                errors.append(e)
+        except Exception as e:
+            LOG.exception(e)
+            errors.append(e)
+        finally:
+            pool.terminate()
+            read_pipe.close()
+            write_pipe.close()
+
+    def restore_level(self, restore_path, read_pipe, backup, except_queue,
+                      framed=False, decrypted=False):
+        """
+        Rebuilds the tar stream of the level from its chunks and extracts
+        it like the native engine.
+        """
+        read_fd, write_fd = os.pipe()
+        tar_pipe = os.fdopen(read_fd, 'rb', 0)
+        write_pipe = os.fdopen(write_fd, 'wb', 0)
+        errors = []
+        chunks_stream = threading.Thread(
+            target=self.write_chunks,
+            args=(read_pipe, backup.storage, write_pipe, errors))
+        chunks_stream.daemon = True
+        chunks_stream.start()
+        try:
+            super(DedupBackupEngine, self).restore_level(
+                restore_path, tar_pipe, backup, except_queue)
+        finally:
+            chunks_stream.join()
+        if errors:
+            except_queue.put(errors[0])
+            raise errors[0]
+
+
+def collection_generation(storage):
+    """
+    :type storage: freezer.storage.base.Storage
+    :return: generation written by the last collection of the chunks of
+        storage, '' if they were never collected
+    """
+    try:
+        return storage.get_chunk(GC_MARKER).decode('ascii')
+    except Exception:
+        return ''
+
+
+def recipe_chunks(blocks):
+    """
+    :param blocks: content of a dedup backup
+    :return: names of the chunks the recipe refers to
+    :rtype: set[str]
+    """
+    # about 36 bytes per chunk, recipes are read whole
+    recipe = b''.join(bytes(block) for block in blocks)
+    if not recipe.startswith(RECIPE_MAGIC):
+        raise ValueError("Not a dedup recipe")
+    if (len(recipe) - len(RECIPE_MAGIC)) % RECIPE_ENTRY.size:
+        raise ValueError("Truncated dedup recipe")
+    return set(
+        binascii.hexlify(RECIPE_ENTRY.unpack_from(recipe, offset)[0])
+        .decode('ascii')
+        for offset in range(len(RECIPE_MAGIC), len(recipe),
+                            RECIPE_ENTRY.size))
+
+
+def collect_chunks(storage, grace_period, dry_run=False):
+    """
+    Removes the chunks no dedup backup of the storage refers to, for all
+    the backup names of the storage. Backups of other engines are told
+    apart by the magic of the recipes. Nothing is removed if a recipe
+    cannot be read.
+
+    Dedup backups must not run on the storage meanwhile: they may refer
+    to chunks their index lists and the collection removes. The chunk
+    indexes are rebuilt by the backups following a collection.
+    :type storage: freezer.storage.base.Storage
+    :param grace_period: seconds after which a chunk no recipe refers to
+        is removed, it must be longer than the longest running backup
+    :param dry_run: only report the chunks that would be removed
+    :return: statistics of the collection
+    :rtype: dict
+    """
+    if isinstance(storage, multiple.MultipleStorage):
+        stats = {}
+        for child in storage.storages:
+            for key, value in collect_chunks(child, grace_period,
+                                             dry_run).items():
+                stats[key] = stats.get(key, 0) + value
+        return stats
+    # listed before the recipes: the chunks stored by a backup completed
+    # meanwhile are recent
+    times = storage.chunk_times()
+    times.pop(GC_MARKER, None)
+    cutoff = time.time() - grace_period
+    referenced = set()
+    recipes = 0
+    for backup in storage.list_all_backups():
+        for increment in backup.increments.values():
+            if storage.backup_head(increment,
+                                   len(RECIPE_MAGIC)) != RECIPE_MAGIC:
+                continue
+            referenced |= recipe_chunks(storage.backup_blocks(increment))
+            recipes += 1
+    unused = sorted(name for name, mtime in times.items()
+                    if name not in referenced and mtime < cutoff)
+    stats = {'recipes': recipes, 'chunks': len(times),
+             'unreferenced_chunks': len(unused)}
+    if unused and not dry_run:
+        # the generation changes before the removal, in case it is
+        # interrupted, and after it, for the indexes rebuilt meanwhile
+        storage.put_chunk(GC_MARKER, uuid.uuid4().hex.encode('ascii'))
+        storage.remove_chunks(unused)
+        storage.put_chunk(GC_MARKER, uuid.uuid4().hex.encode('ascii'))
+    LOG.info('{0} {1} of {2} chunks {3} no dedup recipe refers to, '
+             '{4} recipes'.format(
+                 'Found' if dry_run else 'Removed', len(unused),
+                 len(times), storage.chunks_location(), recipes))
+    return stats
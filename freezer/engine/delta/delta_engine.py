@@ -0,0 +1,290 @@
+"""
+(c) Copyright 2016 Hewlett-Packard Enterprise Development Company, L.P.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Freezer delta engine
+"""
+import base64
+import functools
+import hashlib
+import os
+import struct
+import tempfile
+
+from oslo_log import log
+
+from freezer.engine.dedup import dedup_engine
+from freezer.engine.native import native_engine
+
+LOG = log.getLogger(__name__)
+
+# pax header keyword of the members holding a delta, its value is the
+# size of the rebuilt file
+DELTA_KEYWORD = 'FREEZER.delta'
+
+# sha256 digest and size of every block of a file
+SIGNATURE = struct.Struct('>32sI')
+
+# operation, offset in the previous version of the file and length, DATA
+# operations are followed by length bytes
+DELTA_OP = struct.Struct('>BQQ')
+COPY = 1
+DATA = 2
+
+MIN_BLOCK_SIZE = 64 * 1024
+AVG_BLOCK_SIZE = 256 * 1024
+MAX_BLOCK_SIZE = 1024 * 1024
+READ_SIZE = 1024 * 1024
+
+
+def encode_signatures(signatures):
+    return base64.b64encode(bytes(signatures)).decode('ascii')
+
+
+def decode_signatures(encoded):
+    """
+    :return: sha256 digest -> offset and size of the first block with
+        that digest
+    :rtype: dict
+    """
+    signatures = base64.b64decode(encoded)
+    if len(signatures) % SIGNATURE.size:
+        raise ValueError("Corrupted block signatures")
+    blocks = {}
+    offset = 0
+    for position in range(0, len(signatures), SIGNATURE.size):
+        digest, size = SIGNATURE.unpack_from(signatures, position)
+        blocks.setdefault(digest, (offset, size))
+        offset += size
+    return blocks
+
+
+def copy_bytes(source, destination, length):
+    """
+    :return: number of bytes copied, less than length if source ended
+    """
+    copied = 0
+    while copied < length:
+        data = source.read(min(length - copied, READ_SIZE))
+        if not data:
+            break
+        destination.write(data)
+        copied += len(data)
+    return copied
+
+
+class DeltaBackupEngine(native_engine.NativeBackupEngine):
+    """
+    Native engine storing only the changed blocks of modified files.
+
+    Files are split in content defined blocks, the manifest of every
+    level keeps the sha256 and size of the blocks of every regular file.
+    When a file changed since the previous level, its blocks are looked
+    up in the signatures of its previous version: blocks found there are
+    stored as references to their previous offset, the others as data.
+    Boundaries depend on the content around them, so data inserted or
+    removed in the middle of a file only changes the blocks around it.
+
+    The delta replaces the content of the file in the tar stream, it is
+    applied on restore to the file extracted by the previous levels.
+    Levels therefore cannot be restored on their own.
+    """
+
+    engine_name = 'delta'
+
+    def __init__(
+            self, compression_algo, dereference_symlink, exclude, storage,
+            chunk_size, encrypt_pass_file=None, dry_run=False,
+            queue_max_bytes=None, restore_prefetch=1, compression_workers=0,
+            encryption_workers=1):
+        """
+            :type storage: freezer.storage.base.Storage
+        :return:
+        """
+        super(DeltaBackupEngine, self).__init__(
+            compression_algo, dereference_symlink, exclude, storage,
+            chunk_size, encrypt_pass_file=encrypt_pass_file,
+            dry_run=dry_run, queue_max_bytes=queue_max_bytes,
+            restore_prefetch=restore_prefetch,
+            compression_workers=compression_workers,
+            encryption_workers=encryption_workers)
+        self.chunker = dedup_engine.Chunker(MIN_BLOCK_SIZE, AVG_BLOCK_SIZE,
+                                            MAX_BLOCK_SIZE)
+        self.delta_files = 0
+        self.reused_bytes = 0
+
+    @staticmethod
+    def unchanged(previous_entry, entry):
+        # the previous entry carries the block signatures of the file
+        return previous_entry is not None and previous_entry[:3] == entry
+
+    def write_tar(self, backup_path, manifest_path, write_pipe, errors):
+        self.delta_files = 0
+        self.reused_bytes = 0
+        super(DeltaBackupEngine, self).write_tar(
+            backup_path, manifest_path, write_pipe, errors)
+        self.stats.update({'files_delta': self.delta_files,
+                           'bytes_reused': self.reused_bytes})
+
+    def signed_blocks(self, reader, signatures):
+        """
+        Splits the content of a file in blocks and appends their
+        signatures to signatures.
+        :type signatures: bytearray
+        :return: digest and data of every block
+        """
+        reads = iter(functools.partial(reader.read, READ_SIZE), b'')
+        for block in self.chunker.split(reads):
+            digest = hashlib.sha256(block).digest()
+            signatures += SIGNATURE.pack(digest, len(block))
+            yield digest, block
+
+    def add_file(self, tar, tarinfo, reader, previous_entry, entry):
+        signatures = bytearray()
+        blocks = self.signed_blocks(reader, signatures)
+        if previous_entry is not None and len(previous_entry) > 3:
+            size = self.add_delta(tar, tarinfo, blocks,
+                                  decode_signatures(previous_entry[3]))
+        else:
+            tar.addfile(tarinfo, BlockReader(block for _, block in blocks))
+            size = tarinfo.size
+        entry.append(encode_signatures(signatures))
+        return size
+
+    def add_delta(self, tar, tarinfo, blocks, previous_blocks):
+        """
+        Adds the delta between a file and its previous version to tar,
+        the delta is spooled in the work dir since tar needs its size
+        before its content.
+        :param previous_blocks: signatures of the previous version
+        :return: size of the delta
+        """
+        with tempfile.TemporaryFile(dir=self.storage.work_dir) as delta:
+            copy_offset = copy_length = 0
+            for digest, block in blocks:
+                previous = previous_blocks.get(digest)
+                if previous is not None and previous[1] == len(block):
+                    self.reused_bytes += len(block)
+                    if copy_length and copy_offset + copy_length == \
+                            previous[0]:
+                        copy_length += len(block)
+                        continue
+                    if copy_length:
+                        delta.write(DELTA_OP.pack(COPY, copy_offset,
+                                                  copy_length))
+                    copy_offset, copy_length = previous
+                    continue
+                if copy_length:
+                    delta.write(DELTA_OP.pack(COPY, copy_offset, copy_length))
+                    copy_length = 0
+                delta.write(DELTA_OP.pack(DATA, 0, len(block)))
+                delta.write(block)
+            if copy_length:
+                delta.write(DELTA_OP.pack(COPY, copy_offset, copy_length))
+            tarinfo.pax_headers[DELTA_KEYWORD] = str(tarinfo.size)
+            tarinfo.size = delta.tell()
+            delta.seek(0)
+            tar.addfile(tarinfo, delta)
+        self.delta_files += 1
+        return tarinfo.size
+
+    def restore_members(self, tar, restore_path):
+        for member in self.safe_members(tar):
+            if DELTA_KEYWORD in member.pax_headers:
+                self.apply_delta(tar, member, restore_path)
+            else:
+                yield member
+
+    @staticmethod
+    def apply_delta(tar, member, restore_path):
+        """
+        Rebuilds the file of member from its previous version in
+        restore_path and the delta stored in member. The file is rebuilt
+        beside the previous version and renamed over it.
+        :type tar: tarfile.TarFile
+        :type member: tarfile.TarInfo
+        """
+        target = os.path.join(restore_path, member.name)
+        if os.path.islink(target) or not os.path.isfile(target):
+            raise ValueError("Cannot restore {0}: its previous level is "
+                             "not restored".format(member.name))
+        size = int(member.pax_headers[DELTA_KEYWORD])
+        delta = tar.extractfile(member)
+        fd, part_path = tempfile.mkstemp(dir=os.path.dirname(target),
+                                         prefix='.freezer_delta_')
+        try:
+            with open(target, 'rb') as previous:
+                with os.fdopen(fd, 'wb') as rebuilt:
+                    while True:
+                        header = delta.read(DELTA_OP.size)
+                        if not header:
+                            break
+                        if len(header) != DELTA_OP.size:
+                            raise ValueError("Truncated delta of {0}".format(
+                                member.name))
+                        op, offset, length = DELTA_OP.unpack(header)
+                        if op == COPY:
+                            previous.seek(offset)
+                            source = previous
+                        elif op == DATA:
+                            source = delta
+                        else:
+                            raise ValueError(
+                                "Unknown delta operation {0} in {1}".format(
+                                    op, member.name))
+                        if copy_bytes(source, rebuilt, length) != length:
+                            raise ValueError(
+                                "Cannot restore {0}: the delta does not "
+                                "match its previous level".format(
+                                    member.name))
+                    if rebuilt.tell() != size:
+                        raise ValueError(
+                            "Cannot restore {0}: expected {1} bytes, got "
+                            "{2}".format(member.name, size, rebuilt.tell()))
+            if hasattr(os, 'geteuid') and os.geteuid() == 0:
+                os.chown(part_path, member.uid, member.gid)
+            os.chmod(part_path, member.mode & 0o777)
+            os.utime(part_path, (member.mtime, member.mtime))
+            os.rename(part_path, target)
+        except Exception:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+
+
+class BlockReader(object):
+    """
+    File-like reader over an iterator of blocks of bytes.
+    """
+
+    def __init__(self, blocks):
+        self.blocks = iter(blocks)
+        self.block = b''
+        self.position = 0
+
+    def read(self, size=-1):
+        data = []
+        while size:
+            if self.position >= len(self.block):
+                self.block = next(self.blocks, b'')
+                self.position = 0
+                if not self.block:
+                    break
+            end = len(self.block) if size < 0 else self.position + size
+            chunk = self.block[self.position:end]
+            self.position += len(chunk)
+            if size > 0:
+                size -= len(chunk)
+            data.append(chunk)
+        return b''.join(data)
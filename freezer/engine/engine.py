@@ -17,16 +17,20 @@ Freezer general utils functions
 """
 
 import abc
+import errno
+import itertools
 import multiprocessing
-from multiprocessing.queues import SimpleQueue
+import os
 import six
 # PyCharm will not recognize queue. Puts red squiggle line under it. That's OK.
 from six.moves import queue
-import time
+import threading
 
 from oslo_log import log
 
 from freezer.engine.exceptions import EngineException
+from freezer.utils import compress
+from freezer.utils import crypt
 from freezer.utils import streaming
 from freezer.utils import utils
 
@@ -58,14 +62,42 @@ class BackupEngine(object):
         1.3) invoke post_backup - now it uploads metadata file
     2) restore backup
         2.1) define all incremental backups
-        2.2) for each incremental backup create a dataflow between
-            storage.read_backup and restore_stream
-            Read_backup is data producer, it reads data chunk by chunk from
-            the specified storage and pushes the chunks into a queue.
-            Restore stream is a consumer, that is actually does restore (for
-            tar it is a thread that creates gnutar subprocess and feeds chunks
-            to stdin of this thread.
+        2.2) a download thread reads the incremental backups one after
+            another from storage.backup_blocks into spools, up to
+            restore_prefetch levels ahead of the level being restored.
+            Spools keep what fits in their memory and write the rest in
+            the work dir, so the download never waits for the restore
+        2.3) for each incremental backup create a dataflow between
+            its spool and restore_level through an OS pipe
+            Read_blocks is data producer, a thread that takes the chunks
+            from the spool and writes them into the pipe.
+            Restore_level is a consumer, that is actually does restore (for
+            tar it is a thread that creates gnutar subprocess reading the
+            pipe as its stdin).
     """
+
+    # Maximum number of bytes buffered between backup_stream and
+    # storage.write_backup, or in memory by the spool of every level being
+    # restored. None limits the buffers to queue_size messages
+    queue_max_bytes = None
+
+    # Number of levels downloaded ahead of the level being restored
+    restore_prefetch = 1
+
+    # Number of threads compressing the backup stream in frames, 0 leaves
+    # the compression to the engine itself
+    compression_workers = 0
+
+    # Passphrase file of the backups encrypted by backup_stream, None
+    # leaves them in clear
+    encrypt_pass_file = None
+
+    # Number of threads encrypting and decrypting the stream
+    encryption_workers = 1
+
+    # Framing of the last backup, recorded in its metadata
+    framing = {}
+
     def backup_stream(self, backup_path, rich_queue, manifest_path):
         """
         :param rich_queue:
@@ -73,7 +105,25 @@ class BackupEngine(object):
         :param manifest_path:
         :return:
         """
-        rich_queue.put_messages(self.backup_data(backup_path, manifest_path))
+        data = self.backup_data(backup_path, manifest_path)
+        framing = {}
+        compressor = None
+        if self.compression_workers:
+            compressor = compress.FrameCompressor(
+                self.compression_algo, self.compression_workers,
+                self.chunk_size)
+            data = compressor.compress(data)
+        if self.encrypt_pass_file:
+            encryptor = crypt.ChunkEncryptor(
+                self.encrypt_pass_file, self.encryption_workers,
+                self.chunk_size)
+            data = encryptor.encrypt(data)
+            framing.update(encryptor.metadata())
+        rich_queue.put_messages(data)
+        # compressor statistics are complete once the stream is consumed
+        if compressor:
+            framing.update(compressor.metadata())
+        self.framing = framing
 
     def backup(self, backup_path, backup, queue_size=2):
         """
@@ -82,7 +132,7 @@ class BackupEngine(object):
         :return: stream
         """
         manifest = backup.storage.download_meta_file(backup)
-        input_queue = streaming.RichQueue(queue_size)
+        input_queue = streaming.RichQueue(queue_size, self.queue_max_bytes)
 
         read_except_queue = queue.Queue()
         write_except_queue = queue.Queue()
@@ -129,6 +179,7 @@ class BackupEngine(object):
             raise EngineException("Engine error. Failed to backup.")
 
         self.post_backup(backup, manifest)
+        backup.storage.add_to_catalog(backup, tar_meta=True)
 
     @abc.abstractmethod
     def post_backup(self, backup, manifest_file):
@@ -138,32 +189,110 @@ class BackupEngine(object):
         """
         pass
 
-    def read_blocks(self, backup, write_pipe, read_pipe, except_queue):
-        # Close the read pipe in this child as it is unneeded
-        # and download the objects from swift in chunks. The
-        # Chunk size is set by RESP_CHUNK_SIZE and sent to che write
-        # pipe
+    @staticmethod
+    def peek(blocks):
+        """
+        :return: the first block, None for an empty stream, and all the
+            blocks
+        """
+        blocks = iter(blocks)
+        first = next(blocks, None)
+        if first is None:
+            return None, iter(())
+        return first, itertools.chain([first], blocks)
 
+    def level_blocks(self, increment):
+        """
+        Blocks of a level as restore_level expects them. Encrypted streams
+        are decrypted on encryption_workers threads, framed streams are
+        decompressed on compression_workers threads (one per cpu by
+        default).
+        :type increment: freezer.storage.base.Backup
+        :return: the keyword arguments of restore_level describing the
+            decoding of the level, and its blocks
+        """
+        decoding = {"framed": False, "decrypted": False}
+        first, blocks = self.peek(
+            increment.storage.backup_blocks(increment))
+        if first is not None and crypt.is_encrypted(first):
+            if not self.encrypt_pass_file:
+                raise Exception("Cannot restore encrypted backup without key")
+            decryptor = crypt.ChunkDecryptor(self.encrypt_pass_file,
+                                             self.encryption_workers)
+            first, blocks = self.peek(decryptor.decrypt(blocks))
+            decoding["decrypted"] = True
+        if first is not None and compress.is_framed(first):
+            workers = self.compression_workers or multiprocessing.cpu_count()
+            blocks = compress.FrameDecompressor(workers).decompress(blocks)
+            decoding["framed"] = True
+        return decoding, blocks
+
+    def download_levels(self, increments, spools, stopped, except_queue):
+        """
+        Downloads the increments in order, every one in its own spool put
+        in spools together with its decoding. The spools keep in memory
+        queue_max_bytes bytes of their level and write the rest to a file
+        of the work dir of the storage, so downloads do not wait for the
+        restore of the levels. spools is bounded, so at most
+        restore_prefetch levels are downloaded ahead of the one being
+        restored.
+        :type increments: list[freezer.storage.base.Backup]
+        :type spools: Queue.Queue
+        :type stopped: threading.Event
+        :type except_queue: Queue.Queue
+        """
+        for increment in increments:
+            spool = streaming.SpooledQueue(increment.storage.work_dir,
+                                           max_bytes=self.queue_max_bytes)
+            try:
+                decoding, blocks = self.level_blocks(increment)
+            except Exception as e:
+                decoding, blocks = {}, None
+                if not stopped.is_set():
+                    LOG.exception(e)
+                    except_queue.put(e)
+                spool.force_stop()
+            spools.put((spool, decoding))
+            if stopped.is_set() or blocks is None:
+                spool.force_stop()
+                return
+            try:
+                spool.put_messages(blocks)
+            except Exception as e:
+                if not stopped.is_set():
+                    LOG.exception(e)
+                    except_queue.put(e)
+                spool.force_stop()
+                return
+
+    def read_blocks(self, spool, write_pipe, except_queue):
+        """
+        Writes the blocks of a level from its spool to the write end
+        of the pipe. The pipe is closed at the end, so the consumer gets
+        EOF as soon as the last block is written.
+        :type spool: freezer.utils.streaming.RichQueue
+        :param write_pipe: write end of the pipe, unbuffered
+        :type except_queue: Queue.Queue
+        """
         try:
-
-            read_pipe.close()
-            for block in backup.storage.backup_blocks(backup):
-                write_pipe.send_bytes(block)
-
-            # Closing the pipe after checking no data
-            # is still available in the pipe.
-            while True:
-                if not write_pipe.poll():
-                    write_pipe.close()
-                    break
-                time.sleep(1)
-
-        except IOError:
-            pass
-
+            for block in spool.get_messages():
+                write_pipe.write(block)
+        except IOError as e:
+            if e.errno != errno.EPIPE:
+                LOG.exception(e)
+                except_queue.put(e)
+                spool.force_stop()
+            else:
+                # the consumer exited before reading everything, its own
+                # exit status tells whether the restore failed. The rest
+                # of the level is drained so the download can go on.
+                for _ in spool.get_messages():
+                    pass
         except Exception as e:
+            LOG.exception(e)
             except_queue.put(e)
-            raise
+        finally:
+            write_pipe.close()
 
     def restore(self, backup, restore_path, overwrite):
         """
@@ -176,63 +305,75 @@ class BackupEngine(object):
                 "Restore dir is not empty. "
                 "Please use --overwrite or provide different path.")
         LOG.info("Creation restore path completed")
-        for level in range(0, backup.level + 1):
-            b = backup.full_backup.increments[level]
-            LOG.info("Restore backup {0}".format(b))
-
-            # Use SimpleQueue because Queue does not work on Mac OS X.
-            read_except_queue = SimpleQueue()
-
-            read_pipe, write_pipe = multiprocessing.Pipe()
-            process_stream = multiprocessing.Process(
-                target=self.read_blocks,
-                args=(b, write_pipe, read_pipe, read_except_queue))
-
-            process_stream.daemon = True
-            process_stream.start()
-            write_pipe.close()
-
-            # Start the tar pipe consumer process
-
-            # Use SimpleQueue because Queue does not work on Mac OS X.
-            write_except_queue = SimpleQueue()
-
-            tar_stream = multiprocessing.Process(
-                target=self.restore_level,
-                args=(restore_path, read_pipe, backup, write_except_queue))
-
-            tar_stream.daemon = True
-            tar_stream.start()
-            read_pipe.close()
-            write_pipe.close()
-            process_stream.join()
-            tar_stream.join()
+        increments = [backup.full_backup.increments[level]
+                      for level in range(0, backup.level + 1)]
+
+        spools = queue.Queue(maxsize=max(self.restore_prefetch, 1))
+        stopped = threading.Event()
+        except_queue = queue.Queue()
+        download_stream = threading.Thread(
+            target=self.download_levels,
+            args=(increments, spools, stopped, except_queue))
+        download_stream.daemon = True
+        download_stream.start()
+
+        spool = None
+        try:
+            for b in increments:
+                spool, decoding = spools.get()
+                LOG.info("Restore backup {0}".format(b))
+
+                read_fd, write_fd = os.pipe()
+                read_pipe = os.fdopen(read_fd, 'rb', 0)
+                write_pipe = os.fdopen(write_fd, 'wb', 0)
+
+                read_stream = threading.Thread(
+                    target=self.read_blocks,
+                    args=(spool, write_pipe, except_queue))
+                tar_stream = threading.Thread(
+                    target=self.restore_level,
+                    args=(restore_path, read_pipe, backup, except_queue),
+                    kwargs=decoding)
+
+                read_stream.daemon = True
+                tar_stream.daemon = True
+                read_stream.start()
+                tar_stream.start()
+                tar_stream.join()
+                read_stream.join()
+                spool.close()
 
-            # SimpleQueue handling is different from queue handling.
-            def handle_except_SimpleQueue(except_queue):
                 if not except_queue.empty():
                     while not except_queue.empty():
-                        e = except_queue.get()
+                        e = except_queue.get_nowait()
                         LOG.exception('Engine error: {0}'.format(e))
-                    return True
-                else:
-                    return False
-
-            got_exception = None
-            got_exception = (handle_except_SimpleQueue(read_except_queue) or
-                             got_exception)
-            got_exception = (handle_except_SimpleQueue(write_except_queue) or
-                             got_exception)
-
-            if tar_stream.exitcode or got_exception:
-                raise EngineException("Engine error. Failed to restore.")
+                    raise EngineException("Engine error. Failed to restore.")
+        finally:
+            # stop the download of levels that will not be restored
+            stopped.set()
+            if spool:
+                spool.force_stop()
+            while not spools.empty():
+                spools.get_nowait()[0].force_stop()
 
         LOG.info(
             'Restore execution successfully executed \
              for backup name {0}'.format(backup))
 
     @abc.abstractmethod
-    def restore_level(self, restore_path, read_pipe, backup, except_queue):
+    def restore_level(self, restore_path, read_pipe, backup, except_queue,
+                      framed=False, decrypted=False):
+        """
+        Restores one level reading its data from read_pipe until EOF.
+        Implementations own read_pipe and must close it, errors are put
+        in except_queue.
+        :param read_pipe: read end of the pipe, unbuffered
+        :type except_queue: Queue.Queue
+        :param framed: the level was a framed stream, its data is already
+            decompressed
+        :param decrypted: the level was encrypted by backup_stream, its
+            data is already decrypted
+        """
         pass
 
     @abc.abstractmethod
@@ -0,0 +1,279 @@
+"""
+(c) Copyright 2016 Hewlett-Packard Enterprise Development Company, L.P.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Freezer hard link tree engine
+"""
+import errno
+import os
+import shutil
+import stat
+
+from oslo_log import log
+
+from freezer.engine.native import native_engine
+from freezer.storage import local
+from freezer.utils import utils
+
+LOG = log.getLogger(__name__)
+
+# directory of the storage where trees are built before they are renamed
+# into place, so an interrupted backup is never listed
+PARTIAL_DIRECTORY = '.partial'
+
+
+def is_root():
+    return hasattr(os, 'geteuid') and os.geteuid() == 0
+
+
+def mtime_ns(path_stat):
+    """
+    :return: modification time of path_stat in nanoseconds, float times
+        of python 2 are rounded to the microseconds of utime
+    :rtype: int
+    """
+    if hasattr(path_stat, 'st_mtime_ns'):
+        return path_stat.st_mtime_ns
+    return int(round(path_stat.st_mtime * 1000000)) * 1000
+
+
+def copy_attributes(from_stat, to_path):
+    if is_root():
+        os.lchown(to_path, from_stat.st_uid, from_stat.st_gid)
+    os.chmod(to_path, stat.S_IMODE(from_stat.st_mode))
+    if hasattr(from_stat, 'st_mtime_ns'):
+        os.utime(to_path, ns=(from_stat.st_atime_ns, from_stat.st_mtime_ns))
+    else:
+        os.utime(to_path, (from_stat.st_atime, from_stat.st_mtime))
+
+
+class HardlinkBackupEngine(native_engine.NativeBackupEngine):
+    """
+    Engine writing every backup as a plain directory tree in a local
+    storage, in place of the backup file of the storage layout. Files
+    unchanged since the most recent tree of the same backup name (same
+    size, mtime, mode and, for root, owner) are hard links to that tree,
+    only the others are copied.
+
+    Every backup is a level 0 with no tar_meta, the trees do not depend
+    on each other: restoring is a copy of one tree, old backups are
+    removed by deleting their directory and the files they share stay
+    in the other trees. Files of a tree must not be modified in place
+    since they are shared. Compression and encryption do not apply, the
+    files are stored as they are.
+    """
+
+    engine_name = 'hardlink'
+
+    def __init__(
+            self, compression_algo, dereference_symlink, exclude, storage,
+            chunk_size, encrypt_pass_file=None, dry_run=False):
+        """
+            :type storage: freezer.storage.local.LocalStorage
+        :return:
+        """
+        if not isinstance(storage, local.LocalStorage):
+            raise ValueError("The hardlink engine requires a local storage")
+        if encrypt_pass_file:
+            raise ValueError("Encryption is not supported by the hardlink "
+                             "engine")
+        super(HardlinkBackupEngine, self).__init__(
+            compression_algo, dereference_symlink, exclude, storage,
+            chunk_size, dry_run=dry_run)
+
+    def previous_tree(self, backup):
+        """
+        :type backup: freezer.storage.base.Backup
+        :return: path of the most recent tree of the backup name older
+            than backup, None if there is none
+        """
+        increments = []
+        for full_backup in self.storage.find_all(backup.hostname_backup_name):
+            increments.extend(full_backup.increments.values())
+        # backups of other engines are files, they are skipped
+        for increment in sorted(increments, key=lambda b: b.timestamp,
+                                reverse=True):
+            if increment.timestamp >= backup.timestamp:
+                continue
+            path = self.storage.backup_to_file_path(increment)
+            if os.path.isdir(path):
+                return path
+        return None
+
+    @staticmethod
+    def linkable(previous_path, path_stat):
+        """
+        :return: True if the file of the previous tree can be linked
+        """
+        try:
+            previous_stat = os.lstat(previous_path)
+        except OSError:
+            return False
+        same_owner = (not is_root() or
+                      (previous_stat.st_uid, previous_stat.st_gid) ==
+                      (path_stat.st_uid, path_stat.st_gid))
+        return (stat.S_ISREG(previous_stat.st_mode) and same_owner and
+                previous_stat.st_mode == path_stat.st_mode and
+                previous_stat.st_size == path_stat.st_size and
+                mtime_ns(previous_stat) == mtime_ns(path_stat))
+
+    def add_to_tree(self, path, path_stat, target, previous_path, stats):
+        """
+        Adds path to the tree as target, files that cannot be read are
+        skipped.
+        """
+        try:
+            if stat.S_ISLNK(path_stat.st_mode):
+                os.symlink(os.readlink(path), target)
+                if is_root():
+                    os.lchown(target, path_stat.st_uid, path_stat.st_gid)
+                return
+            if not stat.S_ISREG(path_stat.st_mode):
+                LOG.warning("Skipping special file {0}".format(path))
+                return
+            if previous_path and self.linkable(previous_path, path_stat):
+                try:
+                    os.link(previous_path, target)
+                    stats['files_linked'] += 1
+                    return
+                except OSError as e:
+                    # too many links to the file of the previous tree
+                    if e.errno != errno.EMLINK:
+                        raise
+            shutil.copyfile(path, target)
+            copy_attributes(path_stat, target)
+            stats['files_copied'] += 1
+            stats['bytes_copied'] += path_stat.st_size
+        except (IOError, OSError) as e:
+            LOG.warning("Cannot read {0}: {1}".format(path, e))
+
+    def write_tree(self, backup_path, tree_path, previous):
+        """
+        Writes the tree of backup_path into tree_path, linking unchanged
+        files to the tree previous.
+        """
+        stats = {'files_linked': 0, 'files_copied': 0, 'bytes_copied': 0}
+        directories = []
+        for path, path_stat in self.walk(backup_path):
+            relative = os.path.normpath(path)
+            target = tree_path
+            if relative != os.curdir:
+                target = os.path.join(tree_path, relative)
+            if stat.S_ISDIR(path_stat.st_mode):
+                if not os.path.isdir(target):
+                    os.mkdir(target)
+                directories.append((path_stat, target))
+                continue
+            previous_path = (os.path.join(previous, relative)
+                             if previous else None)
+            self.add_to_tree(path, path_stat, target, previous_path, stats)
+        # attributes of the directories are set once they are filled
+        for path_stat, target in reversed(directories):
+            copy_attributes(path_stat, target)
+        return stats
+
+    def dry_run_tree(self, backup_path, previous):
+        """
+        Counts the files write_tree would link and copy, without writing.
+        """
+        stats = {'files_linked': 0, 'files_copied': 0, 'bytes_copied': 0}
+        for path, path_stat in self.walk(backup_path):
+            if not stat.S_ISREG(path_stat.st_mode):
+                continue
+            relative = os.path.normpath(path)
+            LOG.info("Dry run: {0}".format(relative))
+            if previous and self.linkable(os.path.join(previous, relative),
+                                          path_stat):
+                stats['files_linked'] += 1
+            else:
+                stats['files_copied'] += 1
+                stats['bytes_copied'] += path_stat.st_size
+        return stats
+
+    def backup(self, backup_path, backup, queue_size=2):
+        """
+        :type backup: freezer.storage.base.Backup
+        """
+        tree_path = self.storage.backup_to_file_path(backup)
+        previous = self.previous_tree(backup)
+        LOG.info("Hardlink engine backup of {0} into {1}, linked to "
+                 "{2}".format(backup_path, tree_path, previous))
+        if self.dry_run:
+            self.stats = self.dry_run_tree(backup_path, previous)
+            return
+        partial_path = utils.path_join(self.storage.storage_directory,
+                                       PARTIAL_DIRECTORY, backup)
+        if os.path.exists(partial_path):
+            shutil.rmtree(partial_path)
+        self.storage.create_dirs(partial_path)
+        self.stats = self.write_tree(backup_path, partial_path, previous)
+        self.storage.create_dirs(os.path.dirname(tree_path))
+        self.storage.rename(partial_path, tree_path)
+        self.post_backup(backup, None)
+        backup.storage.add_to_catalog(backup, tar_meta=False)
+
+    def post_backup(self, backup, manifest):
+        metadata = {"engine": self.engine_name}
+        metadata.update(self.stats)
+        self.storage.upload_freezer_meta_data(backup, metadata)
+
+    def restore(self, backup, restore_path, overwrite):
+        """
+        Copies the tree of backup into restore_path.
+        :type backup: freezer.storage.base.Backup
+        """
+        tree_path = backup.storage.backup_to_file_path(backup)
+        if not os.path.isdir(tree_path):
+            raise Exception("Backup {0} is not a hardlink tree".format(
+                backup))
+        utils.create_dir_tree(restore_path)
+        if not overwrite and not utils.is_empty_dir(restore_path):
+            raise Exception(
+                "Restore dir is not empty. "
+                "Please use --overwrite or provide different path.")
+        directories = []
+        for root, dirs, files in os.walk(tree_path):
+            relative = os.path.relpath(root, tree_path)
+            target_root = os.path.normpath(
+                os.path.join(restore_path, relative))
+            if self.dry_run:
+                for name in files:
+                    LOG.info("Dry run: {0}".format(
+                        os.path.normpath(os.path.join(relative, name))))
+                continue
+            if not os.path.isdir(target_root):
+                os.mkdir(target_root)
+            directories.append((os.lstat(root), target_root))
+            # os.walk lists symbolic links to directories with dirs
+            for name in files + [d for d in dirs
+                                 if os.path.islink(os.path.join(root, d))]:
+                self.restore_file(os.path.join(root, name),
+                                  os.path.join(target_root, name))
+        for path_stat, target in reversed(directories):
+            copy_attributes(path_stat, target)
+        LOG.info("Restore of {0} into {1} completed".format(
+            backup, restore_path))
+
+    @staticmethod
+    def restore_file(path, target):
+        path_stat = os.lstat(path)
+        if os.path.lexists(target) and not os.path.isdir(target):
+            os.remove(target)
+        if stat.S_ISLNK(path_stat.st_mode):
+            os.symlink(os.readlink(path), target)
+            if is_root():
+                os.lchown(target, path_stat.st_uid, path_stat.st_gid)
+            return
+        shutil.copyfile(path, target)
+        copy_attributes(path_stat, target)
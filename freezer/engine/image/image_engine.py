@@ -0,0 +1,345 @@
+"""
+(c) Copyright 2016 Hewlett-Packard Enterprise Development Company, L.P.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Freezer block image engine
+
+An image stream starts with MAGIC and the block size, followed by
+records. Every record is a RECORD_HEADER (type, value, length) followed
+by length bytes:
+
+- NEW_FILE and CHANGED_FILE: value is the size of the file, the data is
+  its path. The blocks that follow belong to it, a new file is emptied
+  before its blocks are written.
+- BLOCK: value is the index of the block, the data is the block.
+- ZERO: value is the index of a block that became all zeros, length is
+  its size and no data follows.
+- DELETED: the data is the path of a file removed since previous level.
+
+The records of a file are emitted once it was read completely, a file
+that cannot be read is left out of the level.
+"""
+import base64
+import functools
+import hashlib
+import io
+import json
+import os
+import stat
+import struct
+import sys
+import tempfile
+
+from oslo_log import log
+
+from freezer.engine.native import native_engine
+from freezer.utils import streaming
+
+LOG = log.getLogger(__name__)
+
+MAGIC = b'FRZIMG\x00\x01'
+STREAM_HEADER = struct.Struct('>I')
+RECORD_HEADER = struct.Struct('>BQI')
+
+NEW_FILE = 1
+CHANGED_FILE = 2
+BLOCK = 3
+ZERO = 4
+DELETED = 5
+
+BLOCK_SIZE = 1024 * 1024
+HASH_SIZE = 32
+MANIFEST_VERSION = 1
+
+FALLOC_FL_KEEP_SIZE = 1
+FALLOC_FL_PUNCH_HOLE = 2
+
+try:
+    import ctypes
+    import ctypes.util
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    _fallocate = _libc.fallocate
+    _fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64,
+                           ctypes.c_int64]
+except (AttributeError, ImportError, OSError, TypeError):
+    _fallocate = None
+
+
+def punch_hole(file_obj, offset, length):
+    """
+    Deallocates length bytes of file_obj at offset, they read as zeros
+    afterwards. Zeros are written where holes are not supported.
+    """
+    file_obj.flush()
+    if _fallocate is not None and sys.platform.startswith('linux'):
+        if not _fallocate(file_obj.fileno(),
+                          FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE,
+                          offset, length):
+            return
+    file_obj.seek(offset)
+    file_obj.write(b'\0' * length)
+
+
+class ImageBackupEngine(native_engine.NativeBackupEngine):
+    """
+    Engine for large image files, like raw or qcow2 disks of virtual
+    machines. Every regular file of the backup path is split in blocks
+    of BLOCK_SIZE bytes and the manifest of every level keeps the sha256
+    of every block. A level stores only the blocks that changed since the
+    previous level, files whose size and mtime did not change are not
+    read at all.
+
+    All-zero blocks are not stored: restore leaves holes where they are
+    and punches holes where a block became all zeros. Levels are applied
+    in order, so every block ends up with its newest copy. The stream is
+    always compressed in frames, blocks that do not compress are stored.
+    Directories, links and special files are not backed up.
+    """
+
+    engine_name = 'image'
+
+    def __init__(
+            self, compression_algo, dereference_symlink, exclude, storage,
+            chunk_size, encrypt_pass_file=None, dry_run=False,
+            queue_max_bytes=None, restore_prefetch=1, compression_workers=0,
+            encryption_workers=1):
+        """
+            :type storage: freezer.storage.base.Storage
+        :return:
+        """
+        super(ImageBackupEngine, self).__init__(
+            compression_algo, dereference_symlink, exclude, storage,
+            chunk_size, encrypt_pass_file=encrypt_pass_file,
+            dry_run=dry_run, queue_max_bytes=queue_max_bytes,
+            restore_prefetch=restore_prefetch,
+            compression_workers=max(compression_workers, 1),
+            encryption_workers=encryption_workers)
+        self.block_size = BLOCK_SIZE
+
+    def read_manifest(self, manifest_path):
+        """
+        :return: path -> [size, mtime, block hashes] of the previous
+            level, empty for a level 0
+        :rtype: dict
+        """
+        if not manifest_path or not os.path.exists(manifest_path):
+            return {}
+        with open(manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+        if (manifest.get('version') != MANIFEST_VERSION or
+                manifest.get('block_size') != self.block_size):
+            raise ValueError("Unsupported image manifest {0}".format(
+                manifest_path))
+        return manifest['files']
+
+    def write_manifest(self, manifest_path, files):
+        with open(manifest_path, 'w') as manifest_file:
+            json.dump({'version': MANIFEST_VERSION,
+                       'block_size': self.block_size,
+                       'files': files}, manifest_file)
+
+    @staticmethod
+    def record(record_type, value, data=b'', length=None):
+        if length is None:
+            length = len(data)
+        return RECORD_HEADER.pack(record_type, value, length) + data
+
+    def file_records(self, path, size, previous_entry, entry, stats):
+        """
+        Yields the records of a file and appends its block hashes to its
+        manifest entry.
+        :param previous_entry: manifest entry of the file in the previous
+            level, None to store the file from scratch
+        :type entry: list
+        :type stats: dict
+        """
+        previous_hashes = b''
+        if previous_entry is None:
+            record_type = NEW_FILE
+        else:
+            record_type = CHANGED_FILE
+            previous_hashes = base64.b64decode(previous_entry[2])
+        hashes = bytearray()
+        yield self.record(record_type, size, path.encode('utf-8'))
+        with io.open(path, 'rb') as image:
+            reader = native_engine.PaddedReader(image, size)
+            index = 0
+            while True:
+                data = reader.read(self.block_size)
+                if not data:
+                    break
+                digest = hashlib.sha256(data).digest()
+                hashes += digest
+                offset = index * HASH_SIZE
+                previous = previous_hashes[offset:offset + HASH_SIZE]
+                if digest == previous:
+                    stats['blocks_unchanged'] += 1
+                elif data.count(b'\0') == len(data):
+                    stats['blocks_zero'] += 1
+                    # past the previous end of the file, zeros are holes
+                    if previous:
+                        yield self.record(ZERO, index, length=len(data))
+                else:
+                    stats['blocks_changed'] += 1
+                    stats['bytes'] += len(data)
+                    yield self.record(BLOCK, index, data)
+                index += 1
+        entry.append(base64.b64encode(bytes(hashes)).decode('ascii'))
+
+    def records(self, backup_path, manifest_path):
+        previous = self.read_manifest(manifest_path)
+        current = {}
+        stats = {'files_changed': 0, 'files_unchanged': 0,
+                 'files_deleted': 0, 'blocks_changed': 0,
+                 'blocks_unchanged': 0, 'blocks_zero': 0, 'bytes': 0}
+        yield MAGIC + STREAM_HEADER.pack(self.block_size)
+        for path, path_stat in self.walk(backup_path):
+            if not stat.S_ISREG(path_stat.st_mode):
+                if not stat.S_ISDIR(path_stat.st_mode):
+                    LOG.warning("Skipping {0}, not a regular file".format(
+                        path))
+                continue
+            entry = [path_stat.st_size, path_stat.st_mtime]
+            previous_entry = previous.get(path)
+            if previous_entry is not None and previous_entry[:2] == entry:
+                current[path] = previous_entry
+                stats['files_unchanged'] += 1
+                continue
+            # records are spooled until the file is read completely, a
+            # read error does not leave part of the file in the level
+            spool = tempfile.SpooledTemporaryFile(
+                max_size=self.chunk_size, dir=self.storage.work_dir)
+            try:
+                file_stats = dict.fromkeys(stats, 0)
+                try:
+                    for record in self.file_records(
+                            path, path_stat.st_size, previous_entry, entry,
+                            file_stats):
+                        spool.write(record)
+                except (IOError, OSError) as e:
+                    # the previous entry is kept, the file is stored again
+                    # by the next level
+                    LOG.warning("Cannot read {0}: {1}".format(path, e))
+                    if previous_entry is not None:
+                        current[path] = previous_entry
+                    continue
+                spool.seek(0)
+                for data in iter(functools.partial(spool.read,
+                                                   self.block_size), b''):
+                    yield data
+            finally:
+                spool.close()
+            for key, value in file_stats.items():
+                stats[key] += value
+            current[path] = entry
+            stats['files_changed'] += 1
+        for path in sorted(set(previous) - set(current)):
+            stats['files_deleted'] += 1
+            yield self.record(DELETED, 0, path.encode('utf-8'))
+        self.write_manifest(manifest_path, current)
+        self.stats = stats
+
+    def backup_data(self, backup_path, manifest_path):
+        LOG.info("Image engine backup stream enter")
+        return streaming.join_blocks(
+            self.records(backup_path, manifest_path), self.chunk_size)
+
+    def restore_level(self, restore_path, read_pipe, backup, except_queue,
+                      framed=False, decrypted=False):
+        """
+        Writes the blocks of one level into the files of restore_path.
+        """
+        try:
+            self.apply_records(restore_path, io.open(read_pipe.fileno(), 'rb',
+                                                     closefd=False))
+        except Exception as e:
+            LOG.exception(e)
+            except_queue.put(e)
+            raise
+        finally:
+            read_pipe.close()
+
+    @staticmethod
+    def restore_target(restore_path, data):
+        path = data.decode('utf-8')
+        if path.startswith('/') or '..' in path.split('/'):
+            raise ValueError("Unsafe path {0}".format(path))
+        return os.path.join(restore_path, path)
+
+    def apply_records(self, restore_path, stream):
+        """
+        Applies the records read from stream to the files of
+        restore_path.
+        """
+        if stream.read(len(MAGIC)) != MAGIC:
+            raise ValueError("Not an image stream")
+        block_size, = STREAM_HEADER.unpack(stream.read(STREAM_HEADER.size))
+        image = None
+        try:
+            while True:
+                header = stream.read(RECORD_HEADER.size)
+                if not header:
+                    break
+                if len(header) != RECORD_HEADER.size:
+                    raise ValueError("Truncated image stream")
+                record_type, value, length = RECORD_HEADER.unpack(header)
+                data = b''
+                if record_type != ZERO:
+                    data = stream.read(length)
+                    if len(data) != length:
+                        raise ValueError("Truncated image stream")
+                if record_type in (NEW_FILE, CHANGED_FILE):
+                    if image:
+                        image.close()
+                        image = None
+                    target = self.restore_target(restore_path, data)
+                    if self.dry_run:
+                        LOG.info("Dry run: {0}".format(target))
+                        continue
+                    image = self.open_image(target, value,
+                                            record_type == NEW_FILE)
+                elif record_type == BLOCK:
+                    if image:
+                        image.seek(value * block_size)
+                        image.write(data)
+                elif record_type == ZERO:
+                    if image:
+                        punch_hole(image, value * block_size, length)
+                elif record_type == DELETED:
+                    target = self.restore_target(restore_path, data)
+                    if not self.dry_run and os.path.isfile(target):
+                        os.remove(target)
+                else:
+                    raise ValueError("Unknown image record {0}".format(
+                        record_type))
+        finally:
+            if image:
+                image.close()
+
+    @staticmethod
+    def open_image(target, size, new):
+        """
+        :param new: the file is stored from scratch, its previous content
+            is dropped
+        :return: target opened for writing, with size bytes
+        """
+        directory = os.path.dirname(target)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        if new or not os.path.exists(target):
+            image = io.open(target, 'wb')
+        else:
+            image = io.open(target, 'r+b')
+        image.truncate(size)
+        return image
@@ -0,0 +1,372 @@
+"""
+(c) Copyright 2016 Hewlett-Packard Enterprise Development Company, L.P.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Freezer native tar engine
+"""
+import json
+import os
+import shutil
+import stat
+import tarfile
+import threading
+
+from oslo_log import log
+
+from freezer.engine import engine
+from freezer.utils import streaming
+from freezer.utils import utils
+
+LOG = log.getLogger(__name__)
+
+COMPRESSION_MODES = {
+    'gzip': 'gz',
+    'bzip2': 'bz2',
+    'xz': 'xz',
+}
+
+# pax global header keyword listing the paths removed since previous level
+DELETED_KEYWORD = 'FREEZER.deleted'
+
+MANIFEST_VERSION = 1
+
+
+class NativeBackupEngine(engine.BackupEngine):
+    """
+    Backup engine built on the tarfile module instead of a gnutar
+    subprocess.
+
+    Incremental backups rely on a manifest of its own, uploaded as the
+    tar_meta of every level: a json document mapping every path to its
+    size, mtime and inode. Files whose entry did not change
+    since the previous level are skipped, the paths that disappeared are
+    listed in a pax global header of the stream and removed on restore.
+    Hard links are always stored as regular files, so every level can be
+    extracted on its own.
+    """
+
+    engine_name = 'native'
+
+    def __init__(
+            self, compression_algo, dereference_symlink, exclude, storage,
+            chunk_size, encrypt_pass_file=None, dry_run=False,
+            queue_max_bytes=None, restore_prefetch=1, compression_workers=0,
+            encryption_workers=1):
+        """
+            :type storage: freezer.storage.base.Storage
+        :return:
+        """
+        if compression_algo not in COMPRESSION_MODES:
+            raise ValueError("Unknown compression algorithm {0}".format(
+                compression_algo))
+        self.compression_algo = compression_algo
+        self.encrypt_pass_file = encrypt_pass_file
+        self.dereference_symlink = dereference_symlink
+        self.exclude = exclude
+        self.storage = storage
+        self.dry_run = dry_run
+        self.chunk_size = chunk_size
+        self.queue_max_bytes = queue_max_bytes
+        self.restore_prefetch = restore_prefetch
+        self.compression_workers = compression_workers
+        self.encryption_workers = encryption_workers
+        self.buffer_pool = streaming.BufferPool(chunk_size)
+        self.stats = {}
+
+    @property
+    def follow_symlinks(self):
+        return self.dereference_symlink in ('soft', 'all')
+
+    def post_backup(self, backup, manifest):
+        self.storage.upload_meta_file(backup, manifest)
+        metadata = {
+            "engine": self.engine_name,
+            "compression": self.compression_algo,
+            "encryption": bool(self.encrypt_pass_file)
+        }
+        metadata.update(self.stats)
+        metadata.update(self.framing)
+
+        self.storage.upload_freezer_meta_data(backup, metadata)
+
+    @staticmethod
+    def read_manifest(manifest_path):
+        """
+        :return: path -> manifest entry of the previous level, empty for
+            a level 0
+        :rtype: dict
+        """
+        if not manifest_path or not os.path.exists(manifest_path):
+            return {}
+        with open(manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest.get('version') != MANIFEST_VERSION:
+            raise ValueError("Unsupported manifest {0}".format(manifest_path))
+        return manifest['files']
+
+    @staticmethod
+    def write_manifest(manifest_path, files):
+        with open(manifest_path, 'w') as manifest_file:
+            json.dump({'version': MANIFEST_VERSION, 'files': files},
+                      manifest_file)
+
+    def walk(self, backup_path):
+        """
+        Yields path and stat of everything to back up, without leaving
+        the file system of backup_path.
+        """
+        stat_func = os.stat if self.follow_symlinks else os.lstat
+        root_stat = stat_func(backup_path)
+        yield backup_path, root_stat
+        if not stat.S_ISDIR(root_stat.st_mode):
+            return
+        for root, dirs, files in os.walk(backup_path, topdown=True,
+                                         followlinks=self.follow_symlinks):
+            traverse = []
+            for name in sorted(dirs):
+                path = os.path.join(root, name)
+                if self.exclude and utils.exclude_path(path, self.exclude):
+                    continue
+                path_stat = stat_func(path)
+                yield path, path_stat
+                if (stat.S_ISDIR(path_stat.st_mode) and
+                        path_stat.st_dev == root_stat.st_dev):
+                    traverse.append(name)
+            dirs[:] = traverse
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                if self.exclude and utils.exclude_path(path, self.exclude):
+                    continue
+                try:
+                    yield path, stat_func(path)
+                except OSError as e:
+                    LOG.warning("Cannot stat {0}: {1}".format(path, e))
+
+    def backup_data(self, backup_path, manifest_path):
+        LOG.info("Native engine backup stream enter")
+        read_fd, write_fd = os.pipe()
+        read_pipe = os.fdopen(read_fd, 'rb')
+        write_pipe = os.fdopen(write_fd, 'wb')
+        errors = []
+        tar_stream = threading.Thread(
+            target=self.write_tar,
+            args=(backup_path, manifest_path, write_pipe, errors))
+        tar_stream.daemon = True
+        tar_stream.start()
+        try:
+            tar_chunk = self.buffer_pool.acquire()
+            while tar_chunk.readinto(read_pipe):
+                yield tar_chunk
+                tar_chunk = self.buffer_pool.acquire()
+            tar_chunk.release()
+        finally:
+            read_pipe.close()
+            tar_stream.join()
+        if errors:
+            raise errors[0]
+
+        LOG.info("Native engine streaming end")
+
+    def tar_mode(self):
+        # framed backups are compressed by backup_stream
+        if self.compression_workers:
+            return 'w|'
+        return 'w|' + COMPRESSION_MODES[self.compression_algo]
+
+    def write_tar(self, backup_path, manifest_path, write_pipe, errors):
+        """
+        Writes the tar stream of backup_path into write_pipe and the new
+        manifest into manifest_path.
+        :type errors: list
+        """
+        try:
+            previous = self.read_manifest(manifest_path)
+            current = {}
+            changed = []
+            for path, path_stat in self.walk(backup_path):
+                current[path] = self.manifest_entry(path_stat)
+                # directories are always stored, their headers are cheap
+                if (not stat.S_ISDIR(path_stat.st_mode) and
+                        self.unchanged(previous.get(path), current[path])):
+                    current[path] = previous[path]
+                    continue
+                changed.append(path)
+            deleted = sorted(set(previous) - set(current))
+
+            stats = {'files_changed': 0, 'files_unchanged': 0,
+                     'files_deleted': len(deleted), 'bytes': 0}
+            tar = tarfile.open(
+                fileobj=write_pipe, mode=self.tar_mode(),
+                format=tarfile.PAX_FORMAT,
+                dereference=self.follow_symlinks,
+                pax_headers={DELETED_KEYWORD: json.dumps(deleted)})
+            stats['files_unchanged'] = len(current) - len(changed)
+            try:
+                for path in changed:
+                    size = self.add(tar, path, previous.get(path),
+                                    current[path])
+                    if size is None:
+                        # the manifest keeps the version restored by the
+                        # previous levels, the next level adds the file
+                        if path in previous:
+                            current[path] = previous[path]
+                        else:
+                            del current[path]
+                        continue
+                    stats['files_changed'] += 1
+                    stats['bytes'] += size
+            finally:
+                tar.close()
+            self.write_manifest(manifest_path, current)
+            self.stats = stats
+        except Exception as e:
+            LOG.exception(e)
+            errors.append(e)
+        finally:
+            write_pipe.close()
+
+    @staticmethod
+    def manifest_entry(path_stat):
+        """
+        :return: the manifest entry of a path, [size, mtime, inode]
+        :rtype: list
+        """
+        return [path_stat.st_size, path_stat.st_mtime, path_stat.st_ino]
+
+    @staticmethod
+    def unchanged(previous_entry, entry):
+        """
+        :param previous_entry: entry of the path in the previous manifest,
+            None if the path is new
+        :return: True if the path can be skipped
+        """
+        return previous_entry == entry
+
+    def add(self, tar, path, previous_entry=None, entry=None):
+        """
+        Adds path to tar, files that cannot be read are skipped.
+        :type tar: tarfile.TarFile
+        :param previous_entry: entry of path in the previous manifest
+        :param entry: entry of path in the new manifest
+        :return: number of bytes added, None if path was skipped
+        """
+        try:
+            tarinfo = tar.gettarinfo(path)
+            if tarinfo is None:
+                # sockets and other unsupported file types
+                return None
+            if tarinfo.islnk():
+                tarinfo.type = tarfile.REGTYPE
+                tarinfo.linkname = ''
+                tarinfo.size = os.stat(path).st_size
+            if not tarinfo.isreg():
+                tar.addfile(tarinfo)
+                return 0
+            with open(path, 'rb') as file_obj:
+                return self.add_file(tar, tarinfo,
+                                     PaddedReader(file_obj, tarinfo.size),
+                                     previous_entry, entry)
+        except (IOError, OSError) as e:
+            LOG.warning("Cannot read {0}: {1}".format(path, e))
+            return None
+
+    @staticmethod
+    def add_file(tar, tarinfo, reader, previous_entry, entry):
+        """
+        Adds the content of a regular file to tar.
+        :type tarinfo: tarfile.TarInfo
+        :type reader: PaddedReader
+        :return: number of bytes added
+        """
+        tar.addfile(tarinfo, reader)
+        return tarinfo.size
+
+    def restore_level(self, restore_path, read_pipe, backup, except_queue,
+                      framed=False, decrypted=False):
+        """
+        Extracts one level into restore_path and removes the paths that
+        were deleted since the previous level.
+        """
+        try:
+            with tarfile.open(fileobj=read_pipe, mode='r|*') as tar:
+                if self.dry_run:
+                    for member in tar:
+                        LOG.info("Dry run: {0}".format(member.name))
+                    return
+                kwargs = {}
+                if hasattr(tarfile, 'tar_filter'):
+                    kwargs['filter'] = 'tar'
+                tar.extractall(restore_path,
+                               members=self.restore_members(tar,
+                                                            restore_path),
+                               **kwargs)
+                deleted = json.loads(
+                    tar.pax_headers.get(DELETED_KEYWORD, '[]'))
+            self.remove_deleted(restore_path, deleted)
+
+        except Exception as e:
+            LOG.exception(e)
+            except_queue.put(e)
+            raise
+        finally:
+            read_pipe.close()
+
+    def restore_members(self, tar, restore_path):
+        """
+        :return: the members of tar extracted into restore_path
+        """
+        return self.safe_members(tar)
+
+    @staticmethod
+    def safe_members(tar):
+        for member in tar:
+            parts = member.name.split('/')
+            if member.name.startswith('/') or '..' in parts:
+                LOG.warning("Skipping unsafe path {0}".format(member.name))
+                continue
+            yield member
+
+    @staticmethod
+    def remove_deleted(restore_path, deleted):
+        # children are removed before their parent directories
+        for path in sorted(deleted, reverse=True):
+            if path.startswith('/') or '..' in path.split('/'):
+                continue
+            full_path = os.path.join(restore_path, path)
+            if os.path.isdir(full_path) and not os.path.islink(full_path):
+                shutil.rmtree(full_path, ignore_errors=True)
+            elif os.path.lexists(full_path):
+                os.remove(full_path)
+
+
+class PaddedReader(object):
+    """
+    Reads exactly size bytes from file_obj, padding with zeros if the
+    file shrinks while it is read, like gnutar does.
+    """
+
+    def __init__(self, file_obj, size):
+        self.file_obj = file_obj
+        self.remaining = size
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file_obj.read(size)
+        if len(data) < size:
+            LOG.warning("File {0} shrank while being read".format(
+                getattr(self.file_obj, 'name', '')))
+            data += b'\0' * (size - len(data))
+        self.remaining -= size
+        return data
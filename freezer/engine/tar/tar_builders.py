@@ -156,6 +156,9 @@ class TarCommandRestoreBuilder(object):
 
 
 def get_tar_flag_from_algo(compression):
+    # streams without compression, or compressed outside of gnutar
+    if not compression:
+        return ''
     algo = {
         'gzip': '-z',
         'bzip2': '-j',
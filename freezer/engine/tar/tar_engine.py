@@ -15,13 +15,13 @@ limitations under the License.
 
 Freezer general utils functions
 """
-import os
 import subprocess
 
 from oslo_log import log
 
 from freezer.engine import engine
 from freezer.engine.tar import tar_builders
+from freezer.utils import streaming
 from freezer.utils import winutils
 
 LOG = log.getLogger(__name__)
@@ -31,7 +31,9 @@ class TarBackupEngine(engine.BackupEngine):
 
     def __init__(
             self, compression_algo, dereference_symlink, exclude, storage,
-            is_windows, chunk_size, encrypt_pass_file=None, dry_run=False):
+            is_windows, chunk_size, encrypt_pass_file=None, dry_run=False,
+            queue_max_bytes=None, restore_prefetch=1, compression_workers=0,
+            encryption_workers=1):
         """
             :type storage: freezer.storage.base.Storage
         :return:
@@ -44,6 +46,11 @@ class TarBackupEngine(engine.BackupEngine):
         self.is_windows = is_windows
         self.dry_run = dry_run
         self.chunk_size = chunk_size
+        self.queue_max_bytes = queue_max_bytes
+        self.restore_prefetch = restore_prefetch
+        self.compression_workers = compression_workers
+        self.encryption_workers = encryption_workers
+        self.buffer_pool = streaming.BufferPool(chunk_size)
 
     def post_backup(self, backup, manifest):
         self.storage.upload_meta_file(backup, manifest)
@@ -52,15 +59,18 @@ class TarBackupEngine(engine.BackupEngine):
             "compression": self.compression_algo,
             "encryption": self.encrypt_pass_file is not None
         }
+        metadata.update(self.framing)
 
         self.storage.upload_freezer_meta_data(backup, metadata)
 
     def backup_data(self, backup_path, manifest_path):
         LOG.info("Tar engine backup stream enter")
+        # framed backups are compressed by backup_stream
         tar_command = tar_builders.TarCommandBuilder(
-            backup_path, self.compression_algo, self.is_windows)
-        if self.encrypt_pass_file:
-            tar_command.set_encryption(self.encrypt_pass_file)
+            backup_path,
+            None if self.compression_workers else self.compression_algo,
+            self.is_windows)
+        # the stream is encrypted by backup_stream
         if self.dereference_symlink:
             tar_command.set_dereference(self.dereference_symlink)
         tar_command.set_exclude(self.exclude)
@@ -73,16 +83,20 @@ class TarBackupEngine(engine.BackupEngine):
         tar_process = subprocess.Popen(command, stdout=subprocess.PIPE,
                                        stderr=subprocess.PIPE, shell=True)
         read_pipe = tar_process.stdout
-        tar_chunk = read_pipe.read(self.chunk_size)
-        while tar_chunk:
+        # segments are read into recycled buffers, storages release them
+        # once they are written
+        tar_chunk = self.buffer_pool.acquire()
+        while tar_chunk.readinto(read_pipe):
             yield tar_chunk
-            tar_chunk = read_pipe.read(self.chunk_size)
+            tar_chunk = self.buffer_pool.acquire()
+        tar_chunk.release()
 
         self.check_process_output(tar_process, 'Backup')
 
         LOG.info("Tar engine streaming end")
 
-    def restore_level(self, restore_path, read_pipe, backup, except_queue):
+    def restore_level(self, restore_path, read_pipe, backup, except_queue,
+                      framed=False, decrypted=False):
         """
         Restore the provided file into backup_opt_dict.restore_abs_path
         Decrypt the file if backup_opt_dict.encrypt_pass_file key is provided
@@ -95,12 +109,14 @@ class TarBackupEngine(engine.BackupEngine):
                     metadata.get("encryption", False)):
                 raise Exception("Cannot restore encrypted backup without key")
 
+            compression_algo = None if framed else metadata.get(
+                'compression', self.compression_algo)
             tar_command = tar_builders.TarCommandRestoreBuilder(
-                restore_path,
-                metadata.get('compression', self.compression_algo),
-                self.is_windows)
+                restore_path, compression_algo, self.is_windows)
 
-            if self.encrypt_pass_file:
+            # backups made before the in process encryption were
+            # encrypted by openssl
+            if self.encrypt_pass_file and not decrypted:
                 tar_command.set_encryption(self.encrypt_pass_file)
 
             if self.dry_run:
@@ -108,29 +124,25 @@ class TarBackupEngine(engine.BackupEngine):
 
             command = tar_command.build()
 
-            if winutils.is_windows():
-                # on windows, chdir to restore path.
-                os.chdir(restore_path)
+            # on windows, tar runs in the restore path.
+            cwd = restore_path if winutils.is_windows() else None
 
+            # tar reads the pipe filled by read_blocks directly as its
+            # std input, our copy of the read end is closed right away
+            # so the writer gets EPIPE if tar exits early.
             tar_process = subprocess.Popen(
-                command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE, shell=True)
-            # Start loop reading the pipe and pass the data to the tar
-            # std input. If EOFError exception is raised, the loop end
-            # the std err will be checked for errors.
-            try:
-                while True:
-                    tar_process.stdin.write(read_pipe.recv_bytes())
-            except EOFError:
-                LOG.info('Pipe closed as EOF reached. '
-                         'Data transmitted successfully')
-            finally:
-                self.check_process_output(tar_process, 'Restore')
+                command, stdin=read_pipe, stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE, shell=True, cwd=cwd,
+                close_fds=not winutils.is_windows())
+            read_pipe.close()
+            self.check_process_output(tar_process, 'Restore')
 
         except Exception as e:
             LOG.exception(e)
             except_queue.put(e)
             raise
+        finally:
+            read_pipe.close()
 
     @staticmethod
     def check_process_output(process, function):
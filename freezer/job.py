@@ -22,6 +22,7 @@ import six
 import sys
 import time
 
+from freezer.engine.dedup import dedup_engine
 from freezer.openstack import backup
 from freezer.openstack import restore
 from freezer.snapshot import snapshot
@@ -120,6 +121,7 @@ class BackupJob(Job):
                   ]
         for field_name in fields:
             metadata[field_name] = self.conf.__dict__.get(field_name, '') or ''
+        metadata.update(self.storage.retry_stats())
         return metadata
 
     def backup(self, app_mode):
@@ -253,6 +255,24 @@ class ConsistencyCheckException(Exception):
 class AdminJob(Job):
 
     def execute_method(self):
+        stats = {}
+        if self.conf.remove_orphans:
+            stats.update(self.storage.remove_orphans(
+                int(self.conf.orphans_grace_period), self.conf.dry_run))
+
+        if (self.conf.remove_from_date or
+                self.conf.remove_older_than is not None or
+                not (self.conf.remove_orphans or self.conf.collect_chunks)):
+            self.remove_older_than()
+
+        # last, the chunks of the backups just removed are collected too
+        if self.conf.collect_chunks:
+            stats.update(dedup_engine.collect_chunks(
+                self.storage, int(self.conf.orphans_grace_period),
+                self.conf.dry_run))
+        return stats
+
+    def remove_older_than(self):
         if self.conf.remove_from_date:
             timestamp = utils.date_to_timestamp(self.conf.remove_from_date)
         else:
@@ -262,7 +282,6 @@ class AdminJob(Job):
 
         self.storage.remove_older_than(timestamp,
                                        self.conf.hostname_backup_name)
-        return {}
 
 
 class ExecJob(Job):
@@ -25,14 +25,21 @@ from oslo_config import cfg
 from oslo_log import log
 
 from freezer.common import config as freezer_config
+from freezer.engine.dedup import dedup_engine
+from freezer.engine.delta import delta_engine
+from freezer.engine.hardlink import hardlink_engine
+from freezer.engine.image import image_engine
+from freezer.engine.native import native_engine
 from freezer.engine.tar import tar_engine
 from freezer import job
 from freezer.openstack import osclients
+from freezer.storage import catalog
 from freezer.storage import local
 from freezer.storage import multiple
 from freezer.storage import ssh
 from freezer.storage import swift
 from freezer.utils import config
+from freezer.utils import streaming
 from freezer.utils import utils
 from freezer.utils import validator
 from freezer.utils import winutils
@@ -69,20 +76,77 @@ def freezer_main(backup_args):
         storage = multiple.MultipleStorage(
             work_dir,
             [storage_from_dict(x, work_dir, max_segment_size)
-             for x in backup_args.storages])
+             for x in backup_args.storages],
+            backup_args.queue_max_bytes)
     else:
         storage = storage_from_dict(backup_args.__dict__, work_dir,
                                     max_segment_size)
 
-    backup_args.engine = tar_engine.TarBackupEngine(
-        backup_args.compression,
-        backup_args.dereference_symlink,
-        backup_args.exclude,
-        storage,
-        winutils.is_windows(),
-        backup_args.max_segment_size,
-        backup_args.encrypt_pass_file,
-        backup_args.dry_run)
+    # engines stream messages of at most MAX_MESSAGE_SIZE bytes, the
+    # storage joins them in segments of max_segment_size bytes
+    chunk_size = min(max_segment_size, streaming.MAX_MESSAGE_SIZE)
+
+    catalog_ttl = int(backup_args.catalog_ttl or 0)
+    if catalog_ttl:
+        utils.create_dir(work_dir)
+        storage.set_catalog(catalog.Catalog(
+            os.path.join(work_dir, catalog.CATALOG_FILE), catalog_ttl))
+
+    if backup_args.engine_name == 'dedup':
+        backup_args.engine = dedup_engine.DedupBackupEngine(
+            backup_args.compression,
+            backup_args.dereference_symlink,
+            backup_args.exclude,
+            storage,
+            chunk_size,
+            backup_args.encrypt_pass_file,
+            backup_args.dry_run,
+            backup_args.queue_max_bytes,
+            backup_args.restore_prefetch,
+            int(backup_args.upload_workers),
+            int(backup_args.download_workers))
+    elif backup_args.engine_name == 'hardlink':
+        backup_args.engine = hardlink_engine.HardlinkBackupEngine(
+            backup_args.compression,
+            backup_args.dereference_symlink,
+            backup_args.exclude,
+            storage,
+            chunk_size,
+            backup_args.encrypt_pass_file,
+            backup_args.dry_run)
+    elif backup_args.engine_name in ('native', 'delta', 'image'):
+        if backup_args.engine_name == 'delta':
+            engine_class = delta_engine.DeltaBackupEngine
+        elif backup_args.engine_name == 'image':
+            engine_class = image_engine.ImageBackupEngine
+        else:
+            engine_class = native_engine.NativeBackupEngine
+        backup_args.engine = engine_class(
+            backup_args.compression,
+            backup_args.dereference_symlink,
+            backup_args.exclude,
+            storage,
+            chunk_size,
+            backup_args.encrypt_pass_file,
+            backup_args.dry_run,
+            backup_args.queue_max_bytes,
+            backup_args.restore_prefetch,
+            backup_args.compression_workers,
+            backup_args.encryption_workers)
+    else:
+        backup_args.engine = tar_engine.TarBackupEngine(
+            backup_args.compression,
+            backup_args.dereference_symlink,
+            backup_args.exclude,
+            storage,
+            winutils.is_windows(),
+            chunk_size,
+            backup_args.encrypt_pass_file,
+            backup_args.dry_run,
+            backup_args.queue_max_bytes,
+            backup_args.restore_prefetch,
+            backup_args.compression_workers,
+            backup_args.encryption_workers)
 
     if hasattr(backup_args, 'trickle_command'):
         if "tricklecount" in os.environ:
@@ -175,7 +239,11 @@ def storage_from_dict(backup_args, work_dir, max_segment_size):
         client_manager = backup_args['client_manager']
 
         storage = swift.SwiftStorage(
-            client_manager, container, work_dir, max_segment_size)
+            client_manager, container, work_dir, max_segment_size,
+            upload_workers=int(backup_args.get('upload_workers', 1)),
+            download_workers=int(backup_args.get('download_workers', 1)),
+            use_index=bool(backup_args.get('swift_index', False)),
+            use_slo=bool(backup_args.get('swift_slo', False)))
     elif storage_name == "local":
         storage = local.LocalStorage(container, work_dir)
     elif storage_name == "ssh":
@@ -104,9 +104,18 @@ class OSClientManager(object):
         return self.cinder
 
     def create_swift(self):
+        """
+        Creates the shared swift connection of this client manager
+        :return: swiftclient instance
+        """
+        self.swift = self.new_swift()
+        return self.swift
+
+    def new_swift(self):
         """
         Swift client needs to be treated differently so we need to copy the
         arguments and provide it to swiftclient the correct way !
+        The connection is not shared, so it can be used by a worker thread.
         :return: swiftclient instance
         """
         os_options = {}
@@ -114,16 +123,16 @@ class OSClientManager(object):
         if 'region_name' in self.swift_args.keys():
             os_options['region_name'] = self.swift_args.get('region_name')
         if 'endpoint_type' in self.swift_args.keys():
-            os_options['endpoint_type'] = self.swift_args.pop('endpoint_type')
+            os_options['endpoint_type'] = self.swift_args.get('endpoint_type')
         if 'tenant_id' in self.swift_args.keys():
-            os_options['tenant_id'] = self.swift_args.pop('tenant_id')
+            os_options['tenant_id'] = self.swift_args.get('tenant_id')
         if 'identity_api_version' in self.swift_args.keys():
             os_options['identity_api_version'] = \
-                self.swift_args.pop('identity_api_version')
+                self.swift_args.get('identity_api_version')
             auth_version = os_options['identity_api_version']
 
         if 'token' in self.swift_args.keys():
-            os_options['auth_token'] = self.swift_args.pop('token')
+            os_options['auth_token'] = self.swift_args.get('token')
         if 'auth_version' in self.swift_args.keys():
             auth_version = self.swift_args.get('auth_version')
         os_options['project_domain_name'] = \
@@ -137,7 +146,7 @@ class OSClientManager(object):
 
         tenant_name = self.swift_args.get('project_name') or self.swift_args.\
             get('tenant_name')
-        self.swift = swiftclient.client.Connection(
+        swift = swiftclient.client.Connection(
             authurl=self.swift_args.get('auth_url'),
             user=self.swift_args.get('username'),
             key=self.swift_args.get('password'),
@@ -149,8 +158,8 @@ class OSClientManager(object):
         )
 
         if self.dry_run:
-            self.swift = DryRunSwiftclientConnectionWrapper(self.swift)
-        return self.swift
+            swift = DryRunSwiftclientConnectionWrapper(swift)
+        return swift
 
     def get_nova(self):
         """
@@ -14,12 +14,16 @@
 
 
 import abc
+import json
 import os
 import re
+import shutil
 import six
 
 from oslo_log import log
 
+from freezer.storage import retry
+from freezer.utils import compress
 from freezer.utils import utils
 
 LOG = log.getLogger(__name__)
@@ -32,11 +36,30 @@ class Storage(object):
     class.
     """
 
+    # directory of the work dir caching the tar_meta of recent backups
+    META_CACHE_DIRECTORY = 'tar_meta_cache'
+
     def __init__(self, work_dir, skip_prepare=False):
         self.work_dir = work_dir
+        self.catalog = None
+        self.retry_policy = retry.RetryPolicy()
         if not skip_prepare:
             self.prepare()
 
+    def retry_stats(self):
+        """
+        :return: retries of the operations of the storage and seconds
+            spent retrying them
+        :rtype: dict
+        """
+        return self.retry_policy.stats()
+
+    def set_catalog(self, catalog):
+        """
+        :type catalog: freezer.storage.catalog.Catalog
+        """
+        self.catalog = catalog
+
     def download_meta_file(self, backup):
         """
         Downloads meta_data to work_dir of previous backup.
@@ -48,17 +71,143 @@ class Storage(object):
         """
         utils.create_dir(self.work_dir)
         if backup.level == 0:
-            return utils.path_join(self.work_dir, backup.tar())
+            # a level 0 starts without snapshot, a resumed backup would
+            # otherwise find the one of its interrupted run
+            to_path = utils.path_join(self.work_dir, backup.tar())
+            if os.path.exists(to_path):
+                os.remove(to_path)
+            return to_path
         meta_backup = backup.full_backup.increments[backup.level - 1]
         if not meta_backup.tar_meta:
             raise ValueError('Latest update have no tar_meta')
         to_path = utils.path_join(self.work_dir, meta_backup.tar())
         if os.path.exists(to_path):
             os.remove(to_path)
-        meta_backup.storage.get_file(
-            meta_backup.storage.meta_file_abs_path(meta_backup), to_path)
+        if meta_backup.storage.get_cached_meta_file(meta_backup, to_path):
+            LOG.info('Using the cached tar meta data file {0}'.format(
+                meta_backup.tar()))
+            return to_path
+        download_path = '{0}.download'.format(to_path)
+        if os.path.exists(download_path):
+            os.remove(download_path)
+        try:
+            meta_backup.storage.get_file(
+                meta_backup.storage.meta_file_abs_path(meta_backup),
+                download_path)
+            compress.gunzip_file(download_path, to_path)
+        finally:
+            if os.path.exists(download_path):
+                os.remove(download_path)
+        # the engine rewrites to_path, the cache needs its own copy
+        meta_backup.storage.cache_meta_file(meta_backup, to_path, link=False)
         return to_path
 
+    def compress_meta_file(self, meta_file):
+        """
+        :return: path of the compressed copy of meta_file, it is removed
+            by the caller once uploaded
+        """
+        compressed_path = '{0}.gz'.format(meta_file)
+        compress.gzip_file(meta_file, compressed_path)
+        return compressed_path
+
+    def meta_file_signature(self, backup):
+        """
+        :type backup: freezer.storage.base.Backup
+        :return: identifier of the version of the tar_meta of backup in
+            the storage, like its size or its etag, None if the storage
+            cannot tell and the tar_meta must not be cached
+        """
+        return None
+
+    def meta_cache_path(self, backup):
+        return utils.path_join(self.work_dir, self.META_CACHE_DIRECTORY,
+                               backup.tar())
+
+    def get_cached_meta_file(self, backup, to_path):
+        """
+        Copies the cached tar_meta of backup to to_path, if the storage
+        still has the same version of it.
+        :type backup: freezer.storage.base.Backup
+        :return: False if the tar_meta must be downloaded
+        """
+        cache_path = self.meta_cache_path(backup)
+        try:
+            if not os.path.exists(cache_path):
+                return False
+            with open('{0}.json'.format(cache_path)) as signature_file:
+                cached = json.load(signature_file)['signature']
+            signature = self.meta_file_signature(backup)
+            if signature is None or cached != signature:
+                LOG.info('Cached tar meta data file {0} is stale'.format(
+                    backup.tar()))
+                return False
+            shutil.copyfile(cache_path, to_path)
+            return True
+        except Exception as e:
+            LOG.warning('Cannot read the cached tar meta data file '
+                        '{0}: {1}'.format(backup.tar(), e))
+            return False
+
+    def cache_meta_file(self, backup, meta_file, link=True):
+        """
+        Keeps a copy of the tar_meta of backup in the work dir, the cached
+        tar_meta of older backups with the same name are removed.
+        :type backup: freezer.storage.base.Backup
+        :param link: hard link meta_file instead of copying it, it must
+            not be modified in place afterwards. Uploaded meta files are
+            not: the next backups remove them before writing their own.
+        """
+        try:
+            signature = self.meta_file_signature(backup)
+            if signature is None:
+                return
+            cache_path = self.meta_cache_path(backup)
+            cache_dir = os.path.dirname(cache_path)
+            utils.create_dir(cache_dir)
+            self.remove_cached_meta_files(backup, cache_dir)
+            part_path = '{0}.part'.format(cache_path)
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            linked = False
+            if link and hasattr(os, 'link'):
+                try:
+                    os.link(meta_file, part_path)
+                    linked = True
+                except OSError:
+                    pass
+            if not linked:
+                shutil.copyfile(meta_file, part_path)
+            with open('{0}.json'.format(cache_path), 'w') as signature_file:
+                json.dump({'signature': signature}, signature_file)
+            if os.path.exists(cache_path):
+                os.remove(cache_path)
+            os.rename(part_path, cache_path)
+        except Exception as e:
+            LOG.warning('Cannot cache the tar meta data file {0}: '
+                        '{1}'.format(backup.tar(), e))
+
+    @staticmethod
+    def remove_cached_meta_files(backup, cache_dir):
+        """
+        Removes the cached tar_meta of the backups with the same name as
+        backup older than its level 0.
+        """
+        prefix = 'tar_metadata_'
+        for name in os.listdir(cache_dir):
+            if not name.startswith(prefix) or name.endswith('.json'):
+                continue
+            try:
+                cached = Backup._parse(name[len(prefix):])
+            except ValueError:
+                continue
+            if (cached.hostname_backup_name == backup.hostname_backup_name
+                    and cached.timestamp < backup.full_backup.timestamp):
+                cache_path = os.path.join(cache_dir, name)
+                os.remove(cache_path)
+                if os.path.exists('{0}.json'.format(cache_path)):
+                    os.remove('{0}.json'.format(cache_path))
+
     @abc.abstractmethod
     def meta_file_abs_path(self, backup):
         pass
@@ -112,6 +261,95 @@ class Storage(object):
         """
         pass
 
+    @abc.abstractmethod
+    def put_chunk(self, name, data):
+        """
+        Stores data in the content addressed area of the storage, shared
+        by all the backups
+        :param name: content address of data
+        :type name: str
+        :type data: bytes
+        """
+        pass
+
+    @abc.abstractmethod
+    def get_chunk(self, name):
+        """
+        :param name: content address of the chunk
+        :type name: str
+        :rtype: bytes
+        """
+        pass
+
+    @abc.abstractmethod
+    def list_chunks(self):
+        """
+        :return: names of all the chunks in the storage
+        :rtype: set[str]
+        """
+        pass
+
+    @abc.abstractmethod
+    def chunk_times(self):
+        """
+        :return: modification time of every chunk of the storage, in
+            seconds since the epoch
+        :rtype: dict[str, float]
+        """
+        pass
+
+    @abc.abstractmethod
+    def remove_chunks(self, names):
+        """
+        Removes chunks from the content addressed area of the storage
+        :type names: list[str]
+        """
+        pass
+
+    @abc.abstractmethod
+    def list_all_backups(self):
+        """
+        Lists the backups of all the backup names of the storage
+        :rtype: list[freezer.storage.base.Backup]
+        :return: list of zero level backups
+        """
+        pass
+
+    def backup_head(self, backup, size):
+        """
+        :return: the first size bytes of the stream of backup, storages
+            able to read part of an object override it
+        :rtype: bytes
+        """
+        head = b''
+        blocks = self.backup_blocks(backup)
+        try:
+            for block in blocks:
+                head += bytes(block)
+                if len(head) >= size:
+                    break
+        finally:
+            if hasattr(blocks, 'close'):
+                blocks.close()
+        return head[:size]
+
+    @abc.abstractmethod
+    def location(self):
+        """
+        :return: location of the storage, unique across storages, keys
+            its backups in the catalog
+        :rtype: str
+        """
+        pass
+
+    @abc.abstractmethod
+    def chunks_location(self):
+        """
+        :return: location of the chunks, unique across storages
+        :rtype: str
+        """
+        pass
+
     def find_one(self, hostname_backup_name, recent_to_date=None):
         """
         :param hostname_backup_name:
@@ -136,17 +374,58 @@ class Storage(object):
                                if x.timestamp <= recent_to_date]
         return max(last_increments, key=lambda x: x.timestamp)
 
-    @abc.abstractmethod
     def find_all(self, hostname_backup_name):
         """
-        Gets backups by backup_name and hostname
+        Gets backups by backup_name and hostname, from the catalog when
+        it has a recent listing of them
         :param hostname_backup_name:
         :type hostname_backup_name: str
         :rtype: list[freezer.storage.base.Backup]
         :return: List of matched backups
         """
+        if self.catalog is None:
+            return self.list_backups(hostname_backup_name)
+        location = self.location()
+        rows = self.catalog.backups(location, hostname_backup_name)
+        if rows is not None:
+            return Backup.from_catalog(hostname_backup_name, rows, self)
+        backups = self.list_backups(hostname_backup_name)
+        self.catalog.reconcile(location, hostname_backup_name,
+                               Backup.to_catalog(backups))
+        return backups
+
+    @abc.abstractmethod
+    def list_backups(self, hostname_backup_name):
+        """
+        Lists the backups of backup_name and hostname in the storage
+        :type hostname_backup_name: str
+        :rtype: list[freezer.storage.base.Backup]
+        :return: List of matched backups
+        """
         pass
 
+    def add_to_catalog(self, backup, tar_meta):
+        """
+        Records a completed backup in the catalog.
+        :type backup: freezer.storage.base.Backup
+        :param tar_meta: the tar_meta of backup was uploaded
+        """
+        if self.catalog is not None:
+            self.catalog.add(self.location(),
+                             backup.hostname_backup_name, backup.timestamp,
+                             backup.level, tar_meta)
+
+    def remove_from_catalog(self, backup):
+        """
+        :param backup: level 0 of the removed backups
+        :type backup: freezer.storage.base.Backup
+        """
+        if self.catalog is not None:
+            self.catalog.remove(
+                self.location(), backup.hostname_backup_name,
+                [backup.timestamp] +
+                [i.timestamp for i in backup.increments.values()])
+
     @abc.abstractmethod
     def remove_backup(self, backup):
         """
@@ -165,8 +444,37 @@ class Storage(object):
         backups = self.find_all(hostname_backup_name)
         backups = [b for b in backups
                    if b.latest_update.timestamp < remove_older_timestamp]
+        # the backups of a storage are removed together
+        by_storage = {}
         for b in backups:
-            b.storage.remove_backup(b)
+            by_storage.setdefault(b.storage, []).append(b)
+        for storage, storage_backups in by_storage.items():
+            storage.remove_backups(storage_backups)
+            for b in storage_backups:
+                storage.remove_from_catalog(b)
+
+    def remove_backups(self, backups):
+        """
+        Removes several backups, storages able to remove them at once
+        override it
+        :type backups: list[freezer.storage.base.Backup]
+        """
+        for backup in backups:
+            self.remove_backup(backup)
+
+    def remove_orphans(self, grace_period, dry_run=False):
+        """
+        Removes the data left by backups that failed before they were
+        completed, storages keeping such data override it
+        :param grace_period: seconds after which the data of an unfinished
+            backup is considered orphaned
+        :type grace_period: int
+        :param dry_run: only report what would be removed
+        :return: statistics of the removal
+        :rtype: dict
+        """
+        LOG.info('No orphans to remove in this storage')
+        return {}
 
     @abc.abstractmethod
     def info(self):
@@ -236,6 +544,12 @@ class Backup(object):
             http://www.gnu.org/software/tar/manual/html_node/Incremental-Dumps.html
     """
     PATTERN = r'(.*)_(\d+)_(\d+?)$'
+    _PATTERN = re.compile(PATTERN, re.I)
+
+    # backups are listed by the hundred thousand in shared containers
+    __slots__ = ('hostname_backup_name', '_timestamp', 'tar_meta',
+                 '_increments', '_latest_update', '_level', 'storage',
+                 '_full_backup')
 
     def __init__(self, storage, hostname_backup_name, timestamp, level=0,
                  full_backup=None, tar_meta=False):
@@ -259,7 +573,8 @@ class Backup(object):
         self.hostname_backup_name = hostname_backup_name
         self._timestamp = timestamp
         self.tar_meta = tar_meta
-        self._increments = {0: self}
+        # only level 0 backups hold their increments
+        self._increments = {0: self} if level == 0 else None
         self._latest_update = self
         self._level = level
         self.storage = storage
@@ -282,6 +597,8 @@ class Backup(object):
 
     @property
     def increments(self):
+        if self._increments is None:
+            return {0: self}
         return self._increments
 
     @property
@@ -322,48 +639,92 @@ class Backup(object):
     @staticmethod
     def parse_backups(names, storage):
         """
-        :param names:
-        :type names: list[str] - file names of backups.
+        :param names: file names of backups, iterated once, names are not
+            kept
+        :type names: collections.Iterable[str]
         :type storage: freezer.storage.base.Storage
         File name should be something like that host_backup_timestamp_level
         :rtype: list[freezer.storage.base.Backup]
         :return: list of zero level backups
         """
         prefix = 'tar_metadata_'
-        tar_names = set([x[len(prefix):]
-                         for x in names if x.startswith(prefix)])
-        backup_names = [x for x in names if not x.startswith(prefix)]
-        backups = []
-        """:type: list[freezer.storage.base.BackupRepr]"""
-        for name in backup_names:
-            try:
-                backup = Backup._parse(name)
-                backup.tar_meta = name in tar_names
-                backups.append(backup)
-            except Exception as e:
-                LOG.exception(e)
-                LOG.error("cannot parse backup name: {0}".format(name))
-        backups.sort(
-            key=lambda x: (x.hostname_backup_name, x.timestamp, x.level))
+        stored, with_tar_meta = 1, 2
+        # (hostname_backup_name, timestamp, level) -> flags
+        found = {}
+        hostname_backup_names = {}
+        for name in names:
+            tar_meta = name.startswith(prefix)
+            match = Backup._PATTERN.match(name,
+                                          len(prefix) if tar_meta else 0)
+            if not match:
+                if not tar_meta:
+                    LOG.error("cannot parse backup name: {0}".format(name))
+                continue
+            # one string per backup name, shared by all its backups
+            hostname_backup_name = hostname_backup_names.setdefault(
+                match.group(1), match.group(1))
+            key = (hostname_backup_name, int(match.group(2)),
+                   int(match.group(3)))
+            found[key] = found.get(key, 0) | (
+                with_tar_meta if tar_meta else stored)
+
         zero_backups = []
         """:type: list[freezer.storage.base.Backup]"""
         last_backup = None
-
         """:type last_backup: freezer.storage.base.Backup"""
-        for backup in backups:
-            if backup.level == 0:
-                last_backup = backup.backup(storage)
+        # listings are mostly sorted already, sorting them is close to
+        # linear
+        for key in sorted(found):
+            flags = found.pop(key)
+            if not flags & stored:
+                continue
+            hostname_backup_name, timestamp, level = key
+            tar_meta = bool(flags & with_tar_meta)
+            if level == 0:
+                last_backup = Backup(storage, hostname_backup_name,
+                                     timestamp, tar_meta=tar_meta)
                 zero_backups.append(last_backup)
+            elif (last_backup and last_backup.hostname_backup_name ==
+                    hostname_backup_name):
+                last_backup.add_increment(Backup(
+                    storage, hostname_backup_name, timestamp, level=level,
+                    full_backup=last_backup, tar_meta=tar_meta))
             else:
-                if last_backup:
-                    last_backup.add_increment(backup.backup(storage,
-                                                            last_backup))
-                else:
-                    LOG.error("Incremental backup without parent: {0}"
-                              .format(backup))
-
+                LOG.error("Incremental backup without parent: {0}_{1}_{2}"
+                          .format(hostname_backup_name, timestamp, level))
         return zero_backups
 
+    @staticmethod
+    def to_catalog(backups):
+        """
+        :type backups: list[freezer.storage.base.Backup]
+        :return: timestamp, level and tar_meta of backups and of all their
+            increments
+        :rtype: list[(int, int, bool)]
+        """
+        return [(increment.timestamp, increment.level, increment.tar_meta)
+                for backup in backups
+                for increment in backup.increments.values()]
+
+    @staticmethod
+    def from_catalog(hostname_backup_name, rows, storage):
+        """
+        :param rows: timestamp, level and tar_meta of the backups of
+            hostname_backup_name
+        :type rows: list[(int, int, bool)]
+        :type storage: freezer.storage.base.Storage
+        :rtype: list[freezer.storage.base.Backup]
+        :return: list of zero level backups
+        """
+        def names():
+            for timestamp, level, tar_meta in rows:
+                name = '{0}_{1}_{2}'.format(hostname_backup_name, timestamp,
+                                            level)
+                yield name
+                if tar_meta:
+                    yield 'tar_metadata_{0}'.format(name)
+        return Backup.parse_backups(names(), storage)
+
     @staticmethod
     def _parse(value):
         """
@@ -371,7 +732,7 @@ class Backup(object):
         :type value: str
         :return:
         """
-        match = re.search(Backup.PATTERN, value, re.I)
+        match = Backup._PATTERN.search(value)
         if not match:
             raise ValueError("Cannot parse backup from string: " + value)
         return BackupRepr(match.group(1), int(match.group(2)),
@@ -394,6 +755,9 @@ class BackupRepr(object):
     Difference between Backup and BackupRepr - backupRepr can be parsed from
     str and doesn't require information about full_backup
     """
+
+    __slots__ = ('hostname_backup_name', 'timestamp', 'level', 'tar_meta')
+
     def __init__(self, hostname_backup_name, timestamp, level, tar_meta=False):
         """
 
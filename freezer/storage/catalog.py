@@ -0,0 +1,158 @@
+"""
+(c) Copyright 2016 Hewlett-Packard Enterprise Development Company, L.P.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import contextlib
+import sqlite3
+import time
+
+from oslo_log import log
+
+LOG = log.getLogger(__name__)
+
+CATALOG_FILE = 'catalog.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS backups (
+    location TEXT NOT NULL,
+    name TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    level INTEGER NOT NULL,
+    tar_meta INTEGER NOT NULL,
+    PRIMARY KEY (location, name, timestamp, level)
+);
+CREATE TABLE IF NOT EXISTS listings (
+    location TEXT NOT NULL,
+    name TEXT NOT NULL,
+    listed_at REAL NOT NULL,
+    PRIMARY KEY (location, name)
+);
+"""
+
+
+class Catalog(object):
+    """
+    Local sqlite catalog of the backups of storages, kept in the work dir
+    and shared by all the storages of the agent, rows are keyed by the
+    location of their storage.
+
+    The backups of a backup name are read from the catalog while the
+    last listing of the name in its storage is more recent than ttl
+    seconds, the name is listed again otherwise and the catalog
+    reconciled with the listing. Backups and removals done by the agent
+    update the catalog as they complete, those of other agents are seen
+    at the next listing.
+    """
+
+    def __init__(self, path, ttl):
+        """
+        :param path: sqlite database of the catalog, created if missing
+        :param ttl: seconds a listing of a backup name is trusted
+        :type ttl: int
+        """
+        self.path = path
+        self.ttl = ttl
+        with self.connect() as connection:
+            connection.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def connect(self):
+        """
+        Connection committed on success, storages of a multiple storage
+        use the catalog from their own threads.
+        """
+        connection = sqlite3.connect(self.path, timeout=60)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def backups(self, location, name):
+        """
+        :return: timestamp, level and tar_meta of every backup of name,
+            None if the catalog must be reconciled with the storage
+        :rtype: list[(int, int, bool)]
+        """
+        with self.connect() as connection:
+            listed = connection.execute(
+                'SELECT listed_at FROM listings '
+                'WHERE location = ? AND name = ?', (location, name)).fetchone()
+            if listed is None or time.time() - listed[0] > self.ttl:
+                return None
+            rows = connection.execute(
+                'SELECT timestamp, level, tar_meta FROM backups '
+                'WHERE location = ? AND name = ? ORDER BY timestamp, level',
+                (location, name)).fetchall()
+        return [(timestamp, level, bool(tar_meta))
+                for timestamp, level, tar_meta in rows]
+
+    def backup_names(self, location):
+        """
+        :return: names of all the backups of the storage at location
+        :rtype: set[str]
+        """
+        with self.connect() as connection:
+            return set(
+                '{0}_{1}_{2}'.format(name, timestamp, level)
+                for name, timestamp, level in connection.execute(
+                    'SELECT name, timestamp, level FROM backups '
+                    'WHERE location = ?', (location,)))
+
+    def reconcile(self, location, name, backups):
+        """
+        Replaces the backups of name with those listed in the storage.
+        :param backups: timestamp, level and tar_meta of every backup
+        :type backups: list[(int, int, bool)]
+        """
+        listed = set((timestamp, level, bool(tar_meta))
+                     for timestamp, level, tar_meta in backups)
+        with self.connect() as connection:
+            known = set(
+                (timestamp, level, bool(tar_meta))
+                for timestamp, level, tar_meta in connection.execute(
+                    'SELECT timestamp, level, tar_meta FROM backups '
+                    'WHERE location = ? AND name = ?', (location, name)))
+            connection.executemany(
+                'DELETE FROM backups WHERE location = ? AND name = ? '
+                'AND timestamp = ? AND level = ?',
+                [(location, name, timestamp, level)
+                 for timestamp, level, _ in known - listed])
+            connection.executemany(
+                'INSERT OR REPLACE INTO backups VALUES (?, ?, ?, ?, ?)',
+                [(location, name, timestamp, level, int(tar_meta))
+                 for timestamp, level, tar_meta in listed - known])
+            connection.execute(
+                'INSERT OR REPLACE INTO listings VALUES (?, ?, ?)',
+                (location, name, time.time()))
+        LOG.info('Catalog of {0} reconciled: {1} backups added, {2} '
+                 'removed'.format(name, len(listed - known),
+                                  len(known - listed)))
+
+    def add(self, location, name, timestamp, level, tar_meta):
+        with self.connect() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO backups VALUES (?, ?, ?, ?, ?)',
+                (location, name, timestamp, level, int(tar_meta)))
+
+    def remove(self, location, name, timestamps):
+        """
+        Removes the backups of name taken at timestamps, all their levels.
+        :type timestamps: list[int]
+        """
+        with self.connect() as connection:
+            connection.executemany(
+                'DELETE FROM backups WHERE location = ? AND name = ? '
+                'AND timestamp = ?',
+                [(location, name, timestamp) for timestamp in timestamps])
@@ -13,11 +13,14 @@
 # limitations under the License.
 
 import abc
+import os
 import six
+import stat
 
 from oslo_log import log
 
 from freezer.storage import base
+from freezer.utils import streaming
 from freezer.utils import utils
 
 LOG = log.getLogger(__name__)
@@ -26,6 +29,7 @@ LOG = log.getLogger(__name__)
 @six.add_metaclass(abc.ABCMeta)
 class FsLikeStorage(base.Storage):
     DEFAULT_CHUNK_SIZE = 10000000
+    CHUNKS_DIRECTORY = 'chunks'
 
     def __init__(self, storage_directory, work_dir,
                  chunk_size=DEFAULT_CHUNK_SIZE, skip_prepare=False):
@@ -73,9 +77,18 @@ class FsLikeStorage(base.Storage):
         """
         zero_backup = self._zero_backup_dir(backup)
         to_path = utils.path_join(zero_backup, backup.tar())
-        self.put_file(meta_file, to_path)
-
-    def find_all(self, hostname_backup_name):
+        compressed_path = self.compress_meta_file(meta_file)
+        try:
+            self.put_file(compressed_path, to_path)
+        finally:
+            os.remove(compressed_path)
+        self.cache_meta_file(backup, meta_file)
+
+    def meta_file_signature(self, backup):
+        file_stat = self.stat(self.meta_file_abs_path(backup))
+        return [file_stat.st_size, file_stat.st_mtime]
+
+    def list_backups(self, hostname_backup_name):
         backups = []
         backup_dir = utils.path_join(self.storage_directory,
                                      hostname_backup_name)
@@ -106,7 +119,8 @@ class FsLikeStorage(base.Storage):
 
         with self.open(filename, mode='wb') as b_file:
             for message in rich_queue.get_messages():
-                b_file.write(message)
+                b_file.write(streaming.message_view(message))
+                streaming.release(message)
 
     def backup_blocks(self, backup):
         """
@@ -119,19 +133,101 @@ class FsLikeStorage(base.Storage):
         with self.open(filename, 'rb') as backup_file:
             while True:
                 chunk = backup_file.read(self.chunk_size)
-                if chunk == '':
+                if not chunk:
                     break
-                if len(chunk):
-                    yield chunk
+                yield chunk
+
+    def backup_head(self, backup, size):
+        # the hardlink engine stores trees, not streams
+        if stat.S_ISDIR(self.stat(self.backup_to_file_path(backup)).st_mode):
+            return b''
+        return super(FsLikeStorage, self).backup_head(backup, size)
+
+    def chunk_path(self, name):
+        """
+        Chunks are spread in directories named after the first two
+        characters of their name
+        """
+        return utils.path_join(self.storage_directory, self.CHUNKS_DIRECTORY,
+                               name[:2], name)
+
+    def put_chunk(self, name, data):
+        path = self.chunk_path(name)
+        self.create_dirs(os.path.dirname(path))
+        # a chunk appears under its name only once it is complete
+        part_path = '{0}.part'.format(path)
+        with self.open(part_path, mode='wb') as chunk_file:
+            chunk_file.write(data)
+        self.rename(part_path, path)
+
+    def get_chunk(self, name):
+        with self.open(self.chunk_path(name), 'rb') as chunk_file:
+            return chunk_file.read()
+
+    def list_chunks(self):
+        chunks_dir = utils.path_join(self.storage_directory,
+                                     self.CHUNKS_DIRECTORY)
+        self.create_dirs(chunks_dir)
+        names = set()
+        for prefix in self.listdir(chunks_dir):
+            names.update(
+                name for name in
+                self.listdir(utils.path_join(chunks_dir, prefix))
+                if not name.endswith('.part'))
+        return names
+
+    def chunk_times(self):
+        chunks_dir = utils.path_join(self.storage_directory,
+                                     self.CHUNKS_DIRECTORY)
+        self.create_dirs(chunks_dir)
+        times = {}
+        for prefix in self.listdir(chunks_dir):
+            for name in self.listdir(utils.path_join(chunks_dir, prefix)):
+                if not name.endswith('.part'):
+                    times[name] = self.stat(self.chunk_path(name)).st_mtime
+        return times
+
+    def remove_chunks(self, names):
+        for name in names:
+            self.remove(self.chunk_path(name))
+
+    def list_all_backups(self):
+        backups = []
+        for name in sorted(self.listdir(self.storage_directory)):
+            # chunks and the partial trees of the hardlink engine
+            if name == self.CHUNKS_DIRECTORY or name.startswith('.'):
+                continue
+            backups.extend(self.list_backups(name))
+        return backups
+
+    def location(self):
+        return self.storage_directory
+
+    def chunks_location(self):
+        return utils.path_join(self.storage_directory, self.CHUNKS_DIRECTORY)
 
     @abc.abstractmethod
     def listdir(self, directory):
         pass
 
+    @abc.abstractmethod
+    def rename(self, from_path, to_path):
+        """
+        Renames from_path, replacing to_path if it exists
+        """
+        pass
+
     @abc.abstractmethod
     def put_file(self, from_path, to_path):
         pass
 
+    @abc.abstractmethod
+    def stat(self, path):
+        """
+        :return: the status of path, with st_size and st_mtime at least
+        """
+        pass
+
     @abc.abstractmethod
     def create_dirs(self, path):
         pass
@@ -140,6 +236,13 @@ class FsLikeStorage(base.Storage):
     def rmtree(self, path):
         pass
 
+    @abc.abstractmethod
+    def remove(self, path):
+        """
+        Removes the file path
+        """
+        pass
+
     @abc.abstractmethod
     def open(self, filename, mode):
         pass
@@ -34,14 +34,23 @@ class LocalStorage(fslike.FsLikeStorage):
     def put_file(self, from_path, to_path):
         shutil.copyfile(from_path, to_path)
 
+    def stat(self, path):
+        return os.stat(path)
+
     def listdir(self, directory):
         return os.listdir(directory)
 
+    def rename(self, from_path, to_path):
+        os.rename(from_path, to_path)
+
     def create_dirs(self, path):
         utils.create_dir_tree(path)
 
     def rmtree(self, path):
         shutil.rmtree(path)
 
+    def remove(self, path):
+        os.remove(path)
+
     def open(self, filename, mode):
         return io.open(filename, mode)
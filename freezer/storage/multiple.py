@@ -37,7 +37,8 @@ class MultipleStorage(base.Storage):
             s.info()
 
     def write_backup(self, rich_queue, backup):
-        output_queues = [streaming.RichQueue() for x in self.storages]
+        output_queues = [streaming.RichQueue(max_bytes=self.queue_max_bytes)
+                         for x in self.storages]
         except_queues = [queue.Queue() for x in self.storages]
         threads = ([streaming.QueuedThread(storage.write_backup, output_queue,
                     except_queue, kwargs={"backup": backup}) for
@@ -70,11 +71,35 @@ class MultipleStorage(base.Storage):
         if (got_exception):
             raise StorageException("Storage error. Failed to backup.")
 
-    def find_all(self, hostname_backup_name):
+    def list_backups(self, hostname_backup_name):
         backups = [b.find_all(hostname_backup_name) for b in self.storages]
         # flat the list
         return [item for sublist in backups for item in sublist]
 
+    def remove_orphans(self, grace_period, dry_run=False):
+        stats = {}
+        for storage in self.storages:
+            for key, value in storage.remove_orphans(grace_period,
+                                                     dry_run).items():
+                stats[key] = stats.get(key, 0) + value
+        return stats
+
+    def retry_stats(self):
+        stats = {}
+        for storage in self.storages:
+            for key, value in storage.retry_stats().items():
+                stats[key] = stats.get(key, 0) + value
+        return stats
+
+    def set_catalog(self, catalog):
+        # every storage keeps its own backups in the catalog
+        for storage in self.storages:
+            storage.set_catalog(catalog)
+
+    def add_to_catalog(self, backup, tar_meta):
+        for storage in self.storages:
+            storage.add_to_catalog(backup, tar_meta)
+
     def prepare(self):
         pass
 
@@ -82,14 +107,52 @@ class MultipleStorage(base.Storage):
         for storage in self.storages:
             storage.upload_meta_file(backup, meta_file)
 
-    def __init__(self, work_dir, storages):
+    def put_chunk(self, name, data):
+        for storage in self.storages:
+            storage.put_chunk(name, data)
+
+    def get_chunk(self, name):
+        return self.storages[0].get_chunk(name)
+
+    def list_chunks(self):
+        # a chunk is known only once every storage has it
+        return set.intersection(*[storage.list_chunks()
+                                  for storage in self.storages])
+
+    def chunk_times(self):
+        # a chunk is known only once every storage has it, with its
+        # most recent time
+        times = [storage.chunk_times() for storage in self.storages]
+        names = set.intersection(*[set(t) for t in times])
+        return dict((name, max(t[name] for t in times)) for name in names)
+
+    def remove_chunks(self, names):
+        for storage in self.storages:
+            storage.remove_chunks(names)
+
+    def list_all_backups(self):
+        return [backup for storage in self.storages
+                for backup in storage.list_all_backups()]
+
+    def location(self):
+        return ','.join(storage.location() for storage in self.storages)
+
+    def chunks_location(self):
+        return ','.join(storage.chunks_location()
+                        for storage in self.storages)
+
+    def __init__(self, work_dir, storages, queue_max_bytes=None):
         """
         :param storages:
         :type storages: list[freezer.storage.base.Storage]
+        :param queue_max_bytes: maximum number of bytes buffered for
+            every storage
+        :type queue_max_bytes: int
         :return:
         """
         super(MultipleStorage, self).__init__(work_dir)
         self.storages = storages
+        self.queue_max_bytes = queue_max_bytes
 
     def download_freezer_meta_data(self, backup):
         # TODO(DEKLAN): Need to implement.
@@ -129,9 +192,12 @@ class StorageManager(object):
                     if finish:
                         output_queue.finish()
                     else:
+                        streaming.retain(message)
                         output_queue.put(message)
                 except Exception as e:
                     LOG.exception(e)
+                    if not finish:
+                        streaming.release(message)
                     StorageManager.one_fails_all_fail(
                         self.input_queue, self.output_queues)
                     self.broken_output_queues.add(output_queue)
@@ -139,6 +205,7 @@ class StorageManager(object):
     def transmit(self):
         for message in self.input_queue.get_messages():
             self.send_message(message)
+            streaming.release(message)
         self.send_message("", True)
 
     @staticmethod
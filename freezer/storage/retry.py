@@ -0,0 +1,205 @@
+"""
+(c) Copyright 2016 Hewlett-Packard Enterprise Development Company, L.P.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import random
+import socket
+import threading
+import time
+
+from oslo_log import log
+import requests.exceptions
+from six.moves import http_client
+
+from freezer.storage.exceptions import StorageException
+
+LOG = log.getLogger(__name__)
+
+# http statuses of requests worth sending again
+TRANSIENT_STATUSES = frozenset([408, 429, 500, 502, 503, 504])
+
+TRANSIENT_ERRORS = (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout,
+                    http_client.HTTPException,
+                    socket.timeout)
+
+
+class CircuitOpen(StorageException):
+    pass
+
+
+class CircuitBreaker(object):
+    """
+    Fails the calls to an endpoint without sending them once threshold
+    consecutive attempts failed, for reset_timeout seconds. A single call
+    is then let through, the others still fail until it completes: the
+    circuit closes if it succeeds and opens again otherwise.
+    """
+
+    def __init__(self, endpoint, threshold, reset_timeout):
+        self.endpoint = endpoint
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        # a call is probing the endpoint of the half open circuit
+        self.probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if (self.probing or
+                    time.time() - self.opened_at < self.reset_timeout):
+                raise CircuitOpen(
+                    'Circuit open for {0} after {1} failures'.format(
+                        self.endpoint, self.failures))
+            # half open, this call probes the endpoint
+            self.probing = True
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.probing:
+                LOG.error('Probe of {0} failed, the circuit stays '
+                          'open'.format(self.endpoint))
+                self.probing = False
+                self.opened_at = time.time()
+            elif self.failures >= self.threshold and self.opened_at is None:
+                LOG.error('Opening the circuit of {0} after {1} '
+                          'failures'.format(self.endpoint, self.failures))
+                self.opened_at = time.time()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def circuit_breaker(endpoint, threshold, reset_timeout):
+    """
+    :return: the circuit breaker shared by all the calls to endpoint
+    :rtype: CircuitBreaker
+    """
+    with _breakers_lock:
+        if endpoint not in _breakers:
+            _breakers[endpoint] = CircuitBreaker(endpoint, threshold,
+                                                 reset_timeout)
+        return _breakers[endpoint]
+
+
+def is_transient(error):
+    """
+    :return: True if the operation that raised error may succeed if sent
+        again, like on a timeout or an overloaded proxy
+    """
+    if isinstance(error, CircuitOpen):
+        return False
+    status = getattr(error, 'http_status', None)
+    if status is not None:
+        return status in TRANSIENT_STATUSES
+    return isinstance(error, TRANSIENT_ERRORS)
+
+
+class RetryPolicy(object):
+    """
+    Retries of the operations of a storage.
+
+    Only transient errors are retried, after a jittered exponential
+    backoff: the n-th retry waits a random time up to
+    min(max_delay, base_delay * 2 ** n) seconds. The connection of the
+    failed attempt is used again, so its token is reused. Every endpoint
+    has a circuit breaker, an unreachable endpoint fails the calls of all
+    the workers quickly instead of having each of them wait out its own
+    retries. The number of retries and the time spent retrying, failed
+    attempts and waits, are kept for the job metadata.
+    """
+
+    def __init__(self, max_attempts=8, base_delay=0.5, max_delay=30,
+                 breaker_threshold=20, breaker_reset=300):
+        """
+        :param max_attempts: attempts of an operation before its error is
+            raised
+        :param breaker_threshold: consecutive failed attempts to an
+            endpoint opening its circuit
+        :param breaker_reset: seconds the circuit of an endpoint stays
+            open
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset = breaker_reset
+        self.retries = 0
+        self.retry_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def delay(self, attempt):
+        """
+        :param attempt: number of attempts that failed
+        :return: seconds to wait before the next attempt
+        """
+        return random.uniform(
+            0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def call(self, endpoint, operation, *args, **kwargs):
+        """
+        :param endpoint: name of the service the operation talks to, its
+            calls share a circuit breaker
+        :return: result of operation(*args, **kwargs)
+        """
+        breaker = circuit_breaker(endpoint, self.breaker_threshold,
+                                  self.breaker_reset)
+        attempt = 0
+        while True:
+            breaker.before_call()
+            attempt += 1
+            started = time.time()
+            try:
+                result = operation(*args, **kwargs)
+            except Exception as e:
+                if not is_transient(e):
+                    # the endpoint answered
+                    breaker.success()
+                    raise
+                breaker.failure()
+                if attempt >= self.max_attempts:
+                    LOG.error('{0} failed after {1} attempts: {2}'.format(
+                        endpoint, attempt, e))
+                    raise
+                delay = self.delay(attempt)
+                LOG.warning('{0} failed, retrying in {1:.1f}s: {2}'.format(
+                    endpoint, delay, e))
+                with self._lock:
+                    self.retries += 1
+                    self.retry_seconds += time.time() - started + delay
+                time.sleep(delay)
+                continue
+            breaker.success()
+            return result
+
+    def stats(self):
+        """
+        :return: retries and seconds spent retrying
+        :rtype: dict
+        """
+        with self._lock:
+            return {'storage_retries': self.retries,
+                    'storage_retry_seconds': round(self.retry_seconds, 1)}
@@ -102,9 +102,28 @@ class SshStorage(fslike.FsLikeStorage):
     def put_file(self, from_path, to_path):
         self.ftp.put(from_path, to_path)
 
+    def stat(self, path):
+        return self.ftp.stat(path)
+
     def listdir(self, directory):
         return self.ftp.listdir(directory)
 
+    def rename(self, from_path, to_path):
+        self.ftp.posix_rename(from_path, to_path)
+
+    def remove(self, path):
+        self.ftp.remove(path)
+
+    def location(self):
+        return '{0}@{1}:{2}'.format(
+            self.remote_username, self.remote_ip,
+            super(SshStorage, self).location())
+
+    def chunks_location(self):
+        return '{0}@{1}:{2}'.format(
+            self.remote_username, self.remote_ip,
+            super(SshStorage, self).chunks_location())
+
     def open(self, filename, mode):
         return self.ftp.open(filename, mode=mode)
 
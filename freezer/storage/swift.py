@@ -15,12 +15,32 @@ limitations under the License.
 
 """
 
+import calendar
+import datetime
+import errno
+import hashlib
+import io
 import json
+from multiprocessing.pool import ThreadPool
+import os
 from oslo_log import log
-import requests.exceptions
+import six
+# PyCharm will not recognize queue. Puts red squiggle line under it. That's OK.
+from six.moves import queue
+from six.moves.urllib.parse import quote
+import tempfile
+import threading
 import time
 
 from freezer.storage import base
+from freezer.storage.exceptions import StorageException
+from freezer.utils import streaming
+from freezer.utils import utils
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 LOG = log.getLogger(__name__)
 
@@ -30,13 +50,46 @@ class SwiftStorage(base.Storage):
     :type client_manager: freezer.osclients.ClientManager
     """
 
+    # pseudo directory of the index objects, outside of the listings of
+    # backups since they are delimited by '/'
+    INDEX_DIRECTORY = 'freezer_index'
+
+    # objects removed in parallel when bulk delete is not available
+    DELETE_WORKERS = 8
+
+    # seconds an interrupted backup can be resumed after it started,
+    # shorter than the default grace period of orphaned segments
+    RESUME_MAX_AGE = 12 * 3600
+
     def __init__(self, client_manager, container, work_dir, max_segment_size,
-                 skip_prepare=False):
+                 skip_prepare=False, upload_workers=1, download_workers=1,
+                 use_index=False, use_slo=False):
         """
         :type client_manager: freezer.osclients.ClientManager
         :type container: str
+        :param upload_workers: number of segments uploaded in parallel
+        :type upload_workers: int
+        :param download_workers: number of segments downloaded in parallel
+        :type download_workers: int
+        :param use_index: keep an index object of the backups of every
+            backup name, read instead of listing the container
+        :type use_index: bool
+        :param use_slo: upload backups as static large objects when the
+            cluster supports them
+        :type use_slo: bool
         """
         self.client_manager = client_manager
+        # the calls to a swift cluster share its circuit breaker
+        self.endpoint = u'swift {0} {1}'.format(
+            client_manager.swift_args.get('auth_url'),
+            client_manager.swift_args.get('region_name'))
+        self.use_index = use_index
+        self.use_slo = use_slo
+        self._capabilities = None
+        self.upload_workers = max(upload_workers, 1)
+        self.download_workers = max(download_workers, 1)
+        # upload and download workers keep their own swift connection here
+        self._local = threading.local()
         # The containers used by freezer to executed backups needs to have
         # freezer_ prefix in the name. If the user provider container doesn't
         # have the prefix, it is automatically added also to the container
@@ -50,72 +103,122 @@ class SwiftStorage(base.Storage):
         self.max_segment_size = max_segment_size
         super(SwiftStorage, self).__init__(work_dir, skip_prepare)
 
+    @property
+    def read_chunk_size(self):
+        # objects are read in blocks of the size of stream messages
+        return min(self.max_segment_size, streaming.MAX_MESSAGE_SIZE)
+
     def swift(self):
         """
+        Returns the connection of the current upload worker if there is one,
+        otherwise the connection shared through the client manager
         :rtype: swiftclient.Connection
         :return:
         """
-        return self.client_manager.get_swift()
+        connection = getattr(self._local, 'swift', None)
+        return connection or self.client_manager.get_swift()
 
-    def upload_chunk(self, content, path):
+    def call(self, operation, *args, **kwargs):
         """
+        Calls a method of a swift connection with the retry policy of the
+        storage, the connection is kept across attempts.
+        :return: result of operation(*args, **kwargs)
         """
-        # If for some reason the swift client object is not available anymore
-        # an exception is generated and a new client object is initialized/
-        # If the exception happens for 10 consecutive times for a total of
-        # 1 hour, then the program will exit with an Exception.
+        return self.retry_policy.call(self.endpoint, operation, *args,
+                                      **kwargs)
 
-        count = 0
-        success = False
-        while not success:
+    def upload_chunk(self, content, path, etag=None):
+        """
+        Uploads a segment, transient errors are retried by the retry
+        policy of the storage.
+        :param content: bytes-like content or a Segment
+        :param etag: md5 of the content, verified by swift
+        """
+        def put_object():
+            contents = content
+            if isinstance(content, Segment):
+                contents = content.body()
+            if isinstance(contents, memoryview):
+                contents = streaming.ViewReader(contents)
             try:
-                LOG.info(
-                    'Uploading file chunk index: {0}'.format(path))
                 self.swift().put_object(
-                    self.segments, path, content,
+                    self.segments, path, contents,
                     content_type='application/octet-stream',
-                    content_length=len(content))
-                LOG.info('Data successfully uploaded!')
-                success = True
-            except Exception as error:
-                LOG.info(
-                    'Retrying to upload file chunk index: {0}'.format(
-                        path))
-                time.sleep(60)
-                self.client_manager.create_swift()
-                count += 1
-                if count == 10:
-                    LOG.critical('Error: add_object: {0}'
-                                 .format(error))
-                    raise Exception("cannot add object to storage")
-
-    def upload_manifest(self, backup):
+                    content_length=len(content), etag=etag)
+            finally:
+                # spool files of segments
+                if hasattr(contents, 'close'):
+                    contents.close()
+
+        LOG.info('Uploading file chunk index: {0}'.format(path))
+        self.call(put_object)
+        LOG.info('Data successfully uploaded!')
+
+    def upload_manifest(self, backup, segments=None):
         """
         Upload Manifest to manage segments in Swift
 
         :param backup: Backup
         :type backup: freezer.storage.base.Backup
+        :param segments: path, etag and size of every segment, in order
+        :type segments: list[dict]
         """
-        self.client_manager.create_swift()
-        headers = {'x-object-manifest':
-                   u'{0}/{1}'.format(self.segments, backup)}
         LOG.info('Uploading Swift Manifest: {0}'.format(backup))
-        self.swift().put_object(container=self.container, obj=str(backup),
-                                contents=u'', headers=headers)
+        self.put_manifest(str(backup), u'{0}/{1}'.format(self.segments,
+                                                         backup), segments)
         LOG.info('Manifest successfully uploaded!')
 
+    def put_manifest(self, name, prefix, segments, headers=None):
+        """
+        Uploads the manifest object name. In slo mode it is a static large
+        object listing segments, otherwise, or when the cluster cannot
+        store them, a dynamic large object made of the objects starting
+        with prefix.
+        :param segments: path, etag and size of every segment, in order
+        :type segments: list[dict]
+        """
+        headers = dict(headers or {})
+        if self.use_slo and segments:
+            limit = self.slo_limit()
+            if len(segments) <= limit:
+                self.call(self.swift().put_object, self.container, name,
+                          json.dumps(segments), headers=headers,
+                          query_string='multipart-manifest=put')
+                return
+            LOG.warning('{0} has {1} segments, more than the {2} of a '
+                        'static large object'.format(name, len(segments),
+                                                     limit))
+        headers['x-object-manifest'] = prefix
+        self.call(self.swift().put_object, container=self.container,
+                  obj=name, contents=u'', headers=headers)
+
+    def slo_segment(self, path, etag, size):
+        """
+        :return: entry of a segment in the manifest of a static large
+            object
+        """
+        return {'path': u'/{0}/{1}'.format(self.segments, path),
+                'etag': etag, 'size_bytes': size}
+
     def upload_meta_file(self, backup, meta_file):
-        # Upload swift manifest for segments
-        # Request a new auth client in case the current token
-        # is expired before uploading tar meta data or the swift manifest
-        self.client_manager.create_swift()
+        def put_object():
+            with open(compressed_path, 'rb') as meta_fd:
+                self.swift().put_object(
+                    self.container, backup.tar(), meta_fd)
 
         # Upload tar incremental meta data file and remove it
         LOG.info('Uploading tar meta data file: {0}'.format(
             backup.tar()))
-        with open(meta_file, 'r') as meta_fd:
-            self.swift().put_object(
-                self.container, backup.tar(), meta_fd)
+        compressed_path = self.compress_meta_file(meta_file)
+        try:
+            self.call(put_object)
+        finally:
+            os.remove(compressed_path)
+        self.cache_meta_file(backup, meta_file)
+
+    def meta_file_signature(self, backup):
+        return self.call(self.swift().head_object, self.container,
+                         backup.tar()).get('etag')
 
     def prepare(self):
         """
@@ -124,15 +227,16 @@ class SwiftStorage(base.Storage):
         container name and the whole list of container available for the swift
         account.
         """
-        containers_list = [c['name'] for c in self.swift().get_account()[1]]
+        containers_list = [c['name'] for c in
+                           self.call(self.swift().get_account)[1]]
         if self.container not in containers_list:
-            self.swift().put_container(self.container)
+            self.call(self.swift().put_container, self.container)
         if self.segments not in containers_list:
-            self.swift().put_container(self.segments)
+            self.call(self.swift().put_container, self.segments)
 
     def info(self):
         ordered_container = {}
-        containers = self.swift().get_account()[1]
+        containers = self.call(self.swift().get_account)[1]
         for container in containers:
             print(container)
             ordered_container['container_name'] = container['name']
@@ -150,15 +254,17 @@ class SwiftStorage(base.Storage):
 
     def get_file(self, from_path, to_path):
         with open(to_path, 'ab') as obj_fd:
-            iterator = self.swift().get_object(
-                self.container, from_path,
-                resp_chunk_size=self.max_segment_size)[1]
+            iterator = self.call(
+                self.swift().get_object, self.container, from_path,
+                resp_chunk_size=self.read_chunk_size)[1]
             for obj_chunk in iterator:
                 obj_fd.write(obj_chunk)
 
     def remove(self, container, prefix):
-        for segment in self.swift().get_container(container, prefix=prefix)[1]:
-            self.swift().delete_object(container, segment['name'])
+        self.delete_objects(
+            [(container, x['name']) for x in self.call(
+                self.swift().get_container, container, prefix=prefix,
+                full_listing=True)[1]])
 
     def remove_backup(self, backup):
         """
@@ -167,77 +273,1045 @@ class SwiftStorage(base.Storage):
             :type backup: freezer.storage.base.Backup
             :return:
         """
-        for i in range(backup.latest_update.level, -1, -1):
-            if i in backup.increments:
-                # remove segment
-                self.remove(self.segments, backup.increments[i])
-                # remove tar
-                self.remove(self.container, backup.increments[i].tar())
-                # remove manifest
-                self.remove(self.container, backup.increments[i])
+        self.remove_backups([backup])
+
+    def remove_backups(self, backups):
+        """
+        Removes the objects of all the backups at once, with bulk delete
+        requests when the cluster supports them.
+        :type backups: list[freezer.storage.base.Backup]
+        """
+        objects = []
+        for backup in backups:
+            objects.extend(self.backup_objects(backup))
+        LOG.info('Removing {0} objects of {1} backups'.format(
+            len(objects), len(backups)))
+        self.delete_objects(objects)
+        if self.use_index:
+            removed = {}
+            for backup in backups:
+                removed.setdefault(backup.hostname_backup_name, set()).update(
+                    i.timestamp for i in backup.increments.values())
+            for hostname_backup_name, timestamps in removed.items():
+                self.update_index(
+                    hostname_backup_name,
+                    lambda rows: [r for r in rows if r[0] not in timestamps])
+
+    def backup_objects(self, backup):
+        """
+        :type backup: freezer.storage.base.Backup
+        :return: container and name of the segments, tar_meta and
+            manifest of backup and all its increments, manifests last so
+            an interrupted removal can be run again
+        :rtype: list[(str, str)]
+        """
+        increments = sorted(backup.increments.values(),
+                            key=lambda i: i.level, reverse=True)
+        objects = []
+        for increment in increments:
+            objects.extend(
+                (self.segments, x['name']) for x in
+                self.call(self.swift().get_container, self.segments,
+                          prefix=u'{0}/'.format(increment),
+                          full_listing=True)[1])
+            objects.append((self.container, increment.tar()))
+        objects.extend((self.container, str(increment))
+                       for increment in increments)
+        return objects
+
+    def orphan_prefixes(self, grace_period):
+        """
+        :return: segment prefixes of the backups without manifest in the
+            container nor in the catalog, whose segments were all modified
+            more than grace_period seconds ago, with their segments
+        :rtype: dict[str, list[dict]]
+        """
+        subdirs = self.call(self.swift().get_container, self.segments,
+                            delimiter='/', full_listing=True)[1]
+        # chunks are shared by the recipes of dedup backups
+        chunks = self.chunk_path('')
+        prefixes = [x['subdir'] for x in subdirs
+                    if 'subdir' in x and x['subdir'] != chunks]
+        if not prefixes:
+            return {}
+        manifests = set(x['name'] for x in self.call(
+            self.swift().get_container, self.container,
+            full_listing=True)[1] if 'name' in x)
+        if self.catalog is not None:
+            manifests |= self.catalog.backup_names(self.location())
+        cutoff = (datetime.datetime.utcnow() -
+                  datetime.timedelta(seconds=grace_period)).strftime(
+            '%Y-%m-%dT%H:%M:%S')
+        orphans = {}
+        for prefix in prefixes:
+            if prefix[:-1] in manifests:
+                continue
+            # segments are named <manifest>/<index>, the manifests written
+            # by add_stream have a '/' in their own name
+            backups = {}
+            for segment in self.call(self.swift().get_container,
+                                     self.segments, prefix=prefix,
+                                     full_listing=True)[1]:
+                backups.setdefault(u'{0}/'.format(
+                    segment['name'].rsplit('/', 1)[0]), []).append(segment)
+            for backup_prefix, segments in backups.items():
+                if backup_prefix[:-1] in manifests:
+                    continue
+                # last_modified is in UTC, iso formatted strings compare
+                # as dates
+                if max(x['last_modified'][:19] for x in segments) < cutoff:
+                    orphans[backup_prefix] = segments
+        return orphans
+
+    def remove_orphans(self, grace_period, dry_run=False):
+        """
+        Removes the segments of backups whose upload failed before their
+        manifest was written.
+        """
+        orphans = self.orphan_prefixes(grace_period)
+        objects = [(self.segments, x['name'])
+                   for segments in orphans.values() for x in segments]
+        stats = {'orphan_backups': len(orphans),
+                 'orphan_segments': len(objects),
+                 'orphan_bytes': sum(x.get('bytes', 0)
+                                     for segments in orphans.values()
+                                     for x in segments)}
+        for prefix in sorted(orphans):
+            LOG.info('Orphaned segments {0}: {1} objects'.format(
+                prefix, len(orphans[prefix])))
+        if not dry_run:
+            self.delete_objects(objects)
+        LOG.info('{0} {1} orphaned segments of {2} backups, {3} '
+                 'bytes'.format('Found' if dry_run else 'Removed',
+                                stats['orphan_segments'],
+                                stats['orphan_backups'],
+                                stats['orphan_bytes']))
+        return stats
+
+    def capabilities(self):
+        """
+        :return: capabilities of the swift cluster, empty if they cannot
+            be read
+        :rtype: dict
+        """
+        if self._capabilities is None:
+            try:
+                self._capabilities = self.call(
+                    self.swift().get_capabilities)
+            except Exception as e:
+                LOG.info('Cannot read the capabilities of swift: {0}'.format(
+                    e))
+                self._capabilities = {}
+        return self._capabilities
+
+    def bulk_delete_limit(self):
+        """
+        :return: maximum number of objects of a bulk delete request, 0
+            if the cluster does not support them
+        """
+        try:
+            return int(self.capabilities()['bulk_delete'][
+                'max_deletes_per_request'])
+        except (KeyError, TypeError, ValueError) as e:
+            LOG.info('Bulk delete is not available: {0}'.format(e))
+            return 0
+
+    def slo_limit(self):
+        """
+        :return: maximum number of segments of a static large object, 0
+            if the cluster does not support them
+        """
+        try:
+            return int(self.capabilities()['slo'].get(
+                'max_manifest_segments', 1000))
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            LOG.info('Static large objects are not available: {0}'.format(
+                e))
+            return 0
+
+    def delete_objects(self, objects):
+        """
+        :param objects: container and name of the objects, objects already
+            removed are ignored
+        :type objects: list[(str, str)]
+        """
+        limit = self.bulk_delete_limit()
+        if limit:
+            for start in range(0, len(objects), limit):
+                self.bulk_delete(objects[start:start + limit])
+            return
+        pool = ThreadPool(self.DELETE_WORKERS)
+        try:
+            pool.map(self._delete_object, objects)
+        finally:
+            pool.terminate()
+
+    def bulk_delete(self, objects):
+        """
+        :type objects: list[(str, str)]
+        """
+        paths = [quote(u'/{0}/{1}'.format(container, name).encode('utf-8'))
+                 for container, name in objects]
+        response = self.call(
+            self.swift().post_account,
+            headers={'Accept': 'application/json',
+                     'Content-Type': 'text/plain'},
+            query_string='bulk-delete', data='\n'.join(paths))[1]
+        if isinstance(response, bytes):
+            response = response.decode('utf-8')
+        result = json.loads(response)
+        if result.get('Errors') or \
+                not result.get('Response Status', '').startswith('200'):
+            raise StorageException('Bulk delete failed: {0} {1}'.format(
+                result.get('Response Status'), result.get('Errors')))
+
+    def _delete_object(self, container_object):
+        if not getattr(self._local, 'swift', None):
+            self._init_worker_connection()
+        container, name = container_object
+        try:
+            self.call(self.swift().delete_object, container, name)
+        except Exception as e:
+            if getattr(e, 'http_status', None) != 404:
+                raise
 
     def add_stream(self, stream, package_name, headers=None):
-        i = 0
-        for el in stream:
-            self.upload_chunk(el, "{0}/{1}".format(package_name, "%08d" % i))
-            i += 1
-        if not headers:
-            headers = {}
-        headers['X-Object-Manifest'] = u'{0}/{1}/'.format(
-            self.segments, package_name)
+        segments = []
+        for i, el in enumerate(stream):
+            path = "{0}/{1}".format(package_name, "%08d" % i)
+            etag = hashlib.md5(el).hexdigest()
+            self.upload_chunk(el, path, etag=etag)
+            segments.append(self.slo_segment(path, etag, len(el)))
+        headers = dict(headers or {})
         headers['x-object-meta-length'] = len(stream)
+        self.put_manifest(package_name, u'{0}/{1}/'.format(
+            self.segments, package_name), segments, headers)
 
-        self.swift().put_object(self.container, package_name, "",
-                                headers=headers)
+    def list_backups(self, hostname_backup_name):
+        """
+        :rtype: list[freezer.storage.base.Backup]
+        :return: list of zero level backups
+        """
+        if self.use_index:
+            rows = self.read_index(hostname_backup_name)
+            if rows is not None:
+                return base.Backup.from_catalog(hostname_backup_name, rows,
+                                                self)
+        backups = self.list_container(hostname_backup_name)
+        if self.use_index:
+            self.write_index(hostname_backup_name,
+                             base.Backup.to_catalog(backups))
+        return backups
 
-    def find_all(self, hostname_backup_name):
+    def list_container(self, hostname_backup_name):
         """
+        Lists the backups and the tar_meta of hostname_backup_name, with
+        all the pages of the listings.
         :rtype: list[freezer.storage.base.Backup]
         :return: list of zero level backups
         """
+        prefix = '{0}_'.format(hostname_backup_name)
         try:
-            files = self.swift().get_container(self.container)[1]
-            names = [x['name'] for x in files if 'name' in x]
-            return [b for b in base.Backup.parse_backups(names, self)
-                    if b.hostname_backup_name == hostname_backup_name]
+            names = [x['name'] for listing_prefix in
+                     (prefix, 'tar_metadata_{0}'.format(prefix))
+                     for x in self.call(
+                         self.swift().get_container, self.container,
+                         prefix=listing_prefix, delimiter='/',
+                         full_listing=True)[1]
+                     if 'name' in x]
         except Exception as error:
             raise Exception('Error: get_object_list: {0}'.format(error))
+        # the prefix also matches backup names starting with this one
+        return [b for b in base.Backup.parse_backups(names, self)
+                if b.hostname_backup_name == hostname_backup_name]
 
-    def backup_blocks(self, backup):
+    def index_path(self, hostname_backup_name):
+        return u'{0}/{1}'.format(self.INDEX_DIRECTORY, hostname_backup_name)
+
+    def read_index(self, hostname_backup_name):
+        """
+        :return: timestamp, level and tar_meta of every backup of
+            hostname_backup_name, None if there is no index yet
+        :rtype: list[(int, int, bool)]
         """
+        try:
+            contents = self.call(
+                self.swift().get_object, self.container,
+                self.index_path(hostname_backup_name))[1]
+            if isinstance(contents, bytes):
+                contents = contents.decode('utf-8')
+            return [tuple(row) for row in json.loads(contents)['backups']]
+        except Exception as e:
+            LOG.info('No index of {0}, listing the container: {1}'.format(
+                hostname_backup_name, e))
+            return None
 
+    def write_index(self, hostname_backup_name, rows):
+        try:
+            self.call(
+                self.swift().put_object, self.container,
+                self.index_path(hostname_backup_name),
+                json.dumps({'backups': sorted(rows)}),
+                content_type='application/json')
+        except Exception as e:
+            # the next listing writes it again
+            LOG.warning('Cannot write the index of {0}: {1}'.format(
+                hostname_backup_name, e))
+
+    def update_index(self, hostname_backup_name, update):
+        """
+        Rewrites the index of hostname_backup_name, it is built from a
+        listing if it does not exist yet.
+        :param update: function returning the updated rows of the index
+        """
+        rows = self.read_index(hostname_backup_name)
+        if rows is None:
+            # the listing already has the change
+            rows = base.Backup.to_catalog(
+                self.list_container(hostname_backup_name))
+        else:
+            rows = update(rows)
+        self.write_index(hostname_backup_name, rows)
+
+    def add_to_catalog(self, backup, tar_meta):
+        super(SwiftStorage, self).add_to_catalog(backup, tar_meta)
+        if self.use_index:
+            row = (backup.timestamp, backup.level, tar_meta)
+            self.update_index(backup.hostname_backup_name,
+                              lambda rows: [r for r in rows if r != row] +
+                              [row])
+
+    def backup_blocks(self, backup):
+        """
+        Yields the content of the backup in order. In slo mode the
+        segments of a static large object are fetched from its manifest.
+        Otherwise, with more than one download worker, the segments are
+        listed, static large objects have their segments at the same
+        paths. Segments are fetched concurrently in ranges of at most
+        read_chunk_size bytes and verified against their size and etag,
+        download workers read ahead at most one range each.
         :param backup:
         :type backup: freezer.storage.base.Backup
         :return:
         """
-        try:
-            chunks = self.swift().get_object(
-                self.container, str(backup),
-                resp_chunk_size=self.max_segment_size)[1]
-        except requests.exceptions.SSLError as e:
-            LOG.warning(e)
-            chunks = self.client_manager.create_swift().get_object(
-                self.container, str(backup),
-                resp_chunk_size=self.max_segment_size)[1]
+        # the manifest is probed only when backups may be stored as
+        # static large objects
+        manifest = self.slo_manifest(backup) if self.use_slo else None
+        if manifest is not None:
+            segments = [tuple(x['name'].lstrip('/').split('/', 1)) +
+                        (x['bytes'], x['hash']) for x in manifest]
+            for block in self._download_ranges(backup, segments):
+                yield block
+            return
+
+        if self.download_workers > 1:
+            segments = self.listed_segments(backup)
+            if segments:
+                for block in self._download_ranges(backup, segments):
+                    yield block
+                return
+
+        chunks = self.call(self.swift().get_object, self.container,
+                           str(backup),
+                           resp_chunk_size=self.read_chunk_size)[1]
 
         for chunk in chunks:
             yield chunk
 
+    def slo_manifest(self, backup):
+        """
+        :type backup: freezer.storage.base.Backup
+        :return: segments of the static large object of the backup, with
+            their name, bytes and hash, None if it is a dynamic large
+            object
+        :rtype: list[dict]
+        """
+        headers, contents = self.call(
+            self.swift().get_object, self.container, str(backup),
+            query_string='multipart-manifest=get')
+        if str(headers.get('x-static-large-object', '')).lower() != 'true':
+            return None
+        if isinstance(contents, bytes):
+            contents = contents.decode('utf-8')
+        return json.loads(contents)
+
+    def _download_ranges(self, backup, segments):
+        """
+        :type backup: freezer.storage.base.Backup
+        :param segments: container, name, size and md5 of the segments of
+            backup
+        :type segments: list[(str, str, int, str)]
+        :return: content of the segments, in order
+        """
+        ranges = []
+        for container, name, size, _ in segments:
+            for start in range(0, max(size, 1), self.read_chunk_size):
+                ranges.append((container, name, start,
+                               min(start + self.read_chunk_size, size),
+                               size))
+        hashes = dict((name, md5) for _, name, _, md5 in segments)
+        pool = ThreadPool(self.download_workers)
+        try:
+            md5 = received = None
+            for (container, name, start, end, size), data in six.moves.zip(
+                    ranges, streaming.ordered_map(
+                        pool, self._download_range, ranges,
+                        self.download_workers)):
+                if start == 0:
+                    md5 = hashlib.md5()
+                    received = 0
+                md5.update(data)
+                received += len(data)
+                if end == size and (received != size or
+                                    md5.hexdigest() != hashes[name]):
+                    raise StorageException(
+                        'Segment {0} of backup {1} is corrupt: {2} bytes '
+                        'with md5 {3}, {4} bytes with md5 {5} '
+                        'expected'.format(name, backup, received,
+                                          md5.hexdigest(), size,
+                                          hashes[name]))
+                yield data
+        finally:
+            pool.terminate()
+
+    def _download_range(self, segment_range):
+        """
+        :param segment_range: container and name of a segment, start and
+            end of the range and size of the segment
+        :return: content of the range
+        """
+        if not getattr(self._local, 'swift', None):
+            self._init_worker_connection()
+        container, name, start, end, size = segment_range
+        headers = {}
+        if start or end != size:
+            headers['Range'] = 'bytes={0}-{1}'.format(start, end - 1)
+        try:
+            return self.call(self.swift().get_object, container, name,
+                             headers=headers)[1]
+        except Exception as e:
+            if getattr(e, 'http_status', None) == 404:
+                raise StorageException('Segment {0} is missing'.format(name))
+            raise
+
+    def listed_segments(self, backup):
+        """
+        :type backup: freezer.storage.base.Backup
+        :return: container, name, size and md5 of the segments of the
+            backup, in order
+        :rtype: list[(str, str, int, str)]
+        """
+        segments = self.call(
+            self.swift().get_container, self.segments,
+            prefix=u'{0}/'.format(backup), full_listing=True)[1]
+        return [(self.segments, x['name'], x['bytes'], x['hash'])
+                for x in segments]
+
+    def _download_segment(self, name):
+        if not getattr(self._local, 'swift', None):
+            self._init_worker_connection()
+        return self.call(self.swift().get_object, self.segments, name)[1]
+
+    def chunk_path(self, name):
+        return u'chunks/{0}'.format(name)
+
+    def put_chunk(self, name, data):
+        if not getattr(self._local, 'swift', None):
+            self._init_worker_connection()
+        self.upload_chunk(data, self.chunk_path(name))
+
+    def get_chunk(self, name):
+        return self._download_segment(self.chunk_path(name))
+
+    def list_chunks(self):
+        chunks = self.call(
+            self.swift().get_container, self.segments,
+            prefix=self.chunk_path(''), full_listing=True)[1]
+        return set(chunk['name'].split('/', 1)[1] for chunk in chunks)
+
+    def chunk_times(self):
+        chunks = self.call(
+            self.swift().get_container, self.segments,
+            prefix=self.chunk_path(''), full_listing=True)[1]
+        # last_modified is in UTC
+        return dict((chunk['name'].split('/', 1)[1], calendar.timegm(
+            time.strptime(chunk['last_modified'][:19], '%Y-%m-%dT%H:%M:%S')))
+            for chunk in chunks)
+
+    def remove_chunks(self, names):
+        self.delete_objects(
+            [(self.segments, self.chunk_path(name)) for name in names])
+
+    def list_all_backups(self):
+        """
+        Lists the container, whatever the catalog or the index say, the
+        objects of the index have a '/' in their names.
+        :rtype: list[freezer.storage.base.Backup]
+        """
+        names = [x['name'] for x in self.call(
+            self.swift().get_container, self.container, delimiter='/',
+            full_listing=True)[1] if 'name' in x]
+        return base.Backup.parse_backups(names, self)
+
+    def backup_head(self, backup, size):
+        return self.call(
+            self.swift().get_object, self.container, str(backup),
+            headers={'Range': 'bytes=0-{0}'.format(size - 1)})[1][:size]
+
+    def location(self):
+        # no authentication, unlike the storage url of the chunks, the
+        # project of the options tells the accounts of a cluster apart
+        args = self.client_manager.swift_args
+        project = args.get('project_id') or args.get('tenant_id')
+        project_name = args.get('project_name') or args.get('tenant_name')
+        if not project and project_name:
+            # project names are unique in their domain
+            project = u'{0}@{1}'.format(
+                project_name, args.get('project_domain_id') or
+                args.get('project_domain_name') or 'default')
+        if not project:
+            # authenticated with a token, only its storage url tells
+            storage_url = self.swift().get_auth()[0]
+            return u'{0}/{1}'.format(storage_url, self.container)
+        return u'{0}/{1}/{2}'.format(self.endpoint, project, self.container)
+
+    def chunks_location(self):
+        storage_url = self.swift().get_auth()[0]
+        return u'{0}/{1}'.format(storage_url, self.segments)
+
+    def _init_worker_connection(self):
+        self._local.swift = self.client_manager.new_swift()
+
+    def segment_path(self, backup, block_index):
+        """
+        :type backup: freezer.storage.base.Backup
+        :type block_index: int
+        :return: name of the segment object in the segments container
+        """
+        return u'{0}/{1}/{2}/{3}'.format(
+            backup, backup.timestamp,
+            self.max_segment_size, "%08d" % block_index)
+
+    def upload_journal(self, hostname_backup_name):
+        location = u'{0}/{1}'.format(self.segments, hostname_backup_name)
+        return UploadJournal(utils.path_join(
+            self.work_dir, 'upload_{0}.journal'.format(
+                hashlib.sha1(location.encode('utf-8')).hexdigest())))
+
+    def create_backup(self, hostname_backup_name, no_incremental,
+                      max_level, always_level, restart_always_level,
+                      time_stamp=None):
+        """
+        Resumes the upload of the last backup of hostname_backup_name if
+        it was interrupted recently and the new backup has the same level
+        and the same level 0. An upload still running in another process
+        is not resumed.
+        """
+        backup = super(SwiftStorage, self).create_backup(
+            hostname_backup_name, no_incremental, max_level, always_level,
+            restart_always_level, time_stamp)
+        journal = self.upload_journal(hostname_backup_name)
+        if not os.path.exists(journal.path):
+            return backup
+        if not journal.lock():
+            LOG.info('Another backup of {0} is being uploaded'.format(
+                hostname_backup_name))
+            return backup
+        try:
+            loaded = journal.load()
+        finally:
+            journal.unlock()
+        if not loaded:
+            return backup
+        full_timestamp = (journal.timestamp if backup.level == 0
+                          else backup.full_backup.timestamp)
+        if (journal.level != backup.level or
+                journal.full_timestamp != full_timestamp or
+                backup.timestamp - journal.timestamp > self.RESUME_MAX_AGE):
+            return backup
+        LOG.info('Resuming the interrupted backup {0}_{1}_{2}, {3} '
+                 'segments were uploaded'.format(
+                     hostname_backup_name, journal.timestamp, journal.level,
+                     len(journal.segments)))
+        return base.Backup(
+            self, hostname_backup_name, journal.timestamp, backup.level,
+            backup.full_backup if backup.level else None)
+
+    def upload_segment(self, journal, segment, path):
+        """
+        Uploads a segment unless the journal has the same one, at the same
+        offset of the stream, from an interrupted upload of the backup.
+        :type journal: UploadJournal
+        :type segment: Segment
+        :return: entry of the segment in a static large object manifest
+        :rtype: dict
+        """
+        md5 = segment.md5.hexdigest()
+        if journal.uploaded(segment.index, segment.offset, len(segment),
+                            md5, path):
+            LOG.info('Segment {0} already uploaded'.format(path))
+        else:
+            self.upload_chunk(segment, path, etag=md5)
+            journal.add(segment.index, segment.offset, len(segment), md5,
+                        path)
+        return self.slo_segment(path, md5, len(segment))
+
+    def stream_segments(self, rich_queue):
+        """
+        Splits the backup stream in segments of max_segment_size bytes,
+        the messages of the stream can be much smaller than a segment.
+        :type rich_queue: freezer.streaming.RichQueue
+        :rtype: collections.Iterable[Segment]
+        """
+        segment = Segment(0, 0, self.work_dir)
+        try:
+            for message in rich_queue.get_messages():
+                try:
+                    view = streaming.message_view(message)
+                    position = 0
+                    while position < len(view):
+                        size = min(len(view) - position,
+                                   self.max_segment_size - len(segment))
+                        if size == len(view):
+                            segment.add(message, view)
+                        else:
+                            segment.add(message, memoryview(view)[
+                                position:position + size])
+                        position += size
+                        if len(segment) == self.max_segment_size:
+                            full, segment = segment, Segment(
+                                segment.index + 1,
+                                segment.offset + len(segment),
+                                self.work_dir)
+                            full.close()
+                            yield full
+                finally:
+                    streaming.release(message)
+            if len(segment):
+                segment.close()
+                full, segment = segment, None
+                yield full
+        finally:
+            if segment is not None:
+                segment.release()
+
+    def stored_segments(self, backup):
+        """
+        :type backup: freezer.storage.base.Backup
+        :return: md5 of the stored segments of backup by object name
+        :rtype: dict[str, str]
+        """
+        return dict((x['name'], x.get('hash')) for x in self.call(
+            self.swift().get_container, self.segments,
+            prefix=u'{0}/'.format(backup), full_listing=True)[1])
+
+    def remove_stale_segments(self, backup, segments_count, stored):
+        """
+        Removes the segments of an interrupted upload of backup that are
+        not part of the new one, the manifest would include them.
+        :param stored: names of the segments stored before the upload
+        """
+        paths = set(self.segment_path(backup, block_index)
+                    for block_index in range(segments_count))
+        stale = [(self.segments, name) for name in sorted(stored)
+                 if name not in paths]
+        if stale:
+            LOG.info('Removing {0} segments of the interrupted upload of '
+                     '{1}'.format(len(stale), backup))
+            self.delete_objects(stale)
+
     def write_backup(self, rich_queue, backup):
         """
-        Upload object on the remote swift server
+        Upload object on the remote swift server.
+        With more than one upload worker the segments are uploaded
+        concurrently and may be stored out of order, the manifest is
+        uploaded only when every segment index has been stored.
+        Uploaded segments are recorded in a journal, segments of an
+        interrupted upload of the backup are not uploaded again when the
+        new stream has the same content and they are still stored.
         :type rich_queue: freezer.streaming.RichQueue
         :type backup: freezer.storage.base.Backup
         """
-        for block_index, message in enumerate(rich_queue.get_messages()):
-            segment_package_name = u'{0}/{1}/{2}/{3}'.format(
-                backup, backup.timestamp,
-                self.max_segment_size, "%08d" % block_index)
-            self.upload_chunk(message, segment_package_name)
-        self.upload_manifest(backup)
+        journal = self.upload_journal(backup.hostname_backup_name)
+        try:
+            resumed = journal.start(backup)
+            try:
+                if resumed:
+                    # journaled segments may have been removed since, as
+                    # orphans
+                    stored = self.stored_segments(backup)
+                    journal.keep(stored)
+                if self.upload_workers == 1:
+                    segments = self._upload_serial(rich_queue, backup,
+                                                   journal)
+                else:
+                    segments = self._upload_parallel(rich_queue, backup,
+                                                     journal)
+            finally:
+                journal.close()
+            if resumed:
+                self.remove_stale_segments(backup, len(segments), stored)
+            self.upload_manifest(backup, segments)
+            journal.remove()
+        finally:
+            journal.unlock()
+
+    def _upload_serial(self, rich_queue, backup, journal):
+        """
+        :return: manifest entries of the segments of the backup
+        :rtype: list[dict]
+        """
+        segments = []
+        stream = self.stream_segments(rich_queue)
+        try:
+            for segment in stream:
+                try:
+                    segments.append(self.upload_segment(
+                        journal, segment,
+                        self.segment_path(backup, segment.index)))
+                finally:
+                    segment.release()
+        finally:
+            stream.close()
+        return segments
+
+    def _upload_parallel(self, rich_queue, backup, journal):
+        """
+        :return: manifest entries of the segments of the backup
+        :rtype: list[dict]
+        """
+        segments = queue.Queue(maxsize=self.upload_workers)
+        uploaded = {}
+        errors = []
+        workers = [threading.Thread(target=self._upload_worker,
+                                    args=(segments, journal, uploaded,
+                                          errors))
+                   for _ in range(self.upload_workers)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        segments_count = 0
+        stream = self.stream_segments(rich_queue)
+        try:
+            for segment in stream:
+                if errors:
+                    segment.release()
+                    break
+                segments.put((self.segment_path(backup, segment.index),
+                              segment))
+                segments_count += 1
+        finally:
+            stream.close()
+            for _ in workers:
+                segments.put(None)
+            for worker in workers:
+                worker.join()
+
+        if errors:
+            raise errors[0]
+        missing = set(range(segments_count)) - set(uploaded)
+        if missing:
+            raise StorageException(
+                "Segments {0} of backup {1} were not uploaded".format(
+                    sorted(missing), backup))
+        return [uploaded[index] for index in range(segments_count)]
+
+    def _upload_worker(self, segments, journal, uploaded, errors):
+        """
+        Uploads segments taken from the queue until it gets None.
+        After the first error of any worker the remaining segments are
+        only drained, so the producer never blocks on a full queue.
+        :type segments: Queue.Queue
+        :type journal: UploadJournal
+        :param uploaded: manifest entries of the uploaded segments by index
+        :type uploaded: dict
+        :type errors: list
+        """
+        try:
+            self._init_worker_connection()
+        except Exception as e:
+            LOG.exception(e)
+            errors.append(e)
+        while True:
+            item = segments.get()
+            if item is None:
+                break
+            path, segment = item
+            try:
+                if not errors:
+                    uploaded[segment.index] = self.upload_segment(
+                        journal, segment, path)
+            except Exception as e:
+                LOG.exception(e)
+                errors.append(e)
+            finally:
+                segment.release()
 
     def download_freezer_meta_data(self, backup):
         return {}
 
     def upload_freezer_meta_data(self, backup, meta_dict):
         pass
+
+
+class UploadJournal(object):
+    """
+    Segments of the backup being uploaded, kept in the work dir so an
+    interrupted upload can be resumed. The first line holds the backup,
+    every other line the index, stream offset, size, md5 and object name
+    of a segment once it is stored. Lines are synced as they are written.
+
+    The process uploading the backup holds the lock of the journal, a
+    lock file next to it, until the upload completes or fails. It is
+    released by the system if the process dies, so another backup
+    resumes only an upload that is not running anymore. There is no
+    lock where fcntl is not available.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.timestamp = None
+        self.level = None
+        self.full_timestamp = None
+        self.segments = {}
+        self._file = None
+        self._lock_file = None
+        self._lock = threading.Lock()
+
+    def lock(self):
+        """
+        :return: False if another process holds the lock of the journal
+        """
+        if fcntl is None or self._lock_file:
+            return True
+        lock_path = '{0}.lock'.format(self.path)
+        while True:
+            self._lock_file = open(lock_path, 'a')
+            try:
+                fcntl.flock(self._lock_file.fileno(),
+                            fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError as e:
+                self.unlock()
+                if e.errno not in (errno.EACCES, errno.EAGAIN):
+                    raise
+                return False
+            # the lock file is removed with the journal, by its holder
+            if (os.path.exists(lock_path) and os.stat(lock_path).st_ino ==
+                    os.fstat(self._lock_file.fileno()).st_ino):
+                return True
+            self.unlock()
+
+    def unlock(self):
+        if self._lock_file:
+            # closing the file releases the lock
+            self._lock_file.close()
+            self._lock_file = None
+
+    def load(self):
+        """
+        :return: False if there is no journal of an interrupted upload
+        """
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with io.open(self.path, encoding='utf-8') as journal_file:
+                header = json.loads(journal_file.readline())
+                segments = {}
+                for line in journal_file:
+                    # the last line may be incomplete
+                    if not line.endswith('\n'):
+                        break
+                    fields = line[:-1].split(' ', 4)
+                    segments[int(fields[0])] = (int(fields[1]),
+                                                int(fields[2]), fields[3],
+                                                fields[4])
+            self.timestamp = header['timestamp']
+            self.level = header['level']
+            self.full_timestamp = header['full_timestamp']
+        except (IOError, IndexError, KeyError, ValueError) as e:
+            LOG.warning('Cannot read the upload journal {0}: {1}'.format(
+                self.path, e))
+            return False
+        self.segments = segments
+        return True
+
+    def start(self, backup):
+        """
+        Starts the journal of the upload of backup, the segments of an
+        interrupted upload of the same backup are kept. When another
+        process holds the lock of the journal, the upload is not
+        journaled and cannot be resumed.
+        :type backup: freezer.storage.base.Backup
+        :return: True if an interrupted upload of backup is resumed
+        """
+        if not self.lock():
+            LOG.warning('The upload journal {0} is held by another backup, '
+                        'the upload of {1} cannot be resumed'.format(
+                            self.path, backup))
+            self.path = None
+        resumed = (self.path is not None and self.load() and
+                   self.timestamp == backup.timestamp and
+                   self.level == backup.level)
+        if not resumed:
+            self.timestamp = backup.timestamp
+            self.level = backup.level
+            self.full_timestamp = backup.full_backup.timestamp
+            self.segments = {}
+        # written again to drop an incomplete last line
+        self._rewrite()
+        return resumed
+
+    def keep(self, stored):
+        """
+        Forgets the segments that are not stored with the same md5, they
+        are uploaded again.
+        :param stored: md5 of the stored segments by object name
+        :type stored: dict[str, str]
+        """
+        missing = [block_index for block_index, (_, _, md5, path)
+                   in self.segments.items() if stored.get(path) != md5]
+        if not missing:
+            return
+        LOG.warning('{0} segments of the interrupted upload are not '
+                    'stored anymore'.format(len(missing)))
+        for block_index in missing:
+            del self.segments[block_index]
+        self._rewrite()
+
+    def _rewrite(self):
+        self.close()
+        if self.path is None:
+            return
+        self._file = io.open(self.path, 'w', encoding='utf-8')
+        self._file.write(u'{0}\n'.format(json.dumps(
+            {'timestamp': self.timestamp, 'level': self.level,
+             'full_timestamp': self.full_timestamp})))
+        for block_index, segment in sorted(self.segments.items()):
+            self._write(block_index, *segment)
+        self._sync()
+
+    def uploaded(self, block_index, offset, size, md5, path):
+        return self.segments.get(block_index) == (offset, size, md5, path)
+
+    def add(self, block_index, offset, size, md5, path):
+        with self._lock:
+            if self._file is None:
+                return
+            self._write(block_index, offset, size, md5, path)
+            self._sync()
+
+    def _write(self, block_index, offset, size, md5, path):
+        self._file.write(u'{0} {1} {2} {3} {4}\n'.format(
+            block_index, offset, size, md5, path))
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def remove(self):
+        """
+        Removes the journal once the backup is complete.
+        """
+        self.close()
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+        if self._lock_file:
+            os.remove('{0}.lock'.format(self.path))
+        self.unlock()
+
+
+class Segment(object):
+    """
+    Part of the backup stream stored as one object of the segments
+    container. Up to memory_size bytes, a segment keeps the parts of the
+    messages of the stream it is made of, they are uploaded from memory
+    even when the segment straddles several messages, like the slightly
+    larger blocks of an encrypted or framed stream. A larger segment is
+    written to a spool file of the work dir as its parts arrive, so
+    large segments do not need more memory than memory_size. The md5 of
+    the segment is computed as its parts are added.
+    """
+
+    def __init__(self, index, offset, work_dir,
+                 memory_size=streaming.MAX_MESSAGE_SIZE):
+        """
+        :param index: position of the segment in the backup
+        :param offset: position of the segment in the backup stream
+        :param memory_size: size up to which the segment is kept in
+            memory
+        """
+        self.index = index
+        self.offset = offset
+        self.work_dir = work_dir
+        self.memory_size = memory_size
+        self.md5 = hashlib.md5()
+        self.size = 0
+        # messages and views of the parts kept in memory
+        self._parts = []
+        self._spool = None
+        self._spool_path = None
+
+    def __len__(self):
+        return self.size
+
+    def add(self, message, view):
+        """
+        Appends view, a part of message, to the segment
+        """
+        self.md5.update(view)
+        self.size += len(view)
+        if self._spool is None and self.size <= self.memory_size:
+            # kept until the segment is released
+            streaming.retain(message)
+            self._parts.append((message, view))
+            return
+        if self._spool is None:
+            utils.create_dir(self.work_dir)
+            fd, self._spool_path = tempfile.mkstemp(
+                prefix='segment_', dir=self.work_dir)
+            self._spool = io.open(fd, 'wb')
+            for _, part in self._parts:
+                self._spool.write(part)
+            self._release_messages()
+        self._spool.write(view)
+
+    def close(self):
+        """
+        Ends the segment, no part can be added afterwards
+        """
+        if self._spool is not None:
+            self._spool.close()
+
+    def body(self):
+        """
+        :return: the content of the segment in memory, a reader over
+            its parts, or its spool file opened for reading
+        """
+        if self._spool_path is not None:
+            return io.open(self._spool_path, 'rb')
+        if len(self._parts) == 1:
+            return self._parts[0][1]
+        return streaming.ViewReader(*[memoryview(part)
+                                      for _, part in self._parts])
+
+    def _release_messages(self):
+        for message, _ in self._parts:
+            streaming.release(message)
+        self._parts = []
+
+    def release(self):
+        """
+        Frees the memory or the spool file of the segment
+        """
+        self._release_messages()
+        if self._spool is not None:
+            self._spool.close()
+            os.remove(self._spool_path)
+            self._spool = None
+            self._spool_path = None
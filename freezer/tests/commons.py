@@ -18,7 +18,9 @@
 
 from mock import MagicMock
 from mock import Mock
+from mock import patch
 
+import errno
 import swiftclient
 import multiprocessing
 import subprocess
@@ -26,8 +28,14 @@ import time
 import os
 import pymongo
 import re
+import shutil
+import tempfile
+import unittest
 from glanceclient.common.utils import IterableWithLength
+from six.moves import queue
+from freezer.storage import local
 from freezer.storage import swift
+from freezer.utils import streaming
 from freezer.utils import utils
 from freezer.openstack.osclients import OpenstackOpts
 from freezer.openstack.osclients import OSClientManager
@@ -294,6 +302,9 @@ class BackupOpt1:
         self.max_level = '0'
         self.hostname_backup_name = "hostname_backup_name"
         self.remove_older_than = '0'
+        self.remove_orphans = False
+        self.collect_chunks = False
+        self.orphans_grace_period = 86400
         self.max_segment_size = '0'
         self.time_stamp = 123456789
         self.container = 'test-container'
@@ -456,3 +467,78 @@ class FakeDisableFileSystemRedirection:
     def __exit__(self, type, value, traceback):
         if self.success:
             return True
+
+
+class EngineTestCase(unittest.TestCase):
+    """
+    Base of the tests of the file engines. Every test runs in its own
+    temporary directory: the files to back up are in files_dir, the
+    current directory, levels are restored in restore_dir and the
+    manifest of the last level is kept in manifest. Subclasses set
+    self.engine and self.backup.
+    """
+
+    def setUp(self):
+        super(EngineTestCase, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.files_dir = os.path.join(self.tmp_dir, 'files')
+        self.restore_dir = os.path.join(self.tmp_dir, 'restore')
+        self.manifest = os.path.join(self.tmp_dir, 'manifest')
+        os.makedirs(self.files_dir)
+        self.cwd = os.getcwd()
+        os.chdir(self.files_dir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp_dir)
+        super(EngineTestCase, self).tearDown()
+
+    def local_storage(self):
+        """
+        :rtype: freezer.storage.local.LocalStorage
+        """
+        storage = local.LocalStorage(os.path.join(self.tmp_dir, 'storage'),
+                                     os.path.join(self.tmp_dir, 'work'))
+        os.makedirs(storage.work_dir)
+        return storage
+
+    def write(self, name, content):
+        path = os.path.join(self.files_dir, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(content)
+
+    def read(self, name):
+        with open(os.path.join(self.restore_dir, name), 'rb') as f:
+            return f.read()
+
+    def backup_level(self):
+        return b''.join(
+            memoryview(streaming.message_view(message)).tobytes()
+            for message in self.engine.backup_data('.', self.manifest))
+
+    def restore_level(self, stream):
+        # from a file, the stream may not fit in a pipe buffer
+        stream_path = os.path.join(self.tmp_dir, 'stream')
+        with open(stream_path, 'wb') as stream_file:
+            stream_file.write(stream)
+        except_queue = queue.Queue()
+        with open(stream_path, 'rb') as stream_file:
+            self.engine.restore_level(self.restore_dir, stream_file,
+                                      self.backup, except_queue)
+        self.assertTrue(except_queue.empty())
+
+    @staticmethod
+    def unreadable(name):
+        """
+        :return: patch of open raising EACCES when the engine reads name
+        """
+        real_open = open
+
+        def fake_open(path, *args, **kwargs):
+            if os.path.basename(path) == name:
+                raise IOError(errno.EACCES, 'Permission denied', path)
+            return real_open(path, *args, **kwargs)
+        return patch('freezer.engine.native.native_engine.open',
+                     create=True, side_effect=fake_open)
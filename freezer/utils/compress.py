@@ -0,0 +1,325 @@
+"""
+(c) Copyright 2016 Hewlett-Packard Enterprise Development Company, L.P.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Freezer framed compression of backup streams
+
+A framed stream starts with MAGIC followed by independent frames, every
+frame is a FRAME_HEADER (codec, stored length, raw length) followed by
+the stored bytes. Frames can be compressed and decompressed in parallel,
+frames whose data does not compress are kept as they are (STORED).
+"""
+import bz2
+import gzip
+from multiprocessing.pool import ThreadPool
+import shutil
+import struct
+import zlib
+
+from oslo_log import log
+
+from freezer.utils import streaming
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+LOG = log.getLogger(__name__)
+
+MAGIC = b'FRZFRM\x00\x01'
+FRAME_HEADER = struct.Struct('>BII')
+DEFAULT_FRAME_SIZE = 4 * 1024 * 1024
+
+# Compressibility of a frame is estimated compressing SAMPLES slices of
+# SAMPLE_SIZE bytes with the fastest zlib level, frames whose samples do
+# not shrink below INCOMPRESSIBLE_RATIO are stored
+SAMPLES = 4
+SAMPLE_SIZE = 16 * 1024
+INCOMPRESSIBLE_RATIO = 0.9
+
+# Meta files are stored as gzip files, older ones are not compressed
+GZIP_MAGIC = b'\x1f\x8b'
+COPY_SIZE = 1024 * 1024
+
+STORED = 0
+CODECS = {
+    'gzip': 1,
+    'bzip2': 2,
+    'xz': 3,
+}
+
+
+def compress_frame(codec, data):
+    if codec == CODECS['gzip']:
+        return zlib.compress(data)
+    elif codec == CODECS['bzip2']:
+        return bz2.compress(data)
+    elif codec == CODECS['xz']:
+        return lzma.compress(data)
+    return data
+
+
+def decompress_frame(codec, data):
+    if codec == CODECS['gzip']:
+        return zlib.decompress(data)
+    elif codec == CODECS['bzip2']:
+        return bz2.decompress(data)
+    elif codec == CODECS['xz']:
+        return lzma.decompress(data)
+    elif codec == STORED:
+        return data
+    raise ValueError("Unknown frame codec {0}".format(codec))
+
+
+def compressible(data):
+    """
+    :param data: data of a frame
+    :return: False if data looks already compressed or random
+    """
+    length = len(data)
+    if length <= SAMPLES * SAMPLE_SIZE:
+        sample = bytes(data)
+    else:
+        step = (length - SAMPLE_SIZE) // (SAMPLES - 1)
+        sample = b''.join(bytes(data[offset:offset + SAMPLE_SIZE])
+                          for offset in range(0, length - SAMPLE_SIZE + 1,
+                                              step)[:SAMPLES])
+    if not sample:
+        return False
+    return len(zlib.compress(sample, 1)) < len(sample) * INCOMPRESSIBLE_RATIO
+
+
+def encode_frame(codec, data):
+    """
+    :param codec: codec of the compression, data is stored if it does
+        not look compressible or does not shrink
+    :return: the frame, header included
+    :rtype: bytes
+    """
+    stored_codec = STORED
+    stored = data
+    if codec != STORED and compressible(data):
+        compressed = compress_frame(codec, data)
+        if len(compressed) < len(data):
+            stored_codec = codec
+            stored = compressed
+    return (FRAME_HEADER.pack(stored_codec, len(stored), len(data)) +
+            bytes(stored))
+
+
+def decode_frame(frame):
+    """
+    :param frame: a whole frame, header included
+    :return: the data of the frame
+    """
+    codec, length, raw_length = FRAME_HEADER.unpack_from(frame)
+    data = bytes(frame[FRAME_HEADER.size:FRAME_HEADER.size + length])
+    if len(data) != length:
+        raise ValueError("Truncated frame")
+    raw = decompress_frame(codec, data)
+    if len(raw) != raw_length:
+        raise ValueError("Corrupted frame: expected {0} bytes, got "
+                         "{1}".format(raw_length, len(raw)))
+    return raw
+
+
+def is_framed(block):
+    """
+    :return: True if block is the beginning of a framed stream
+    """
+    return bytes(streaming.message_view(block)[:len(MAGIC)]) == MAGIC
+
+
+def gzip_file(from_path, to_path):
+    with open(from_path, 'rb') as from_file:
+        with gzip.open(to_path, 'wb') as to_file:
+            shutil.copyfileobj(from_file, to_file, COPY_SIZE)
+
+
+def is_gzip_file(path):
+    with open(path, 'rb') as f:
+        return f.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+
+
+def gunzip_file(from_path, to_path):
+    """
+    Decompresses from_path into to_path, a file that is not compressed is
+    copied as it is.
+    """
+    if not is_gzip_file(from_path):
+        shutil.copyfile(from_path, to_path)
+        return
+    with gzip.open(from_path, 'rb') as from_file:
+        with open(to_path, 'wb') as to_file:
+            shutil.copyfileobj(from_file, to_file, COPY_SIZE)
+
+
+class FrameCompressor(object):
+    """
+    Splits a stream in frames of frame_size bytes and compresses them on
+    a pool of threads; zlib, bz2 and lzma release the GIL while they
+    work. Frames that do not look compressible, or do not shrink, are
+    stored. The framed stream is yielded in blocks of about chunk_size
+    bytes.
+    """
+
+    def __init__(self, compression_algo, workers, chunk_size,
+                 frame_size=DEFAULT_FRAME_SIZE):
+        """
+        :type compression_algo: str
+        :param workers: number of compression threads
+        :type workers: int
+        :param chunk_size: size of the yielded blocks
+        :type chunk_size: int
+        :type frame_size: int
+        """
+        if compression_algo not in CODECS:
+            raise ValueError("Unknown compression algorithm {0}".format(
+                compression_algo))
+        if compression_algo == 'xz' and not lzma:
+            raise ValueError("xz compression requires the lzma module")
+        self.codec = CODECS[compression_algo]
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.frame_size = frame_size
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+        self.skipped_bytes = 0
+        self.frames = 0
+        self.skipped_frames = 0
+
+    def frame(self, job):
+        """
+        :param job: data of the frame and the message it comes from, if
+            the frame is the last one of its message
+        :return: the encoded frame and the message
+        """
+        data, message = job
+        return encode_frame(self.codec, data), message
+
+    def jobs(self, messages):
+        for message in messages:
+            view = streaming.message_view(message)
+            if not len(view):
+                streaming.release(message)
+                continue
+            offsets = range(0, len(view), self.frame_size)
+            for offset in offsets:
+                last = offset == offsets[-1]
+                yield (view[offset:offset + self.frame_size],
+                       message if last else None)
+
+    def framed(self, messages):
+        yield MAGIC
+        pool = ThreadPool(self.workers)
+        try:
+            for frame, message in streaming.ordered_map(
+                    pool, self.frame, self.jobs(messages), self.workers):
+                if message is not None:
+                    streaming.release(message)
+                codec, length, raw_length = FRAME_HEADER.unpack_from(frame)
+                self.frames += 1
+                self.raw_bytes += raw_length
+                self.stored_bytes += length
+                if codec == STORED:
+                    self.skipped_frames += 1
+                    self.skipped_bytes += raw_length
+                yield frame
+        finally:
+            pool.terminate()
+
+    def compress(self, messages):
+        """
+        :param messages: stream to compress, messages are released once
+            all their frames are compressed
+        :return: blocks of the framed stream
+        """
+        return streaming.join_blocks(self.framed(messages), self.chunk_size)
+
+    def metadata(self):
+        ratio = (float(self.stored_bytes) / self.raw_bytes
+                 if self.raw_bytes else 1.0)
+        return {
+            "compression_frames": self.frames,
+            "compression_frame_size": self.frame_size,
+            "compression_ratio": round(ratio, 4),
+            "compression_skipped_frames": self.skipped_frames,
+            "compression_skipped_bytes": self.skipped_bytes,
+        }
+
+
+class FrameDecompressor(object):
+    """
+    Decodes a framed stream, decompressing its frames on a pool of
+    threads and yielding them in order.
+    """
+
+    def __init__(self, workers):
+        """
+        :param workers: number of decompression threads
+        :type workers: int
+        """
+        self.workers = workers
+
+    @staticmethod
+    def frame(job):
+        codec, raw_length, data = job
+        raw = decompress_frame(codec, data)
+        if len(raw) != raw_length:
+            raise ValueError("Corrupted frame: expected {0} bytes, got "
+                             "{1}".format(raw_length, len(raw)))
+        return raw
+
+    @staticmethod
+    def jobs(blocks):
+        buf = bytearray()
+        header = False
+        for block in blocks:
+            buf += streaming.message_view(block)
+            streaming.release(block)
+            if not header:
+                if len(buf) < len(MAGIC):
+                    continue
+                if bytes(buf[:len(MAGIC)]) != MAGIC:
+                    raise ValueError("Not a framed stream")
+                del buf[:len(MAGIC)]
+                header = True
+            position = 0
+            while len(buf) - position >= FRAME_HEADER.size:
+                codec, length, raw_length = FRAME_HEADER.unpack_from(
+                    buf, position)
+                end = position + FRAME_HEADER.size + length
+                if len(buf) < end:
+                    break
+                yield (codec, raw_length,
+                       bytes(buf[position + FRAME_HEADER.size:end]))
+                position = end
+            del buf[:position]
+        if buf or not header:
+            raise ValueError("Truncated framed stream")
+
+    def decompress(self, blocks):
+        """
+        :param blocks: framed stream
+        :return: the decompressed stream, one block per frame
+        """
+        pool = ThreadPool(self.workers)
+        try:
+            for raw in streaming.ordered_map(pool, self.frame,
+                                             self.jobs(blocks),
+                                             self.workers):
+                yield raw
+        finally:
+            pool.terminate()
@@ -0,0 +1,245 @@
+"""
+(c) Copyright 2016 Hewlett-Packard Enterprise Development Company, L.P.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Freezer chunked encryption of backup streams
+
+An encrypted stream starts with MAGIC and the salt of the key, followed by
+records of CHUNK_SIZE bytes of data (the last one can be shorter) sealed
+with AES-256-GCM. Every record is a RECORD_HEADER (flags, sealed length),
+its nonce and the sealed data. The index of the record and its flags are
+authenticated too, so records cannot be reordered and a truncated stream
+is detected. Records are independent: they are sealed and opened on a
+pool of workers, and every record can be opened on its own.
+"""
+import hashlib
+from multiprocessing.pool import ThreadPool
+import os
+import struct
+
+from oslo_log import log
+
+from freezer.utils import streaming
+
+try:
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+except ImportError:
+    AESGCM = None
+
+LOG = log.getLogger(__name__)
+
+MAGIC = b'FRZENC\x00\x01'
+SALT_SIZE = 16
+NONCE_SIZE = 12
+TAG_SIZE = 16
+KEY_SIZE = 32
+KDF_ITERATIONS = 100000
+CHUNK_SIZE = 1024 * 1024
+
+RECORD_HEADER = struct.Struct('>BI')
+ASSOCIATED_DATA = struct.Struct('>QB')
+FINAL = 1
+
+HEADER_SIZE = len(MAGIC) + SALT_SIZE
+
+
+def read_pass_file(pass_file):
+    """
+    :param pass_file: path of the file holding the passphrase, like
+        openssl only its first line is used
+    :rtype: bytes
+    """
+    with open(pass_file, 'rb') as f:
+        return f.readline().rstrip(b'\r\n')
+
+
+def derive_key(password, salt):
+    return hashlib.pbkdf2_hmac('sha256', password, salt, KDF_ITERATIONS,
+                               KEY_SIZE)
+
+
+def is_encrypted(block):
+    """
+    :return: True if block is the beginning of an encrypted stream
+    """
+    return bytes(streaming.message_view(block)[:len(MAGIC)]) == MAGIC
+
+
+def record_offset(index):
+    """
+    :return: position of the record index in an encrypted stream
+    """
+    record_size = RECORD_HEADER.size + NONCE_SIZE + CHUNK_SIZE + TAG_SIZE
+    return HEADER_SIZE + index * record_size
+
+
+class Cipher(object):
+
+    def __init__(self, pass_file, workers):
+        """
+        :param pass_file: path of the file holding the passphrase
+        :param workers: number of threads sealing or opening records
+        :type workers: int
+        """
+        if AESGCM is None:
+            raise ValueError("Encryption requires the cryptography module")
+        self.password = read_pass_file(pass_file)
+        self.workers = max(workers, 1)
+        self.aead = None
+
+    def set_salt(self, salt):
+        self.aead = AESGCM(derive_key(self.password, salt))
+
+
+class ChunkEncryptor(Cipher):
+    """
+    Encrypts a stream in records of CHUNK_SIZE bytes, every record has
+    a random nonce. The key is derived from the passphrase and a random
+    salt for every stream. The encrypted stream is yielded in blocks of
+    about chunk_size bytes.
+    """
+
+    def __init__(self, pass_file, workers, chunk_size):
+        """
+        :param chunk_size: size of the yielded blocks
+        :type chunk_size: int
+        """
+        super(ChunkEncryptor, self).__init__(pass_file, workers)
+        self.chunk_size = chunk_size
+        self.salt = os.urandom(SALT_SIZE)
+        self.set_salt(self.salt)
+
+    def seal(self, job):
+        index, flags, data = job
+        nonce = os.urandom(NONCE_SIZE)
+        sealed = self.aead.encrypt(nonce, bytes(data),
+                                   ASSOCIATED_DATA.pack(index, flags))
+        return RECORD_HEADER.pack(flags, len(sealed)) + nonce + sealed
+
+    @staticmethod
+    def jobs(messages):
+        buf = bytearray()
+        index = 0
+        for message in messages:
+            buf += streaming.message_view(message)
+            streaming.release(message)
+            # the last chunk is held back until the end of the stream,
+            # it is the one marked as final
+            while len(buf) > CHUNK_SIZE:
+                yield index, 0, bytes(buf[:CHUNK_SIZE])
+                del buf[:CHUNK_SIZE]
+                index += 1
+        yield index, FINAL, bytes(buf)
+
+    def records(self, messages):
+        yield MAGIC + self.salt
+        pool = ThreadPool(self.workers)
+        try:
+            for record in streaming.ordered_map(
+                    pool, self.seal, self.jobs(messages), self.workers):
+                yield record
+        finally:
+            pool.terminate()
+
+    def encrypt(self, messages):
+        """
+        :param messages: stream to encrypt, messages are released once
+            they are copied in a chunk
+        :return: blocks of the encrypted stream
+        """
+        return streaming.join_blocks(self.records(messages), self.chunk_size)
+
+    @staticmethod
+    def metadata():
+        return {
+            "encryption_cipher": "aes-256-gcm",
+            "encryption_chunk_size": CHUNK_SIZE,
+        }
+
+
+class ChunkDecryptor(Cipher):
+    """
+    Decrypts an encrypted stream opening its records on a pool of
+    threads, or single records with open_record.
+    """
+
+    def open_record(self, index, record):
+        """
+        :param index: position of the record in the stream
+        :param record: the record, header included
+        :return: the decrypted data and whether it is the last chunk
+        """
+        flags, length = RECORD_HEADER.unpack_from(record)
+        nonce = bytes(record[RECORD_HEADER.size:
+                             RECORD_HEADER.size + NONCE_SIZE])
+        sealed = bytes(record[RECORD_HEADER.size + NONCE_SIZE:
+                              RECORD_HEADER.size + NONCE_SIZE + length])
+        try:
+            data = self.aead.decrypt(nonce, sealed,
+                                     ASSOCIATED_DATA.pack(index, flags))
+        except InvalidTag:
+            raise ValueError("Wrong key or corrupted record {0}".format(
+                index))
+        return data, bool(flags & FINAL)
+
+    def open(self, job):
+        return self.open_record(*job)[0]
+
+    def jobs(self, blocks):
+        buf = bytearray()
+        index = 0
+        final = False
+        header = False
+        for block in blocks:
+            buf += streaming.message_view(block)
+            streaming.release(block)
+            if not header:
+                if len(buf) < HEADER_SIZE:
+                    continue
+                if bytes(buf[:len(MAGIC)]) != MAGIC:
+                    raise ValueError("Not an encrypted stream")
+                self.set_salt(bytes(buf[len(MAGIC):HEADER_SIZE]))
+                del buf[:HEADER_SIZE]
+                header = True
+            position = 0
+            while len(buf) - position >= RECORD_HEADER.size:
+                if final:
+                    raise ValueError("Data after the last record")
+                flags, length = RECORD_HEADER.unpack_from(buf, position)
+                end = position + RECORD_HEADER.size + NONCE_SIZE + length
+                if len(buf) < end:
+                    break
+                yield index, bytes(buf[position:end])
+                final = bool(flags & FINAL)
+                index += 1
+                position = end
+            del buf[:position]
+        if buf or not final:
+            raise ValueError("Truncated encrypted stream")
+
+    def decrypt(self, blocks):
+        """
+        :param blocks: encrypted stream
+        :return: the decrypted stream, one block per chunk
+        """
+        pool = ThreadPool(self.workers)
+        try:
+            for data in streaming.ordered_map(pool, self.open,
+                                              self.jobs(blocks),
+                                              self.workers):
+                if data:
+                    yield data
+        finally:
+            pool.terminate()
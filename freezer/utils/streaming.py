@@ -15,13 +15,19 @@ limitations under the License.
 
 Freezer general utils functions
 """
-from six.moves import queue
+import collections
+import os
+import tempfile
 import threading
 
 from oslo_log import log
 
 LOG = log.getLogger(__name__)
 
+# largest message of a backup stream, larger swift segments are made of
+# several messages
+MAX_MESSAGE_SIZE = 32 * 1024 * 1024
+
 
 class Wait(Exception):
     pass
@@ -29,34 +35,78 @@ class Wait(Exception):
 
 class RichQueue(object):
     """
-        :type data_queue: Queue.Queue
+    Queue between the producer and the consumer of a backup stream.
+
+    The capacity is a number of messages or, when max_bytes is set, a
+    number of bytes. A message bigger than max_bytes is still accepted
+    by an empty queue, so at least one message can always be in flight.
+    Blocked producers and consumers are woken up by condition variables
+    as soon as the queue changes or force_stop is called.
     """
-    def __init__(self, size=2):
+    def __init__(self, size=2, max_bytes=None):
         """
+        :param size: maximum number of queued messages
         :type size: int
+        :param max_bytes: maximum number of queued bytes, replaces size
+        :type max_bytes: int
         :return:
         """
-        self.data_queue = queue.Queue(maxsize=size)
-        # transmission changes in atomic way so no synchronization needed
+        self.size = size
+        self.max_bytes = max_bytes
+        self.messages = collections.deque()
+        self.bytes = 0
         self.finish_transmission = False
         self.is_force_stop = False
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
 
     def finish(self):
-        self.finish_transmission = True
+        with self._lock:
+            self.finish_transmission = True
+            self._not_empty.notify_all()
 
     def force_stop(self):
-        self.is_force_stop = True
+        with self._lock:
+            self.is_force_stop = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
 
     def empty(self):
-        return self.data_queue.empty()
+        with self._lock:
+            return not self.messages
 
-    def get(self):
-        try:
-            res = self.data_queue.get(timeout=1)
-            self.data_queue.task_done()
-            return res
-        except queue.Empty:
-            raise Wait()
+    def _full(self, length):
+        if not self.messages:
+            return False
+        if self.max_bytes:
+            return self.bytes + length > self.max_bytes
+        return len(self.messages) >= self.size
+
+    def get(self, timeout=None):
+        """
+        Waits for the next message.
+        :param timeout: seconds to wait, None waits until something happens
+        :raises: Wait -- no message is available because the transmission
+            finished or the timeout expired
+        """
+        with self._lock:
+            if (not self.messages and not self.finish_transmission and
+                    not self.is_force_stop):
+                if timeout is None:
+                    while (not self.messages and
+                           not self.finish_transmission and
+                           not self.is_force_stop):
+                        self._not_empty.wait()
+                else:
+                    self._not_empty.wait(timeout)
+            self.check_stop()
+            if not self.messages:
+                raise Wait()
+            message = self.messages.popleft()
+            self.bytes -= len(message)
+            self._not_full.notify()
+            return message
 
     def check_stop(self):
         if self.is_force_stop:
@@ -69,22 +119,315 @@ class RichQueue(object):
 
     def has_more(self):
         self.check_stop()
-        return not self.finish_transmission or not self.data_queue.empty()
+        return not self.finish_transmission or not self.empty()
 
     def put(self, message):
-        while True:
-            try:
-                self.data_queue.put(message, timeout=1)
-                break
-            except queue.Full:
-                self.check_stop()
+        length = len(message)
+        with self._lock:
+            while self._full(length) and not self.is_force_stop:
+                self._not_full.wait()
+            self.check_stop()
+            self.messages.append(message)
+            self.bytes += length
+            self._not_empty.notify()
 
     def get_messages(self):
         while self.has_more():
             try:
                 yield self.get()
             except Wait:
+                pass
+
+
+class _Spooled(object):
+    """
+    Place of a message of a SpooledQueue written to its spool file
+    """
+    def __init__(self, length):
+        self.length = length
+
+    def __len__(self):
+        # spooled messages do not use the memory of the queue
+        return 0
+
+
+class SpooledQueue(RichQueue):
+    """
+    RichQueue whose producer never waits for the consumer: the messages
+    that do not fit in the memory of the queue are appended to a spool
+    file of spool_dir and read back in order. The producer can run far
+    ahead of the consumer with bounded memory. There is one producer and
+    one consumer.
+    """
+    def __init__(self, spool_dir, size=2, max_bytes=None):
+        """
+        :param spool_dir: directory of the spool file, created when the
+            first message is spooled
+        """
+        super(SpooledQueue, self).__init__(size, max_bytes)
+        self.spool_dir = spool_dir
+        self.spooled_bytes = 0
+        # number of spooled messages in the queue
+        self._spooled = 0
+        self._spool = None
+        self._read_offset = 0
+        self._spool_lock = threading.Lock()
+
+    def _full(self, length):
+        in_memory = len(self.messages) - self._spooled
+        if not in_memory:
+            return False
+        if self.max_bytes:
+            return self.bytes + length > self.max_bytes
+        return in_memory >= self.size
+
+    def put(self, message):
+        with self._lock:
+            if not self._full(len(message)):
+                self.check_stop()
+                self.messages.append(message)
+                self.bytes += len(message)
+                self._not_empty.notify()
+                return
+        length = self._write(message)
+        with self._lock:
+            self.check_stop()
+            self.messages.append(_Spooled(length))
+            self._spooled += 1
+            self._not_empty.notify()
+
+    def _write(self, message):
+        view = message_view(message)
+        try:
+            with self._spool_lock:
                 self.check_stop()
+                if self._spool is None:
+                    if not os.path.isdir(self.spool_dir):
+                        os.makedirs(self.spool_dir)
+                    self._spool = tempfile.TemporaryFile(
+                        prefix='spool_', dir=self.spool_dir)
+                self._spool.seek(0, os.SEEK_END)
+                self._spool.write(view)
+                self.spooled_bytes += len(view)
+                return len(view)
+        finally:
+            release(message)
+
+    def get(self, timeout=None):
+        message = super(SpooledQueue, self).get(timeout)
+        if not isinstance(message, _Spooled):
+            return message
+        with self._lock:
+            self._spooled -= 1
+        with self._spool_lock:
+            self.check_stop()
+            self._spool.seek(self._read_offset)
+            data = self._spool.read(message.length)
+            self._read_offset += len(data)
+        return data
+
+    def close(self):
+        """
+        Removes the spool file, once the consumer is done
+        """
+        with self._spool_lock:
+            if self._spool is not None:
+                self._spool.close()
+                self._spool = None
+
+    def force_stop(self):
+        super(SpooledQueue, self).force_stop()
+        self.close()
+
+
+class PooledBuffer(object):
+    """
+    Preallocated bytearray handed out by a BufferPool. Every holder of
+    a reference calls release() when done, the last release gives the
+    buffer back to the pool.
+    """
+    def __init__(self, pool, size):
+        """
+        :type pool: BufferPool
+        :type size: int
+        """
+        self.pool = pool
+        self.buffer = bytearray(size)
+        self.length = 0
+        self.refs = 0
+        self._lock = threading.Lock()
+
+    def readinto(self, stream):
+        """
+        Fills the buffer from stream until it is full or the stream ends
+        :return: number of bytes read
+        """
+        view = memoryview(self.buffer)
+        self.length = 0
+        while self.length < len(self.buffer):
+            read = stream.readinto(view[self.length:])
+            if not read:
+                break
+            self.length += read
+        return self.length
+
+    def view(self):
+        """
+        :rtype: memoryview
+        :return: the filled part of the buffer, without copying it
+        """
+        return memoryview(self.buffer)[:self.length]
+
+    def retain(self):
+        with self._lock:
+            self.refs += 1
+
+    def release(self):
+        with self._lock:
+            self.refs -= 1
+            free = self.refs == 0
+        if free:
+            self.pool.put_back(self)
+
+    def __len__(self):
+        return self.length
+
+
+class BufferPool(object):
+    """
+    Recycles buffers of buffer_size bytes so a steady backup stream does
+    not allocate a new object for every segment. Buffers are allocated
+    lazily, the number of buffers in use is bounded by the queues that
+    carry them.
+    """
+    def __init__(self, buffer_size):
+        """
+        :type buffer_size: int
+        """
+        self.buffer_size = buffer_size
+        self.free = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        :rtype: PooledBuffer
+        :return: an empty buffer with one reference
+        """
+        with self._lock:
+            pooled = self.free.pop() if self.free else None
+        if pooled is None:
+            pooled = PooledBuffer(self, self.buffer_size)
+        pooled.length = 0
+        pooled.refs = 1
+        return pooled
+
+    def put_back(self, pooled):
+        with self._lock:
+            self.free.append(pooled)
+
+
+class ViewReader(object):
+    """
+    File-like reader over memoryviews read one after the other, read
+    returns slices of a view instead of copies, so a read may stop at
+    the end of a view. seek and tell allow http clients to retry.
+    """
+    def __init__(self, *views):
+        """
+        :type views: list[memoryview]
+        """
+        self._views = views
+        self._size = sum(len(view) for view in views)
+        self._position = 0
+
+    def read(self, size=-1):
+        if size < 0 and len(self._views) > 1:
+            # the rest of all the views, copied
+            chunks = []
+            chunk = self.read(self._size)
+            while len(chunk):
+                chunks.append(chunk)
+                chunk = self.read(self._size)
+            return b''.join(chunks)
+        offset = self._position
+        for view in self._views:
+            if offset < len(view):
+                end = len(view) if size < 0 else offset + size
+                chunk = view[offset:end]
+                self._position += len(chunk)
+                return chunk
+            offset -= len(view)
+        return b''
+
+    def seek(self, position, whence=0):
+        if whence == 1:
+            position += self._position
+        elif whence == 2:
+            position += self._size
+        self._position = position
+
+    def tell(self):
+        return self._position
+
+
+def message_view(message):
+    """
+    :return: bytes-like content of a message taken from a RichQueue
+    """
+    if isinstance(message, PooledBuffer):
+        return message.view()
+    return message
+
+
+def retain(message):
+    if isinstance(message, PooledBuffer):
+        message.retain()
+
+
+def release(message):
+    """
+    Marks a message taken from a RichQueue as consumed
+    """
+    if isinstance(message, PooledBuffer):
+        message.release()
+
+
+def ordered_map(pool, func, items, read_ahead):
+    """
+    Applies func to every item on a pool of workers and yields the
+    results in the order of items, with at most read_ahead + 1 items
+    submitted and not yet yielded.
+    :type pool: multiprocessing.pool.ThreadPool
+    :type items: collections.Iterable
+    :type read_ahead: int
+    """
+    pending = collections.deque()
+    for item in items:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) > read_ahead:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def join_blocks(blocks, size):
+    """
+    Joins consecutive blocks into blocks of at least size bytes, only
+    the last one can be smaller.
+    :type blocks: collections.Iterable
+    :type size: int
+    """
+    joined = []
+    length = 0
+    for block in blocks:
+        joined.append(block)
+        length += len(block)
+        if length >= size:
+            yield b''.join(joined)
+            joined = []
+            length = 0
+    if joined:
+        yield b''.join(joined)
 
 
 class QueuedThread(threading.Thread):
@@ -0,0 +1,159 @@
+# (c) Copyright 2016 Hewlett-Packard Enterprise Development Company, L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import random
+import shutil
+import unittest
+
+import mock
+
+from freezer.engine.dedup import dedup_engine
+from freezer.storage import base
+from freezer.tests import commons
+
+
+class TestChunker(unittest.TestCase):
+
+    def setUp(self):
+        self.chunker = dedup_engine.Chunker(64, 256, 1024)
+        rand = random.Random(0)
+        self.data = b''.join(
+            b'line %d\n' % rand.randint(0, 10 ** 6) for _ in range(2000))
+
+    def split(self, data, size=100):
+        return list(self.chunker.split(
+            [data[i:i + size] for i in range(0, len(data), size)]))
+
+    def test_split(self):
+        chunks = self.split(self.data)
+        self.assertEqual(self.data, b''.join(chunks))
+        self.assertTrue(all(64 < len(chunk) <= 1024 for chunk in chunks[:-1]))
+        self.assertEqual(chunks, self.split(self.data, 7))
+
+    def test_max_size(self):
+        chunks = self.split(b'\0' * 3000)
+        self.assertEqual([1024, 1024, 952], [len(c) for c in chunks])
+
+    def test_insertion(self):
+        chunks = self.split(self.data)
+        changed = self.split(self.data[:5000] + b'new' + self.data[5000:])
+        self.assertTrue(len(set(chunks) - set(changed)) <= 2)
+
+
+class TestDedupBackupEngine(commons.EngineTestCase):
+
+    def setUp(self):
+        super(TestDedupBackupEngine, self).setUp()
+        self.write('file_1', os.urandom(5000))
+        self.write('file_2', b'world' * 1000)
+        self.storage = self.local_storage()
+        self.engine = dedup_engine.DedupBackupEngine(
+            'gzip', '', '', self.storage, 1024, upload_workers=2,
+            download_workers=2)
+        self.engine.chunker = dedup_engine.Chunker(512, 2048, 4096)
+        self.backup = mock.MagicMock()
+        self.backup.storage = self.storage
+
+    def test_backup_restore(self):
+        recipe = self.backup_level()
+        self.assertTrue(recipe.startswith(dedup_engine.RECIPE_MAGIC))
+        self.assertEqual(self.engine.stats['chunks'],
+                         len(self.storage.list_chunks()))
+        self.restore_level(recipe)
+        self.assertEqual(b'world' * 1000, self.read('file_2'))
+
+    def test_stores_chunks_once(self):
+        self.backup_level()
+        chunks = self.storage.list_chunks()
+        os.remove(self.manifest)
+        self.backup_level()
+        self.assertEqual(0, self.engine.stats['chunks_stored'])
+        self.assertEqual(chunks, self.storage.list_chunks())
+
+    def test_index_resync(self):
+        self.backup_level()
+        index = self.engine.chunk_index()
+        self.assertTrue(index.load())
+        self.assertEqual(self.storage.list_chunks(), index.names)
+        shutil.rmtree(os.path.join(self.storage.storage_directory,
+                                   self.storage.CHUNKS_DIRECTORY))
+        # a level 0 lists the chunks of the storage again
+        os.remove(self.manifest)
+        recipe = self.backup_level()
+        self.assertEqual(self.engine.stats['chunks'],
+                         self.engine.stats['chunks_stored'])
+        self.restore_level(recipe)
+        self.assertEqual(b'world' * 1000, self.read('file_2'))
+
+    def test_corrupted_chunk(self):
+        recipe = self.backup_level()
+        name = sorted(self.storage.list_chunks())[0]
+        with open(self.storage.chunk_path(name), 'r+b') as chunk_file:
+            chunk_file.seek(-1, os.SEEK_END)
+            chunk_file.write(b'\xff')
+        self.assertRaises(Exception, self.restore_level, recipe)
+
+    def store(self, data, timestamp):
+        backup = base.Backup(self.storage, 'host_backup', timestamp)
+        path = self.storage.backup_to_file_path(backup)
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as backup_file:
+            backup_file.write(data)
+        return backup
+
+    def test_collect_chunks(self):
+        old = self.store(self.backup_level(), 1000)
+        old_chunks = self.storage.list_chunks()
+        self.write('file_1', os.urandom(5000))
+        os.remove(self.manifest)
+        recipe = self.backup_level()
+        self.store(recipe, 2000)
+        self.store(b'native backup', 3000)
+        chunks = self.storage.list_chunks()
+        self.assertEqual(
+            {'recipes': 2, 'chunks': len(chunks), 'unreferenced_chunks': 0},
+            dedup_engine.collect_chunks(self.storage, 0))
+        self.storage.remove_backup(old)
+        unused = old_chunks - dedup_engine.recipe_chunks([recipe])
+        self.assertEqual(
+            {'recipes': 1, 'chunks': len(chunks),
+             'unreferenced_chunks': len(unused)},
+            dedup_engine.collect_chunks(self.storage, 0, dry_run=True))
+        self.assertEqual(chunks, self.storage.list_chunks())
+        # recent chunks are kept
+        dedup_engine.collect_chunks(self.storage, 3600)
+        self.assertEqual(chunks, self.storage.list_chunks())
+        dedup_engine.collect_chunks(self.storage, 0)
+        self.assertEqual(chunks - unused,
+                         self.storage.list_chunks() - {'collected'})
+        self.restore_level(recipe)
+        self.assertEqual(b'world' * 1000, self.read('file_2'))
+
+    def test_collect_chunks_resets_index(self):
+        self.backup_level()
+        self.write('file_1', os.urandom(5000))
+        dedup_engine.collect_chunks(self.storage, 0)
+        # the next level does not rely on the chunks collected
+        recipe = self.backup_level()
+        self.assertEqual(self.engine.stats['chunks'],
+                         self.engine.stats['chunks_stored'])
+        self.assertEqual(dedup_engine.collection_generation(self.storage),
+                         self.engine.index.generation)
+        self.restore_level(recipe)
+
+    def test_encryption_not_supported(self):
+        self.assertRaises(ValueError, dedup_engine.DedupBackupEngine,
+                          'gzip', '', '', self.storage, 1024, 'pass_file')
@@ -0,0 +1,117 @@
+# (c) Copyright 2016 Hewlett-Packard Enterprise Development Company, L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import json
+import os
+import random
+import unittest
+
+import mock
+
+from freezer.engine.dedup import dedup_engine
+from freezer.engine.delta import delta_engine
+from freezer.tests import commons
+
+
+class TestDeltaBackupEngine(commons.EngineTestCase):
+
+    def setUp(self):
+        super(TestDeltaBackupEngine, self).setUp()
+        rand = random.Random(0)
+        self.data = b''.join(
+            b'line %d\n' % rand.randint(0, 10 ** 6) for _ in range(20000))
+        self.write('big', self.data)
+        self.write('small', b'hello')
+        self.storage = self.local_storage()
+        self.engine = delta_engine.DeltaBackupEngine(
+            'gzip', '', '', self.storage, 1024)
+        self.engine.chunker = dedup_engine.Chunker(512, 2048, 4096)
+        self.backup = mock.MagicMock()
+
+    def test_backup_restore(self):
+        self.restore_level(self.backup_level())
+        self.assertEqual(self.data, self.read('big'))
+        self.assertEqual(b'hello', self.read('small'))
+        self.assertEqual(0, self.engine.stats['files_delta'])
+        with open(self.manifest) as manifest_file:
+            files = json.load(manifest_file)['files']
+        self.assertEqual(4, len(files['./big']))
+
+    def test_delta(self):
+        level_0 = self.backup_level()
+        changed = (self.data[:50000] + b'inserted\n' + self.data[50000:70000] +
+                   b'X' * 100 + self.data[70100:])
+        self.write('big', changed)
+        os.utime('big', (1000, 1000))
+        level_1 = self.backup_level()
+        self.assertEqual(1, self.engine.stats['files_delta'])
+        self.assertTrue(self.engine.stats['bytes'] < len(self.data) // 10)
+        self.assertTrue(self.engine.stats['bytes_reused'] >
+                        len(self.data) * 9 // 10)
+        self.restore_level(level_0)
+        self.restore_level(level_1)
+        self.assertEqual(changed, self.read('big'))
+        self.assertEqual(1000, os.stat(
+            os.path.join(self.restore_dir, 'big')).st_mtime)
+        self.assertEqual(['big', 'small'], sorted(os.listdir(
+            self.restore_dir)))
+
+    def test_unchanged_file_keeps_signatures(self):
+        level_0 = self.backup_level()
+        level_1 = self.backup_level()
+        self.assertEqual(2, self.engine.stats['files_unchanged'])
+        self.write('big', self.data + b'appended\n')
+        level_2 = self.backup_level()
+        self.assertEqual(1, self.engine.stats['files_delta'])
+        for level in (level_0, level_1, level_2):
+            self.restore_level(level)
+        self.assertEqual(self.data + b'appended\n', self.read('big'))
+
+    def test_unreadable_changed_file(self):
+        level_0 = self.backup_level()
+        self.write('big', self.data + b'appended\n')
+        with self.unreadable('big'):
+            level_1 = self.backup_level()
+        level_2 = self.backup_level()
+        self.assertEqual(1, self.engine.stats['files_delta'])
+        for level in (level_0, level_1, level_2):
+            self.restore_level(level)
+        self.assertEqual(self.data + b'appended\n', self.read('big'))
+
+    def test_delta_without_previous_level(self):
+        self.backup_level()
+        self.write('big', b'new' + self.data)
+        level_1 = self.backup_level()
+        self.assertRaises(ValueError, self.restore_level, level_1)
+
+    def test_delta_on_different_file(self):
+        level_0 = self.backup_level()
+        self.write('big', b'new' + self.data)
+        level_1 = self.backup_level()
+        self.restore_level(level_0)
+        with open(os.path.join(self.restore_dir, 'big'), 'wb') as f:
+            f.write(b'short')
+        self.assertRaises(ValueError, self.restore_level, level_1)
+        self.assertEqual(b'short', self.read('big'))
+
+
+class TestBlockReader(unittest.TestCase):
+
+    def test_read(self):
+        reader = delta_engine.BlockReader([b'abc', b'de', b'fghi'])
+        self.assertEqual(b'ab', reader.read(2))
+        self.assertEqual(b'cdef', reader.read(4))
+        self.assertEqual(b'ghi', reader.read())
+        self.assertEqual(b'', reader.read(1))
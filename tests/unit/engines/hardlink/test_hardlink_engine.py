@@ -0,0 +1,128 @@
+# (c) Copyright 2016 Hewlett-Packard Enterprise Development Company, L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import shutil
+import unittest
+
+import mock
+import six
+
+from freezer.engine.hardlink import hardlink_engine
+from freezer.tests import commons
+
+
+class TestHardlinkBackupEngine(commons.EngineTestCase):
+
+    def setUp(self):
+        super(TestHardlinkBackupEngine, self).setUp()
+        self.write('file_1', b'hello')
+        self.write('dir/file_2', b'world' * 1000)
+        os.symlink('file_1', os.path.join(self.files_dir, 'link'))
+        self.storage = self.local_storage()
+        self.engine = hardlink_engine.HardlinkBackupEngine(
+            'gzip', '', '', self.storage, 1024)
+        self.timestamp = 1000
+
+    def backup(self):
+        self.timestamp += 1
+        backup = self.storage.create_backup(
+            'host_backup', False, 5, False, False, time_stamp=self.timestamp)
+        self.engine.backup('.', backup)
+        return backup
+
+    def tree_file(self, backup, name):
+        return os.path.join(self.storage.backup_to_file_path(backup), name)
+
+    def test_backup_restore(self):
+        backup = self.backup()
+        self.assertEqual(0, backup.level)
+        self.assertEqual(2, self.engine.stats['files_copied'])
+        self.engine.restore(self.storage.find_one('host_backup'),
+                            self.restore_dir, False)
+        self.assertEqual(b'hello', self.read('file_1'))
+        self.assertEqual(b'world' * 1000, self.read('dir/file_2'))
+        self.assertEqual('file_1', os.readlink(
+            os.path.join(self.restore_dir, 'link')))
+
+    def test_unchanged_files_are_linked(self):
+        first = self.backup()
+        self.write('file_1', b'changed')
+        os.remove(os.path.join(self.files_dir, 'dir', 'file_2'))
+        self.write('dir/file_3', b'new')
+        second = self.backup()
+        self.assertEqual(0, second.level)
+        self.assertEqual(0, self.engine.stats['files_linked'])
+        third = self.backup()
+        self.assertEqual(2, self.engine.stats['files_linked'])
+        self.assertEqual(0, self.engine.stats['files_copied'])
+        self.assertTrue(os.path.samefile(self.tree_file(second, 'file_1'),
+                                         self.tree_file(third, 'file_1')))
+        self.assertFalse(os.path.samefile(self.tree_file(first, 'file_1'),
+                                          self.tree_file(second, 'file_1')))
+        # removing a backup keeps the files of the others
+        self.storage.remove_older_than(third.timestamp, 'host_backup')
+        self.assertEqual([third.timestamp],
+                         [b.timestamp for b in
+                          self.storage.find_all('host_backup')])
+        self.engine.restore(self.storage.find_one('host_backup'),
+                            self.restore_dir, False)
+        self.assertEqual(b'changed', self.read('file_1'))
+        self.assertEqual(b'new', self.read('dir/file_3'))
+        self.assertFalse(os.path.exists(
+            os.path.join(self.restore_dir, 'dir', 'file_2')))
+
+    @unittest.skipIf(six.PY2, 'nanosecond times need python 3')
+    def test_copied_file_is_linkable(self):
+        path = os.path.join(self.files_dir, 'file_1')
+        # a modification time a float cannot hold exactly
+        os.utime(path, ns=(1460000000123456789, 1460000000123456789))
+        copy = os.path.join(self.tmp_dir, 'copy')
+        shutil.copyfile(path, copy)
+        hardlink_engine.copy_attributes(os.lstat(path), copy)
+        self.assertTrue(self.engine.linkable(copy, os.lstat(path)))
+        os.utime(path, ns=(1460000000123456789, 1460000000123456790))
+        self.assertFalse(self.engine.linkable(copy, os.lstat(path)))
+
+    def test_restore_point_in_time(self):
+        self.backup()
+        self.write('file_1', b'changed')
+        self.backup()
+        self.engine.restore(self.storage.find_one('host_backup', 1001),
+                            self.restore_dir, False)
+        self.assertEqual(b'hello', self.read('file_1'))
+
+    def test_interrupted_backup_is_not_listed(self):
+        self.engine.write_tree = mock.Mock(side_effect=IOError("fail"))
+        self.assertRaises(IOError, self.backup)
+        self.assertEqual([], self.storage.find_all('host_backup'))
+
+    def test_dry_run(self):
+        self.backup()
+        self.write('file_1', b'changed')
+        self.engine.dry_run = True
+        self.backup()
+        self.assertEqual({'files_linked': 1, 'files_copied': 1,
+                          'bytes_copied': len(b'changed')},
+                         self.engine.stats)
+        self.assertEqual([1001], [b.timestamp for b in
+                                  self.storage.find_all('host_backup')])
+        self.assertEqual(
+            [], os.listdir(os.path.join(self.storage.storage_directory,
+                                        hardlink_engine.PARTIAL_DIRECTORY)))
+
+    def test_requires_local_storage(self):
+        self.assertRaises(ValueError, hardlink_engine.HardlinkBackupEngine,
+                          'gzip', '', '', mock.MagicMock(), 1024)
@@ -0,0 +1,122 @@
+# (c) Copyright 2016 Hewlett-Packard Enterprise Development Company, L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import io
+import os
+import tempfile
+import unittest
+
+import mock
+
+from freezer.engine.image import image_engine
+from freezer.engine.native import native_engine
+from freezer.tests import commons
+
+
+class TestImageBackupEngine(commons.EngineTestCase):
+
+    def setUp(self):
+        super(TestImageBackupEngine, self).setUp()
+        self.image = bytearray(os.urandom(4096) + b'\0' * 2048 +
+                               os.urandom(1500))
+        self.write('disk.img', self.image)
+        storage = mock.MagicMock()
+        storage.work_dir = self.tmp_dir
+        self.engine = image_engine.ImageBackupEngine(
+            'gzip', '', '', storage, 1024)
+        self.engine.block_size = 1024
+        self.backup = mock.MagicMock()
+
+    def test_backup_restore(self):
+        level_0 = self.backup_level()
+        self.assertEqual(6, self.engine.stats['blocks_changed'])
+        self.assertEqual(2, self.engine.stats['blocks_zero'])
+        self.restore_level(level_0)
+        self.assertEqual(bytes(self.image), self.read('disk.img'))
+
+    def test_changed_blocks(self):
+        level_0 = self.backup_level()
+        self.image[100:110] = b'x' * 10
+        self.image[2048:3072] = b'\0' * 1024
+        self.image += b'tail'
+        self.write('disk.img', self.image)
+        self.write('other.img', b'other')
+        level_1 = self.backup_level()
+        self.assertEqual(2, self.engine.stats['files_changed'])
+        # first block, last block and the new file
+        self.assertEqual(3, self.engine.stats['blocks_changed'])
+        self.assertEqual(1, self.engine.stats['blocks_zero'])
+        self.assertEqual(5, self.engine.stats['blocks_unchanged'])
+        os.remove(os.path.join(self.files_dir, 'other.img'))
+        level_2 = self.backup_level()
+        self.assertEqual(1, self.engine.stats['files_deleted'])
+        self.assertEqual(1, self.engine.stats['files_unchanged'])
+        self.restore_level(level_0)
+        self.restore_level(level_1)
+        self.assertEqual(bytes(self.image), self.read('disk.img'))
+        self.assertEqual(b'other', self.read('other.img'))
+        self.restore_level(level_2)
+        self.assertFalse(os.path.exists(
+            os.path.join(self.restore_dir, 'other.img')))
+
+    def test_read_error(self):
+        level_0 = self.backup_level()
+        previous = bytes(self.image)
+        self.image[0:10] = b'x' * 10
+        self.image[-10:] = b'y' * 10
+        self.write('disk.img', self.image)
+
+        class FailingReader(native_engine.PaddedReader):
+            # the last block cannot be read
+            def read(self, size=-1):
+                if self.file_obj.tell() >= 6 * 1024:
+                    raise IOError("Input/output error")
+                return super(FailingReader, self).read(size)
+        with mock.patch.object(native_engine, 'PaddedReader',
+                               FailingReader):
+            level_1 = self.backup_level()
+        self.assertEqual(0, self.engine.stats['blocks_changed'])
+        level_2 = self.backup_level()
+        self.assertEqual(2, self.engine.stats['blocks_changed'])
+        self.restore_level(level_0)
+        self.restore_level(level_1)
+        # no block of the file that could not be read is restored
+        self.assertEqual(previous, self.read('disk.img'))
+        self.restore_level(level_2)
+        self.assertEqual(bytes(self.image), self.read('disk.img'))
+
+    def test_truncated_stream(self):
+        level_0 = self.backup_level()
+        self.assertRaises(ValueError, self.restore_level, level_0[:-10])
+
+    def test_not_an_image_stream(self):
+        self.assertRaises(ValueError, self.restore_level, b'garbage')
+
+
+class TestPunchHole(unittest.TestCase):
+
+    def test_punch_hole(self):
+        with tempfile.TemporaryFile() as f:
+            f.write(b'x' * 8192)
+            image_engine.punch_hole(f, 4096, 2048)
+            f.seek(0)
+            self.assertEqual(b'x' * 4096 + b'\0' * 2048 + b'x' * 2048,
+                             f.read())
+
+    def test_punch_hole_without_fallocate(self):
+        f = io.BytesIO(b'x' * 10)
+        with mock.patch.object(image_engine, '_fallocate', None):
+            image_engine.punch_hole(f, 2, 3)
+        self.assertEqual(b'xx\0\0\0xxxxx', f.getvalue())
@@ -0,0 +1,70 @@
+# (c) Copyright 2016 Hewlett-Packard Enterprise Development Company, L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import io
+import os
+
+import mock
+
+from freezer.engine.native import native_engine
+from freezer.tests import commons
+
+
+class TestNativeBackupEngine(commons.EngineTestCase):
+
+    def setUp(self):
+        super(TestNativeBackupEngine, self).setUp()
+        self.write('file_1', b'hello')
+        self.write('dir/file_2', b'world' * 1000)
+        self.engine = native_engine.NativeBackupEngine(
+            'gzip', '', '', mock.MagicMock(), 1024)
+        self.backup = mock.MagicMock()
+        self.backup.metadata.return_value = {}
+
+    def test_backup_restore(self):
+        self.restore_level(self.backup_level())
+        self.assertEqual(b'hello', self.read('file_1'))
+        self.assertEqual(b'world' * 1000, self.read('dir/file_2'))
+        self.assertEqual(4, self.engine.stats['files_changed'])
+
+    def test_incremental(self):
+        level_0 = self.backup_level()
+        os.remove(os.path.join(self.files_dir, 'file_1'))
+        self.write('file_3', b'new')
+        level_1 = self.backup_level()
+        self.assertEqual(1, self.engine.stats['files_deleted'])
+        self.assertEqual(1, self.engine.stats['files_unchanged'])
+        self.restore_level(level_0)
+        self.restore_level(level_1)
+        self.assertFalse(os.path.exists(
+            os.path.join(self.restore_dir, 'file_1')))
+        self.assertEqual(b'new', self.read('file_3'))
+        self.assertEqual(b'world' * 1000, self.read('dir/file_2'))
+
+    def test_unreadable_file(self):
+        with self.unreadable('file_1'):
+            level_0 = self.backup_level()
+        # the file is not in the manifest, the next level adds it
+        level_1 = self.backup_level()
+        self.restore_level(level_0)
+        self.assertFalse(os.path.exists(
+            os.path.join(self.restore_dir, 'file_1')))
+        self.restore_level(level_1)
+        self.assertEqual(b'hello', self.read('file_1'))
+
+    def test_padded_reader(self):
+        reader = native_engine.PaddedReader(io.BytesIO(b'ab'), 4)
+        self.assertEqual(b'ab\0\0', reader.read(10))
+        self.assertEqual(b'', reader.read(10))
@@ -0,0 +1,199 @@
+# (c) Copyright 2016 Hewlett-Packard Enterprise Development Company, L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import mock
+from six.moves import queue
+
+from freezer.engine import engine
+from freezer.utils import compress
+from freezer.utils import crypt
+from freezer.utils import streaming
+
+
+class FakeEngine(engine.BackupEngine):
+
+    compression_algo = 'gzip'
+    chunk_size = 16
+
+    def __init__(self):
+        self.restored = []
+        self.framed = []
+        self.decrypted = []
+
+    def post_backup(self, backup, manifest_file):
+        pass
+
+    def backup_data(self, backup_path, manifest_path):
+        return iter([b"ab", b"cd"])
+
+    def restore_level(self, restore_path, read_pipe, backup, except_queue,
+                      framed=False, decrypted=False):
+        try:
+            self.restored.append(read_pipe.read())
+            self.framed.append(framed)
+            self.decrypted.append(decrypted)
+        finally:
+            read_pipe.close()
+
+
+class TestBackupEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = FakeEngine()
+        self.work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work_dir)
+        self.backup = mock.MagicMock()
+        self.backup.storage.work_dir = self.work_dir
+        self.backup.storage.backup_blocks.return_value = [b"ab", b"cd"]
+
+    def spool(self, blocks):
+        spool = streaming.RichQueue(len(blocks) + 1)
+        spool.put_messages(blocks)
+        return spool
+
+    def test_read_blocks(self):
+        read_fd, write_fd = os.pipe()
+        except_queue = queue.Queue()
+        self.engine.read_blocks(self.spool([b"ab", b"cd"]),
+                                os.fdopen(write_fd, 'wb', 0), except_queue)
+        with os.fdopen(read_fd, 'rb') as read_pipe:
+            self.assertEqual(b"abcd", read_pipe.read())
+        self.assertTrue(except_queue.empty())
+
+    def test_read_blocks_closed_reader(self):
+        read_fd, write_fd = os.pipe()
+        os.close(read_fd)
+        except_queue = queue.Queue()
+        spool = self.spool([b"ab", b"cd"])
+        self.engine.read_blocks(spool, os.fdopen(write_fd, 'wb', 0),
+                                except_queue)
+        self.assertTrue(except_queue.empty())
+        self.assertTrue(spool.empty())
+
+    def test_download_levels_error(self):
+        self.backup.storage.backup_blocks.side_effect = Exception("fail")
+        spools = queue.Queue()
+        except_queue = queue.Queue()
+        self.engine.download_levels([self.backup, self.backup], spools,
+                                    threading.Event(), except_queue)
+        self.assertEqual(1, spools.qsize())
+        spool, decoding = spools.get()
+        self.assertRaises(Exception, spool.check_stop)
+        self.assertEqual({}, decoding)
+        self.assertFalse(except_queue.empty())
+
+    @mock.patch('freezer.engine.engine.utils')
+    def test_restore_download_error(self, mock_utils):
+        self.backup.storage.backup_blocks.side_effect = Exception("fail")
+        backup = mock.MagicMock()
+        backup.level = 1
+        backup.full_backup.increments = {0: self.backup, 1: self.backup}
+        self.assertRaises(engine.EngineException, self.engine.restore,
+                          backup, "/tmp/restore", True)
+
+    @mock.patch('freezer.engine.engine.utils')
+    def test_restore(self, mock_utils):
+        backup = mock.MagicMock()
+        backup.level = 1
+        backup.full_backup.increments = {0: self.backup, 1: self.backup}
+        self.engine.restore(backup, "/tmp/restore", True)
+        self.assertEqual([b"abcd", b"abcd"], self.engine.restored)
+
+    def test_backup_stream_framed(self):
+        self.engine.compression_workers = 2
+        rich_queue = streaming.RichQueue(10)
+        self.engine.backup_stream("/tmp", rich_queue, None)
+        blocks = list(rich_queue.get_messages())
+        self.assertTrue(compress.is_framed(blocks[0]))
+        self.assertEqual(
+            [b"ab", b"cd"],
+            list(compress.FrameDecompressor(1).decompress(blocks)))
+        self.assertEqual(2, self.engine.framing["compression_frames"])
+
+    @mock.patch('freezer.engine.engine.utils')
+    def test_restore_prefetch(self, mock_utils):
+        downloaded = threading.Event()
+
+        def backup_blocks(increment):
+            for _ in range(10):
+                yield b"ab"
+            if increment.level == 2:
+                downloaded.set()
+        increments = {}
+        for level in range(3):
+            increments[level] = mock.MagicMock(level=level)
+            increments[level].storage = self.backup.storage
+        self.backup.storage.backup_blocks.side_effect = backup_blocks
+        restore_level = self.engine.restore_level
+        waited = []
+
+        def wait_restore_level(*args, **kwargs):
+            # the levels ahead are downloaded before the first is restored
+            waited.append(downloaded.wait(5))
+            restore_level(*args, **kwargs)
+        self.engine.restore_level = wait_restore_level
+        self.engine.restore_prefetch = 2
+        backup = mock.MagicMock()
+        backup.level = 2
+        backup.full_backup.increments = increments
+        self.engine.restore(backup, "/tmp/restore", True)
+        self.assertEqual([True, True, True], waited)
+        self.assertEqual([b"ab" * 10] * 3, self.engine.restored)
+
+    @mock.patch('freezer.engine.engine.utils')
+    def test_restore_framed(self, mock_utils):
+        compressor = compress.FrameCompressor('gzip', 1, 16)
+        self.backup.storage.backup_blocks.side_effect = (
+            lambda increment: list(compressor.compress([b"ab", b"cd"])))
+        backup = mock.MagicMock()
+        backup.level = 1
+        backup.full_backup.increments = {0: self.backup, 1: self.backup}
+        self.engine.restore(backup, "/tmp/restore", True)
+        self.assertEqual([b"abcd", b"abcd"], self.engine.restored)
+        self.assertEqual([True, True], self.engine.framed)
+
+    @mock.patch('freezer.utils.crypt.KDF_ITERATIONS', 10)
+    @mock.patch('freezer.engine.engine.utils')
+    def test_restore_encrypted(self, mock_utils):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        self.engine.encrypt_pass_file = os.path.join(temp_dir, 'pass')
+        with open(self.engine.encrypt_pass_file, 'w') as f:
+            f.write('secret')
+        self.engine.compression_workers = 2
+        rich_queue = streaming.RichQueue(10)
+        self.engine.backup_stream("/tmp", rich_queue, None)
+        blocks = list(rich_queue.get_messages())
+        self.assertTrue(crypt.is_encrypted(blocks[0]))
+        self.assertEqual("aes-256-gcm",
+                         self.engine.framing["encryption_cipher"])
+        self.backup.storage.backup_blocks.return_value = blocks
+        backup = mock.MagicMock()
+        backup.level = 0
+        backup.full_backup.increments = {0: self.backup}
+        self.engine.restore(backup, "/tmp/restore", True)
+        self.assertEqual([b"abcd"], self.engine.restored)
+        self.assertEqual([True], self.engine.framed)
+        self.assertEqual([True], self.engine.decrypted)
+
+    def test_level_blocks_encrypted_without_key(self):
+        self.backup.storage.backup_blocks.return_value = [crypt.MAGIC]
+        self.assertRaises(Exception, self.engine.level_blocks, self.backup)
@@ -168,6 +168,24 @@ class TestBackup(unittest.TestCase):
         assert result.timestamp == 100
         assert result.level == 0
 
+    def test__get_backups_from_iterator(self):
+        names = iter(["host_backup_200_1", "tar_metadata_host_backup_100_0",
+                      "host_backup_300_0", "host_backup_100_0",
+                      "tar_metadata_host_backup_400_0"])
+        result = base.Backup.parse_backups(names, None)
+        self.assertEqual([100, 300], [b.timestamp for b in result])
+        self.assertTrue(result[0].tar_meta)
+        self.assertFalse(result[1].tar_meta)
+        self.assertEqual(200, result[0].latest_update.timestamp)
+        self.assertEqual({0: result[0].latest_update},
+                         result[0].latest_update.increments)
+
+    def test__get_backups_increment_of_other_name(self):
+        result = base.Backup.parse_backups(
+            ["host_a_100_0", "host_b_200_1"], None)
+        self.assertEqual(1, len(result))
+        self.assertEqual(1, len(result[0].increments))
+
     def test_remove_older_than(self):
         t = local.LocalStorage(None, None, skip_prepare=True)
         t.find_all = mock.Mock()
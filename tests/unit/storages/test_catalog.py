@@ -0,0 +1,104 @@
+# (c) Copyright 2016 Hewlett-Packard Enterprise Development Company, L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from freezer.storage import catalog
+from freezer.storage import local
+
+
+class TestCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.catalog = catalog.Catalog(
+            os.path.join(self.tmp_dir, catalog.CATALOG_FILE), 60)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_not_listed(self):
+        self.catalog.add('storage', 'host_backup', 1000, 0, True)
+        self.assertIsNone(self.catalog.backups('storage', 'host_backup'))
+
+    def test_reconcile(self):
+        self.catalog.reconcile('storage', 'host_backup',
+                               [(1000, 0, True), (2000, 1, True)])
+        self.catalog.reconcile('storage', 'host_backup',
+                               [(2000, 1, True), (3000, 0, False)])
+        self.assertEqual([(2000, 1, True), (3000, 0, False)],
+                         self.catalog.backups('storage', 'host_backup'))
+        self.assertIsNone(self.catalog.backups('other', 'host_backup'))
+
+    def test_expired(self):
+        self.catalog.reconcile('storage', 'host_backup', [(1000, 0, True)])
+        with mock.patch('freezer.storage.catalog.time.time') as now:
+            now.return_value = os.path.getmtime(self.catalog.path) + 3600
+            self.assertIsNone(self.catalog.backups('storage', 'host_backup'))
+
+    def test_add_remove(self):
+        self.catalog.reconcile('storage', 'host_backup', [(1000, 0, True)])
+        self.catalog.add('storage', 'host_backup', 2000, 1, True)
+        self.catalog.add('storage', 'host_backup', 3000, 0, True)
+        self.catalog.remove('storage', 'host_backup', [1000, 2000])
+        self.assertEqual([(3000, 0, True)],
+                         self.catalog.backups('storage', 'host_backup'))
+
+
+class TestStorageCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.storage = local.LocalStorage(
+            os.path.join(self.tmp_dir, 'storage'),
+            os.path.join(self.tmp_dir, 'work'))
+        self.storage.set_catalog(catalog.Catalog(
+            os.path.join(self.tmp_dir, catalog.CATALOG_FILE), 3600))
+        self.list_backups = self.storage.list_backups
+        self.storage.list_backups = mock.Mock(side_effect=self.list_backups)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def store(self, time_stamp):
+        backup = self.storage.create_backup(
+            'host_backup', False, 5, False, False, time_stamp=time_stamp)
+        self.storage.create_dirs(self.storage._zero_backup_dir(backup))
+        open(self.storage.backup_to_file_path(backup), 'w').close()
+        open(self.storage.meta_file_abs_path(backup), 'w').close()
+        self.storage.add_to_catalog(backup, tar_meta=True)
+        return backup
+
+    def test_backups_from_catalog(self):
+        self.store(1000)
+        self.store(2000)
+        self.store(3000)
+        # the storage is listed only by the first backup
+        self.assertEqual(1, self.storage.list_backups.call_count)
+        backups = self.storage.find_all('host_backup')
+        self.assertEqual(1, self.storage.list_backups.call_count)
+        self.assertEqual(self.list_backups('host_backup'), backups)
+        self.assertEqual(2, backups[0].latest_update.level)
+        self.assertEqual(3000, self.storage.find_one('host_backup').timestamp)
+
+    def test_remove_older_than(self):
+        self.store(1000)
+        self.storage.remove_older_than(5000, 'host_backup')
+        self.assertEqual([], self.storage.find_all('host_backup'))
+        self.assertEqual(1, self.storage.list_backups.call_count)
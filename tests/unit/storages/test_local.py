@@ -13,11 +13,15 @@
 # limitations under the License.
 
 
+import os
 import tempfile
 import shutil
 import unittest
 
+import mock
+
 from freezer.storage import local
+from freezer.utils import compress
 from freezer.utils import utils
 
 
@@ -70,3 +74,76 @@ class TestLocalStorage(unittest.TestCase):
         backup_dir, files_dir, work_dir = self.create_dirs()
         storage = local.LocalStorage(backup_dir, work_dir)
         storage.info()
+
+
+class TestLocalStorageMetaFileCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.storage = local.LocalStorage(
+            os.path.join(self.tmp_dir, 'storage'),
+            os.path.join(self.tmp_dir, 'work'))
+        utils.create_dir(self.storage.work_dir)
+        self.backup = self.storage.create_backup(
+            'host_backup', False, 5, False, False, time_stamp=1000)
+        self.storage.create_dirs(self.storage._zero_backup_dir(self.backup))
+        self.meta_file = os.path.join(self.tmp_dir, 'meta')
+        with open(self.meta_file, 'w') as f:
+            f.write('level 0')
+        self.storage.upload_meta_file(self.backup, self.meta_file)
+        open(self.storage.backup_to_file_path(self.backup), 'w').close()
+        self.storage.get_file = mock.Mock(side_effect=shutil.copyfile)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def increment(self, time_stamp=2000):
+        return self.storage.create_backup(
+            'host_backup', False, 5, False, False, time_stamp=time_stamp)
+
+    def read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def test_cached_meta_file(self):
+        meta_path = self.storage.download_meta_file(self.increment())
+        self.assertEqual('level 0', self.read(meta_path))
+        self.assertFalse(self.storage.get_file.called)
+        # the engine rewrites the meta file, the cache keeps its own copy
+        with open(meta_path, 'w') as f:
+            f.write('level 1')
+        self.assertEqual('level 0', self.read(self.storage.meta_cache_path(
+            self.backup)))
+
+    def test_meta_file_is_compressed(self):
+        remote_path = self.storage.meta_file_abs_path(self.backup)
+        self.assertTrue(compress.is_gzip_file(remote_path))
+        self.assertFalse(os.path.exists('{0}.gz'.format(self.meta_file)))
+
+    def test_stale_cache(self):
+        remote_path = self.storage.meta_file_abs_path(self.backup)
+        with open(remote_path, 'w') as f:
+            f.write('changed level 0')
+        meta_path = self.storage.download_meta_file(self.increment())
+        self.assertEqual('changed level 0', self.read(meta_path))
+        self.assertEqual(1, self.storage.get_file.call_count)
+        # the downloaded version is cached
+        self.storage.download_meta_file(self.increment(3000))
+        self.assertEqual(1, self.storage.get_file.call_count)
+
+    def test_missing_cache(self):
+        shutil.rmtree(os.path.join(self.storage.work_dir,
+                                   self.storage.META_CACHE_DIRECTORY))
+        meta_path = self.storage.download_meta_file(self.increment())
+        self.assertEqual('level 0', self.read(meta_path))
+        self.assertEqual(1, self.storage.get_file.call_count)
+
+    def test_older_backups_are_removed(self):
+        backup = self.storage.create_backup(
+            'host_backup', True, 5, False, False, time_stamp=5000)
+        self.storage.create_dirs(self.storage._zero_backup_dir(backup))
+        self.storage.upload_meta_file(backup, self.meta_file)
+        self.assertEqual(
+            [backup.tar(), backup.tar() + '.json'],
+            sorted(os.listdir(os.path.join(
+                self.storage.work_dir, self.storage.META_CACHE_DIRECTORY))))
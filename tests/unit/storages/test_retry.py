@@ -0,0 +1,132 @@
+# (c) Copyright 2016 Hewlett-Packard Enterprise Development Company, L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import unittest
+import uuid
+
+import mock
+import requests.exceptions
+
+from freezer.storage import retry
+
+
+class HttpError(Exception):
+
+    def __init__(self, http_status):
+        super(HttpError, self).__init__(http_status)
+        self.http_status = http_status
+
+
+@mock.patch('freezer.storage.retry.time.sleep')
+class TestRetryPolicy(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = retry.RetryPolicy(max_attempts=3, base_delay=1,
+                                        max_delay=4, breaker_threshold=5)
+        # every test has its own circuit breaker
+        self.endpoint = str(uuid.uuid4())
+
+    def test_transient(self, sleep):
+        self.assertTrue(retry.is_transient(HttpError(503)))
+        self.assertTrue(retry.is_transient(
+            requests.exceptions.ConnectionError()))
+        self.assertFalse(retry.is_transient(HttpError(404)))
+        self.assertFalse(retry.is_transient(ValueError()))
+
+    def test_retry_transient(self, sleep):
+        operation = mock.Mock(side_effect=[HttpError(503), HttpError(500),
+                                           'result'])
+        self.assertEqual('result',
+                         self.policy.call(self.endpoint, operation, 'a'))
+        self.assertEqual(3, operation.call_count)
+        operation.assert_called_with('a')
+        self.assertEqual(2, sleep.call_count)
+        self.assertTrue(sleep.call_args_list[0][0][0] <= 1)
+        self.assertTrue(sleep.call_args_list[1][0][0] <= 2)
+        self.assertEqual(2, self.policy.stats()['storage_retries'])
+
+    def test_not_transient(self, sleep):
+        operation = mock.Mock(side_effect=HttpError(404))
+        self.assertRaises(HttpError, self.policy.call, self.endpoint,
+                          operation)
+        self.assertEqual(1, operation.call_count)
+        self.assertEqual(0, self.policy.stats()['storage_retries'])
+
+    def test_max_attempts(self, sleep):
+        operation = mock.Mock(side_effect=HttpError(503))
+        self.assertRaises(HttpError, self.policy.call, self.endpoint,
+                          operation)
+        self.assertEqual(3, operation.call_count)
+
+    def test_circuit_breaker(self, sleep):
+        operation = mock.Mock(side_effect=HttpError(503))
+        self.assertRaises(HttpError, self.policy.call, self.endpoint,
+                          operation)
+        self.assertRaises(retry.CircuitOpen, self.policy.call,
+                          self.endpoint, operation)
+        self.assertEqual(5, operation.call_count)
+        # other endpoints are not affected
+        self.assertEqual('result', self.policy.call(
+            'other' + self.endpoint, mock.Mock(return_value='result')))
+        later = retry.time.time() + 3600
+        with mock.patch('freezer.storage.retry.time.time') as now:
+            now.return_value = later
+            operation.side_effect = None
+            operation.return_value = 'result'
+            self.assertEqual('result',
+                             self.policy.call(self.endpoint, operation))
+        self.assertEqual(0, retry.circuit_breaker(
+            self.endpoint, 5, 300).failures)
+
+    def test_half_open_single_probe(self, sleep):
+        breaker = retry.circuit_breaker(self.endpoint, 5, 300)
+        for _ in range(5):
+            breaker.failure()
+        probing = threading.Event()
+        release = threading.Event()
+
+        def probe():
+            probing.set()
+            release.wait(10)
+            return 'result'
+        results = []
+        later = retry.time.time() + 3600
+        with mock.patch('freezer.storage.retry.time.time') as now:
+            now.return_value = later
+            thread = threading.Thread(target=lambda: results.append(
+                self.policy.call(self.endpoint, probe)))
+            thread.start()
+            self.assertTrue(probing.wait(10))
+            # other callers fail until the probe completes
+            self.assertRaises(retry.CircuitOpen, self.policy.call,
+                              self.endpoint, mock.Mock())
+            release.set()
+            thread.join(10)
+            self.assertEqual(['result'], results)
+            self.assertEqual('result', self.policy.call(
+                self.endpoint, mock.Mock(return_value='result')))
+
+    def test_half_open_probe_fails(self, sleep):
+        breaker = retry.circuit_breaker(self.endpoint, 5, 300)
+        for _ in range(5):
+            breaker.failure()
+        later = retry.time.time() + 3600
+        with mock.patch('freezer.storage.retry.time.time') as now:
+            now.return_value = later
+            operation = mock.Mock(side_effect=HttpError(503))
+            self.assertRaises(retry.CircuitOpen, self.policy.call,
+                              self.endpoint, operation)
+            self.assertEqual(1, operation.call_count)
+            self.assertEqual(later, breaker.opened_at)
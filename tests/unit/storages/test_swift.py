@@ -14,11 +14,26 @@
 # limitations under the License.
 
 
+import datetime
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
 import unittest
 
+import mock
+import six
+from freezer.engine.native import native_engine
 from freezer.openstack import osclients
 from freezer.storage import swift
 from freezer.storage import base
+from freezer.storage import catalog
+from freezer.storage.exceptions import StorageException
+from freezer.utils import compress
+from freezer.utils import streaming
 
 
 class TestSwiftStorage(unittest.TestCase):
@@ -107,3 +122,839 @@ class TestSwiftStorage(unittest.TestCase):
         self.backup_2.add_increment(self.increment_2)
         self.assertEqual(self.backup, backups[0])
         self.assertEqual(self.backup_2, backups[1])
+
+
+class TestSwiftStorageWriteBackup(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.client_manager = mock.MagicMock()
+        self.storage = swift.SwiftStorage(
+            self.client_manager, "freezer_container", self.tmp_dir, 2,
+            skip_prepare=True, upload_workers=4)
+        self.backup = base.Backup(self.storage, "hostname_backup", 1000)
+        self.connection = self.client_manager.new_swift.return_value
+        self.manifest = self.client_manager.get_swift.return_value.put_object
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_backup(self, messages):
+        rich_queue = streaming.RichQueue(len(messages) + 1)
+        rich_queue.put_messages(messages)
+        self.storage.write_backup(rich_queue, self.backup)
+
+    def uploaded(self):
+        # the manifest is uploaded with keyword arguments
+        return dict((c[0][1], c[0][2])
+                    for c in self.connection.put_object.call_args_list
+                    if c[0])
+
+    def test_write_backup_parallel(self):
+        messages = ['{0:02d}'.format(i).encode('ascii') for i in range(20)]
+        self.write_backup(messages)
+        uploaded = self.uploaded()
+        self.assertEqual(20, len(uploaded))
+        for i, message in enumerate(messages):
+            self.assertEqual(
+                message, uploaded[self.storage.segment_path(self.backup, i)])
+        self.manifest.assert_called_once_with(
+            container="freezer_container", obj="hostname_backup_1000_0",
+            contents=u'', headers={'x-object-manifest':
+                                   u'freezer_container_segments/'
+                                   u'hostname_backup_1000_0'})
+        self.assertEqual([], os.listdir(self.tmp_dir))
+
+    def test_write_backup_parallel_error(self):
+        self.storage.upload_chunk = mock.Mock(side_effect=Exception("fail"))
+        self.assertRaises(Exception, self.write_backup,
+                          [b"aa", b"bb", b"cc"])
+        self.assertFalse(self.manifest.called)
+
+    def test_write_backup_segments(self):
+        self.serial()
+        self.storage.max_segment_size = 5
+        uploaded = {}
+
+        def put_object(container=None, path=None, contents=None, **kwargs):
+            if 'headers' in kwargs:
+                # the manifest
+                return
+            if not isinstance(contents, bytes):
+                contents = contents.read()
+            self.assertEqual(hashlib.md5(contents).hexdigest(),
+                             kwargs['etag'])
+            self.assertEqual(len(contents), kwargs['content_length'])
+            uploaded[path] = contents
+        self.connection.put_object.side_effect = put_object
+        self.write_backup([b"abc", b"defgh", b"ij", b"k"])
+        self.assertEqual(
+            {self.storage.segment_path(self.backup, 0): b"abcde",
+             self.storage.segment_path(self.backup, 1): b"fghij",
+             self.storage.segment_path(self.backup, 2): b"k"},
+            uploaded)
+        self.assertEqual([], os.listdir(self.tmp_dir))
+
+    def test_framed_stream_segments(self):
+        self.serial()
+        self.storage.max_segment_size = 4096
+        uploaded = {}
+
+        def put_object(container=None, path=None, contents=None, **kwargs):
+            if 'headers' not in kwargs:
+                uploaded[path] = contents.read(-1)
+        self.connection.put_object.side_effect = put_object
+        # framed blocks are a little larger than the segments
+        compressor = compress.FrameCompressor('gzip', 1, 4096, 1000)
+        messages = list(compressor.compress([os.urandom(20000)]))
+        self.assertTrue(all(len(m) > 4096 for m in messages[:-1]))
+        with mock.patch.object(swift.tempfile, 'mkstemp') as mkstemp:
+            self.write_backup(messages)
+        self.assertFalse(mkstemp.called)
+        self.assertEqual(b''.join(messages), b''.join(
+            uploaded[self.storage.segment_path(self.backup, i)]
+            for i in range(len(uploaded))))
+
+    def test_large_segment_spooled(self):
+        segment = swift.Segment(0, 0, self.tmp_dir, memory_size=4)
+        segment.add(b'ab', b'ab')
+        segment.add(b'cd', b'cd')
+        self.assertEqual([], os.listdir(self.tmp_dir))
+        self.assertEqual(b'abcd', segment.body().read())
+        segment.add(b'ef', b'ef')
+        segment.close()
+        self.assertEqual(1, len(os.listdir(self.tmp_dir)))
+        with segment.body() as body:
+            self.assertEqual(b'abcdef', body.read())
+        segment.release()
+        self.assertEqual([], os.listdir(self.tmp_dir))
+
+    @mock.patch('freezer.storage.retry.time.sleep')
+    def test_upload_chunk_retry(self, sleep):
+        error = Exception('Service Unavailable')
+        error.http_status = 503
+        self.serial()
+        self.connection.put_object.side_effect = [error, None]
+        self.storage.upload_chunk(b'data', 'segment')
+        self.assertEqual(2, self.connection.put_object.call_count)
+        self.assertEqual(1, sleep.call_count)
+        # the connection and its token are reused
+        self.assertFalse(self.client_manager.create_swift.called)
+        self.assertEqual(1, self.storage.retry_stats()['storage_retries'])
+
+    def interrupt(self, messages, fail_at):
+        upload_chunk = self.storage.upload_chunk
+
+        def upload(data, path, etag=None):
+            if path == self.storage.segment_path(self.backup, fail_at):
+                raise Exception("fail")
+            upload_chunk(data, path, etag)
+        self.storage.upload_chunk = mock.Mock(side_effect=upload)
+        self.assertRaises(Exception, self.write_backup, messages)
+        self.storage.upload_chunk = upload_chunk
+        self.connection.reset_mock()
+
+    def serial(self):
+        self.storage.upload_workers = 1
+        self.connection = self.client_manager.get_swift.return_value
+
+    def stored(self, *messages):
+        self.connection.get_container.return_value = (
+            {}, [{'name': self.storage.segment_path(self.backup, i),
+                  'hash': hashlib.md5(message).hexdigest()}
+                 for i, message in enumerate(messages) if message])
+
+    def test_resume_write_backup(self):
+        self.serial()
+        messages = [b"aa", b"bb", b"cc", b"dd"]
+        self.interrupt(messages, 2)
+        self.stored(b"aa", b"bb")
+        self.write_backup(messages)
+        self.assertEqual(
+            {self.storage.segment_path(self.backup, 2): b"cc",
+             self.storage.segment_path(self.backup, 3): b"dd"},
+            self.uploaded())
+        self.assertTrue(self.manifest.called)
+        self.assertEqual([], os.listdir(self.tmp_dir))
+
+    def test_resume_removed_segments(self):
+        self.serial()
+        messages = [b"aa", b"bb", b"cc"]
+        self.interrupt(messages, 2)
+        # the first segment was removed as an orphan
+        self.stored(None, b"bb")
+        self.write_backup(messages)
+        self.assertEqual(
+            {self.storage.segment_path(self.backup, 0): b"aa",
+             self.storage.segment_path(self.backup, 2): b"cc"},
+            self.uploaded())
+
+    def test_resume_changed_stream(self):
+        self.serial()
+        self.interrupt([b"aa", b"bb", b"cc", b"dd"], 3)
+        stale = self.storage.segment_path(self.backup, 2)
+        self.stored(b"aa", b"bb", b"cc")
+        self.connection.get_capabilities.return_value = {}
+        self.write_backup([b"aa", b"xx"])
+        self.assertEqual({self.storage.segment_path(self.backup, 1): b"xx"},
+                         self.uploaded())
+        delete = self.client_manager.new_swift.return_value.delete_object
+        delete.assert_called_once_with(self.storage.segments, stale)
+
+    def test_resume_create_backup(self):
+        self.storage.find_all = mock.Mock(return_value=[])
+        self.interrupt([b"aa", b"bb"], 1)
+        backup = self.storage.create_backup(
+            "hostname_backup", False, 5, False, False, time_stamp=2000)
+        self.assertEqual(1000, backup.timestamp)
+        self.assertEqual(0, backup.level)
+        backup = self.storage.create_backup(
+            "hostname_backup", False, 5, False, False,
+            time_stamp=1000 + swift.SwiftStorage.RESUME_MAX_AGE + 1)
+        self.assertEqual(1000 + swift.SwiftStorage.RESUME_MAX_AGE + 1,
+                         backup.timestamp)
+
+    @unittest.skipIf(swift.fcntl is None, 'journals are not locked')
+    def test_running_upload_not_resumed(self):
+        self.storage.find_all = mock.Mock(return_value=[])
+        self.serial()
+        self.interrupt([b"aa", b"bb"], 1)
+        journal_path = self.storage.upload_journal("hostname_backup").path
+        with open(journal_path, 'rb') as journal_file:
+            journal = journal_file.read()
+        # the upload goes on in another process
+        running = self.storage.upload_journal("hostname_backup")
+        self.assertTrue(running.lock())
+        try:
+            self.backup = self.storage.create_backup(
+                "hostname_backup", False, 5, False, False, time_stamp=2000)
+            self.assertEqual(2000, self.backup.timestamp)
+            self.write_backup([b"aa", b"bb"])
+            self.assertEqual(2, len(self.uploaded()))
+            with open(journal_path, 'rb') as journal_file:
+                self.assertEqual(journal, journal_file.read())
+        finally:
+            running.unlock()
+        backup = self.storage.create_backup(
+            "hostname_backup", False, 5, False, False, time_stamp=3000)
+        self.assertEqual(1000, backup.timestamp)
+
+
+class MemorySwift(object):
+    """
+    Swift connection keeping the objects in memory, dynamic large objects
+    are read from their segments.
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.fail = None
+
+    def put_object(self, container, obj, contents, headers=None, etag=None,
+                   **kwargs):
+        if self.fail and self.fail(container, obj):
+            raise Exception('Upload of {0} failed'.format(obj))
+        if hasattr(contents, 'read'):
+            contents = contents.read()
+        if isinstance(contents, six.text_type):
+            contents = contents.encode('utf-8')
+        contents = bytes(contents)
+        if etag:
+            self.assert_etag(contents, etag)
+        self.objects[(container, obj)] = (contents, dict(headers or {}))
+
+    @staticmethod
+    def assert_etag(contents, etag):
+        if hashlib.md5(contents).hexdigest() != etag:
+            raise Exception('Unprocessable entity')
+
+    def object(self, container, obj):
+        if (container, obj) not in self.objects:
+            error = Exception('Not Found')
+            error.http_status = 404
+            raise error
+        return self.objects[(container, obj)]
+
+    def get_object(self, container, obj, resp_chunk_size=None, **kwargs):
+        contents, headers = self.object(container, obj)
+        if 'x-object-manifest' in headers:
+            segments, prefix = headers['x-object-manifest'].split('/', 1)
+            contents = b''.join(
+                self.objects[(segments, x['name'])][0] for x in
+                self.get_container(segments, prefix=prefix)[1])
+        if resp_chunk_size:
+            contents = iter([contents])
+        return headers, contents
+
+    def head_object(self, container, obj):
+        return {'etag': hashlib.md5(self.object(container, obj)[0])
+                .hexdigest()}
+
+    def get_container(self, container, prefix=u'', delimiter=None,
+                      **kwargs):
+        listing = []
+        for name in sorted(n for c, n in self.objects
+                           if c == container and n.startswith(prefix)):
+            if delimiter and delimiter in name[len(prefix):]:
+                continue
+            contents = self.objects[(container, name)][0]
+            listing.append({'name': name, 'bytes': len(contents),
+                            'hash': hashlib.md5(contents).hexdigest()})
+        return {}, listing
+
+    def delete_object(self, container, obj):
+        self.object(container, obj)
+        del self.objects[(container, obj)]
+
+    def get_capabilities(self):
+        return {}
+
+
+class TestSwiftStorageResume(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.files_dir = os.path.join(self.tmp_dir, 'files')
+        os.makedirs(self.files_dir)
+        for i in range(5):
+            with open(os.path.join(self.files_dir, str(i)), 'wb') as f:
+                f.write(os.urandom(1000))
+        self.connection = MemorySwift()
+        self.client_manager = mock.MagicMock()
+        self.client_manager.get_swift.return_value = self.connection
+        self.client_manager.new_swift.return_value = self.connection
+        self.storage = swift.SwiftStorage(
+            self.client_manager, "freezer_container",
+            os.path.join(self.tmp_dir, 'work'), 1024, skip_prepare=True)
+        self.engine = native_engine.NativeBackupEngine(
+            'gzip', '', '', self.storage, 1024)
+        self.cwd = os.getcwd()
+        os.chdir(self.files_dir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp_dir)
+
+    def backup(self, time_stamp):
+        backup = self.storage.create_backup(
+            'host_backup', False, 5, False, False, time_stamp=time_stamp)
+        self.engine.backup('.', backup)
+        return backup
+
+    def test_resume_level_0(self):
+        # the stream is stored, the upload of the manifest fails
+        self.connection.fail = lambda container, obj: (
+            container == "freezer_container" and obj == "host_backup_1000_0")
+        self.assertRaises(Exception, self.backup, 1000)
+        self.connection.fail = None
+        backup = self.backup(2000)
+        self.assertEqual((1000, 0), (backup.timestamp, backup.level))
+        restore_dir = os.path.join(self.tmp_dir, 'restore')
+        self.engine.restore(self.storage.find_one('host_backup'),
+                            restore_dir, False)
+        self.assertEqual(sorted(os.listdir(self.files_dir)),
+                         sorted(os.listdir(restore_dir)))
+
+
+class TestSwiftStorageBackupBlocks(unittest.TestCase):
+
+    def setUp(self):
+        self.client_manager = mock.MagicMock()
+        self.storage = swift.SwiftStorage(
+            self.client_manager, "freezer_container", "/tmp/", 100,
+            skip_prepare=True, download_workers=3)
+        self.backup = base.Backup(self.storage, "hostname_backup", 1000)
+
+    def test_backup_blocks_parallel(self):
+        names = [self.storage.segment_path(self.backup, i)
+                 for i in range(10)]
+        # the last segment is larger than a read
+        contents = dict((name, name.encode('utf-8')) for name in names)
+        contents[names[-1]] = os.urandom(250)
+        self.client_manager.get_swift.return_value.get_container.\
+            return_value = ({}, [
+                {'name': name, 'bytes': len(contents[name]),
+                 'hash': hashlib.md5(contents[name]).hexdigest()}
+                for name in names])
+        worker = self.client_manager.new_swift.return_value
+
+        def get_object(container, name, headers):
+            if not headers:
+                return {}, contents[name]
+            start, end = headers['Range'][len('bytes='):].split('-')
+            return {}, contents[name][int(start):int(end) + 1]
+        worker.get_object.side_effect = get_object
+        blocks = list(self.storage.backup_blocks(self.backup))
+        self.assertEqual(b''.join(contents[name] for name in names),
+                         b''.join(blocks))
+        self.assertEqual([100, 100, 50], [len(b) for b in blocks[-3:]])
+        self.client_manager.get_swift.return_value.get_container.\
+            assert_called_once_with("freezer_container_segments",
+                                    prefix=u'hostname_backup_1000_0/',
+                                    full_listing=True)
+        # without slo mode the manifest is not probed
+        self.assertFalse(
+            self.client_manager.get_swift.return_value.get_object.called)
+
+    def test_backup_blocks_corrupt_segment(self):
+        name = self.storage.segment_path(self.backup, 0)
+        self.client_manager.get_swift.return_value.get_container.\
+            return_value = ({}, [{'name': name, 'bytes': 4, 'hash': 'x'}])
+        self.client_manager.new_swift.return_value.get_object.return_value = \
+            ({}, b'data')
+        self.assertRaises(StorageException, list,
+                          self.storage.backup_blocks(self.backup))
+
+    def test_backup_blocks_without_segments(self):
+        connection = self.client_manager.get_swift.return_value
+        connection.get_container.return_value = ({}, [])
+        connection.get_object.return_value = ({}, iter(["a", "b"]))
+        self.assertEqual(["a", "b"],
+                         list(self.storage.backup_blocks(self.backup)))
+
+
+class TestSwiftStorageSlo(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.client_manager = mock.MagicMock()
+        self.storage = swift.SwiftStorage(
+            self.client_manager, "freezer_container", self.tmp_dir, 2,
+            skip_prepare=True, download_workers=2, use_slo=True)
+        self.backup = base.Backup(self.storage, "hostname_backup", 1000)
+        self.connection = self.client_manager.get_swift.return_value
+        self.connection.get_capabilities.return_value = {
+            'slo': {'max_manifest_segments': 1000}}
+        self.segments = {
+            self.storage.segment_path(self.backup, 0): b'abc',
+            self.storage.segment_path(self.backup, 1): b'de'}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_backup(self, messages):
+        rich_queue = streaming.RichQueue(len(messages) + 1)
+        rich_queue.put_messages(messages)
+        self.storage.write_backup(rich_queue, self.backup)
+
+    def manifest(self):
+        return [{'name': u'/freezer_container_segments/{0}'.format(name),
+                 'bytes': len(data),
+                 'hash': hashlib.md5(data).hexdigest()}
+                for name, data in sorted(self.segments.items())]
+
+    def test_write_backup(self):
+        self.write_backup([b'ab', b'cd'])
+        self.connection.put_object.assert_called_with(
+            "freezer_container", "hostname_backup_1000_0",
+            json.dumps([
+                {'path': u'/freezer_container_segments/{0}'.format(
+                    self.storage.segment_path(self.backup, i)),
+                 'etag': hashlib.md5(data).hexdigest(), 'size_bytes': 2}
+                for i, data in enumerate([b'ab', b'cd'])]),
+            headers={}, query_string='multipart-manifest=put')
+
+    def test_not_supported(self):
+        self.connection.get_capabilities.return_value = {}
+        self.write_backup([b'ab'])
+        self.connection.put_object.assert_called_with(
+            container="freezer_container", obj="hostname_backup_1000_0",
+            contents=u'', headers={'x-object-manifest':
+                                   u'freezer_container_segments/'
+                                   u'hostname_backup_1000_0'})
+
+    def get_object(self, container, name, headers):
+        self.assertEqual("freezer_container_segments", container)
+        data = self.segments[name]
+        if headers:
+            start, end = headers['Range'][len('bytes='):].split('-')
+            return {}, data[int(start):int(end) + 1]
+        return {}, data
+
+    def backup_blocks(self):
+        self.connection.get_object.return_value = (
+            {'x-static-large-object': 'True'},
+            json.dumps(self.manifest()).encode('utf-8'))
+        worker = self.client_manager.new_swift.return_value
+        worker.get_object.side_effect = self.get_object
+        return b''.join(self.storage.backup_blocks(self.backup))
+
+    def test_backup_blocks(self):
+        self.assertEqual(b'abcde', self.backup_blocks())
+        # segments are read from the manifest, without listing
+        self.assertFalse(self.connection.get_container.called)
+        worker = self.client_manager.new_swift.return_value
+        self.assertEqual(
+            [{'Range': 'bytes=0-1'}, {'Range': 'bytes=2-2'}, {}],
+            [c[1]['headers'] for c in worker.get_object.call_args_list])
+
+    def test_corrupt_segment(self):
+        manifest = self.manifest()
+        self.segments[self.storage.segment_path(self.backup, 1)] = b'dx'
+        self.manifest = lambda: manifest
+        self.assertRaises(StorageException, self.backup_blocks)
+
+    def test_missing_segment(self):
+        manifest = self.manifest()
+        error = Exception('Not Found')
+        error.http_status = 404
+        self.get_object = mock.Mock(side_effect=error)
+        self.manifest = lambda: manifest
+        self.assertRaises(StorageException, self.backup_blocks)
+
+
+class TestSwiftStorageChunks(unittest.TestCase):
+
+    def setUp(self):
+        self.client_manager = mock.MagicMock()
+        self.storage = swift.SwiftStorage(
+            self.client_manager, "freezer_container", "/tmp/", 100,
+            skip_prepare=True)
+
+    def test_put_get_chunk(self):
+        connection = self.client_manager.new_swift.return_value
+        connection.get_object.return_value = ({}, b"data")
+        self.storage.put_chunk("abcd", b"data")
+        connection.put_object.assert_called_once_with(
+            "freezer_container_segments", u"chunks/abcd", b"data",
+            content_type='application/octet-stream', content_length=4,
+            etag=None)
+        self.assertEqual(b"data", self.storage.get_chunk("abcd"))
+        connection.get_object.assert_called_once_with(
+            "freezer_container_segments", u"chunks/abcd")
+
+    def test_list_chunks(self):
+        connection = self.client_manager.get_swift.return_value
+        connection.get_container.return_value = (
+            {}, [{'name': u'chunks/ab'}, {'name': u'chunks/cd'}])
+        self.assertEqual(set([u'ab', u'cd']), self.storage.list_chunks())
+
+    def test_chunk_times(self):
+        connection = self.client_manager.get_swift.return_value
+        connection.get_container.return_value = (
+            {}, [{'name': u'chunks/ab',
+                  'last_modified': '1970-01-02T00:00:00.000000'}])
+        self.assertEqual({u'ab': 86400}, self.storage.chunk_times())
+
+    def test_list_all_backups(self):
+        connection = self.client_manager.get_swift.return_value
+        connection.get_container.return_value = (
+            {}, [{'name': u'host_a_1000_0'}, {'name': u'host_b_2000_0'},
+                 {'subdir': u'freezer_index/'}])
+        backups = self.storage.list_all_backups()
+        self.assertEqual(['host_a', 'host_b'],
+                         [b.hostname_backup_name for b in backups])
+        self.assertEqual('/', connection.get_container.call_args[1][
+            'delimiter'])
+
+    def test_backup_head(self):
+        connection = self.client_manager.get_swift.return_value
+        connection.get_object.return_value = ({}, b"FRZ")
+        backup = base.Backup(self.storage, 'host_backup', 1000)
+        self.assertEqual(b"FRZ", self.storage.backup_head(backup, 3))
+        connection.get_object.assert_called_once_with(
+            "freezer_container", "host_backup_1000_0",
+            headers={'Range': 'bytes=0-2'})
+
+
+class TestSwiftStorageLocation(unittest.TestCase):
+
+    def storage(self, **swift_args):
+        client_manager = mock.MagicMock()
+        client_manager.swift_args = dict(
+            swift_args, auth_url='http://keystone:5000/v3',
+            region_name='region')
+        client_manager.get_swift.return_value.get_auth.return_value = (
+            'http://swift:8080/v1/AUTH_c', 'token')
+        return swift.SwiftStorage(client_manager, "freezer_container",
+                                  "/tmp/", 100, skip_prepare=True)
+
+    def test_projects(self):
+        first = self.storage(project_id='a')
+        second = self.storage(tenant_id='b')
+        self.assertNotEqual(first.location(), second.location())
+        self.assertEqual(first.endpoint, second.endpoint)
+        self.assertEqual(
+            u'swift http://keystone:5000/v3 region/a/freezer_container',
+            first.location())
+
+    def test_project_names(self):
+        self.assertNotEqual(
+            self.storage(project_name='a',
+                         project_domain_name='first').location(),
+            self.storage(project_name='a',
+                         project_domain_name='second').location())
+
+    def test_token(self):
+        self.assertEqual(u'http://swift:8080/v1/AUTH_c/freezer_container',
+                         self.storage(token='token').location())
+
+
+class TestSwiftStorageMetaFileCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.client_manager = mock.MagicMock()
+        self.storage = swift.SwiftStorage(
+            self.client_manager, "freezer_container", self.tmp_dir, 100,
+            skip_prepare=True)
+        self.backup = base.Backup(self.storage, "hostname_backup", 1000,
+                                  tar_meta=True)
+        self.increment = base.Backup(self.storage, "hostname_backup", 2000,
+                                     full_backup=self.backup, level=1)
+        self.backup.add_increment(self.increment)
+        self.connection = self.client_manager.get_swift.return_value
+        self.connection.head_object.return_value = {'etag': 'abcd'}
+        meta_file = os.path.join(self.tmp_dir, 'meta')
+        with open(meta_file, 'w') as f:
+            f.write('level 0')
+        self.storage.upload_meta_file(self.backup, meta_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_cached_meta_file(self):
+        meta_path = self.storage.download_meta_file(self.increment)
+        with open(meta_path) as f:
+            self.assertEqual('level 0', f.read())
+        self.connection.head_object.assert_called_with(
+            "freezer_container", self.backup.tar())
+        self.assertFalse(self.connection.get_object.called)
+
+    def test_stale_cache(self):
+        self.connection.head_object.return_value = {'etag': 'efgh'}
+        self.connection.get_object.return_value = ({}, iter([b'level 0 v2']))
+        meta_path = self.storage.download_meta_file(self.increment)
+        with open(meta_path) as f:
+            self.assertEqual('level 0 v2', f.read())
+
+    def test_compressed_meta_file(self):
+        self.connection.head_object.return_value = {'etag': 'efgh'}
+        compressed = io.BytesIO()
+        with gzip.GzipFile(fileobj=compressed, mode='wb') as f:
+            f.write(b'level 0 v2')
+        self.connection.get_object.return_value = (
+            {}, iter([compressed.getvalue()]))
+        meta_path = self.storage.download_meta_file(self.increment)
+        with open(meta_path) as f:
+            self.assertEqual('level 0 v2', f.read())
+        self.assertFalse(os.path.exists('{0}.download'.format(meta_path)))
+
+
+class TestSwiftStorageListing(unittest.TestCase):
+
+    def setUp(self):
+        self.client_manager = mock.MagicMock()
+        self.storage = swift.SwiftStorage(
+            self.client_manager, "freezer_container", "/tmp/", 100,
+            skip_prepare=True, use_index=True)
+        self.connection = self.client_manager.get_swift.return_value
+        self.connection.get_capabilities.return_value = {}
+        listings = {
+            'host_backup_': [
+                {'name': 'host_backup_1000_0'},
+                {'name': 'host_backup_2000_1'},
+                {'name': 'host_backup_other_3000_0'}],
+            'tar_metadata_host_backup_': [
+                {'name': 'tar_metadata_host_backup_1000_0'}]}
+        self.connection.get_container.side_effect = \
+            lambda container, prefix, **kwargs: (
+                {}, listings.get(str(prefix), []))
+
+    def index(self):
+        put = self.connection.put_object.call_args
+        self.assertEqual(("freezer_container", "freezer_index/host_backup"),
+                         put[0][:2])
+        return json.loads(put[0][2])['backups']
+
+    def test_list_container(self):
+        self.storage.use_index = False
+        backups = self.storage.find_all('host_backup')
+        self.assertEqual(1, len(backups))
+        self.assertTrue(backups[0].tar_meta)
+        self.assertEqual(2000, backups[0].latest_update.timestamp)
+        self.connection.get_container.assert_any_call(
+            "freezer_container", prefix='host_backup_', delimiter='/',
+            full_listing=True)
+        self.assertFalse(self.connection.put_object.called)
+
+    def test_catalog(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.storage.use_index = False
+        self.storage.set_catalog(catalog.Catalog(
+            os.path.join(tmp_dir, catalog.CATALOG_FILE), 3600))
+        self.storage.find_all('host_backup')
+        self.connection.get_container.reset_mock()
+        backups = self.storage.find_all('host_backup')
+        self.assertEqual(2000, backups[0].latest_update.timestamp)
+        self.assertFalse(self.connection.get_container.called)
+        # the catalog is keyed without authenticating
+        self.assertFalse(self.connection.get_auth.called)
+
+    def test_missing_index(self):
+        self.connection.get_object.side_effect = Exception("404")
+        backups = self.storage.find_all('host_backup')
+        self.assertEqual(2, len(backups[0].increments))
+        self.assertEqual([[1000, 0, True], [2000, 1, False]], self.index())
+
+    def test_index(self):
+        self.connection.get_object.return_value = (
+            {}, b'{"backups": [[1000, 0, true], [5000, 0, false]]}')
+        backups = self.storage.find_all('host_backup')
+        self.assertEqual([1000, 5000], [b.timestamp for b in backups])
+        self.assertFalse(self.connection.get_container.called)
+
+    def test_index_updates(self):
+        self.connection.get_object.return_value = (
+            {}, b'{"backups": [[1000, 0, true], [2000, 1, true]]}')
+        backup = self.storage.find_all('host_backup')[0]
+        self.storage.add_to_catalog(
+            base.Backup(self.storage, 'host_backup', 3000), True)
+        self.assertEqual([[1000, 0, True], [2000, 1, True], [3000, 0, True]],
+                         self.index())
+        self.storage.remove_backup(backup)
+        self.assertEqual([], self.index())
+
+
+class TestSwiftStorageRemove(unittest.TestCase):
+
+    def setUp(self):
+        self.client_manager = mock.MagicMock()
+        self.storage = swift.SwiftStorage(
+            self.client_manager, "freezer_container", "/tmp/", 100,
+            skip_prepare=True)
+        self.connection = self.client_manager.get_swift.return_value
+        self.connection.get_container.side_effect = \
+            lambda container, prefix, full_listing: (
+                {}, [{'name': u'{0}0'.format(prefix)},
+                     {'name': u'{0}1'.format(prefix)}])
+        self.backups = []
+        for timestamp in (1000, 3000):
+            backup = base.Backup(self.storage, "host_backup", timestamp)
+            backup.add_increment(base.Backup(
+                self.storage, "host_backup", timestamp + 1000, 1, backup))
+            self.backups.append(backup)
+        segments = "freezer_container_segments"
+        self.objects = [
+            (segments, u'host_backup_2000_1/0'),
+            (segments, u'host_backup_2000_1/1'),
+            ("freezer_container", 'tar_metadata_host_backup_2000_1'),
+            (segments, u'host_backup_1000_0/0'),
+            (segments, u'host_backup_1000_0/1'),
+            ("freezer_container", 'tar_metadata_host_backup_1000_0'),
+            ("freezer_container", 'host_backup_2000_1'),
+            ("freezer_container", 'host_backup_1000_0')]
+
+    def test_backup_objects(self):
+        self.assertEqual(self.objects,
+                         self.storage.backup_objects(self.backups[0]))
+
+    def test_bulk_delete(self):
+        self.connection.get_capabilities.return_value = {
+            'bulk_delete': {'max_deletes_per_request': 10}}
+        self.connection.post_account.return_value = (
+            {}, b'{"Response Status": "200 OK", "Errors": []}')
+        self.storage.remove_backups(self.backups)
+        self.assertEqual(2, self.connection.post_account.call_count)
+        paths = self.connection.post_account.call_args_list[0][1]['data']
+        self.assertEqual(10, len(paths.split('\n')))
+        self.assertEqual('/freezer_container_segments/host_backup_2000_1/0',
+                         paths.split('\n')[0])
+        self.assertEqual(
+            'bulk-delete',
+            self.connection.post_account.call_args[1]['query_string'])
+
+    def test_bulk_delete_errors(self):
+        self.connection.get_capabilities.return_value = {
+            'bulk_delete': {'max_deletes_per_request': 10}}
+        self.connection.post_account.return_value = (
+            {}, b'{"Response Status": "400 Bad Request", '
+                b'"Errors": [["/c/o", "409 Conflict"]]}')
+        self.assertRaises(StorageException, self.storage.remove_backups,
+                          self.backups)
+
+    def test_parallel_delete(self):
+        self.connection.get_capabilities.side_effect = Exception("404")
+        not_found = Exception("not found")
+        not_found.http_status = 404
+        worker_connection = self.client_manager.new_swift.return_value
+        worker_connection.delete_object.side_effect = \
+            lambda container, name: None if name.endswith('0') else \
+            self.fail_not_found(not_found)
+        self.storage.remove_backup(self.backups[0])
+        self.assertEqual(
+            sorted(self.objects),
+            sorted(c[0] for c in
+                   worker_connection.delete_object.call_args_list))
+
+    @staticmethod
+    def fail_not_found(not_found):
+        raise not_found
+
+
+class TestSwiftStorageOrphans(unittest.TestCase):
+
+    def setUp(self):
+        self.client_manager = mock.MagicMock()
+        self.storage = swift.SwiftStorage(
+            self.client_manager, "freezer_container", "/tmp/", 100,
+            skip_prepare=True)
+        self.connection = self.client_manager.get_swift.return_value
+        self.connection.get_capabilities.return_value = {
+            'bulk_delete': {'max_deletes_per_request': 100}}
+        self.connection.post_account.return_value = (
+            {}, b'{"Response Status": "200 OK", "Errors": []}')
+        old = '2016-01-01T10:00:00.000000'
+        new = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%f')
+        segments = {
+            'host_backup_1000_0/': [old, old],
+            'host_backup_2000_1/': [old, old, old],
+            'host_backup_3000_0/': [old, new],
+            'chunks/': [old]}
+        self.listings = {
+            ("freezer_container", None): [{'name': 'host_backup_1000_0'}],
+            ("freezer_container_segments", None): [
+                {'subdir': prefix} for prefix in sorted(segments)]}
+        for prefix, modified in segments.items():
+            self.listings[("freezer_container_segments", prefix)] = [
+                {'name': u'{0}{1}'.format(prefix, i), 'bytes': 10,
+                 'last_modified': m} for i, m in enumerate(modified)]
+        self.connection.get_container.side_effect = \
+            lambda container, prefix=None, **kwargs: (
+                {}, self.listings[(container, prefix)])
+
+    def test_remove_orphans(self):
+        stats = self.storage.remove_orphans(3600)
+        self.assertEqual({'orphan_backups': 1, 'orphan_segments': 3,
+                          'orphan_bytes': 30}, stats)
+        paths = self.connection.post_account.call_args[1]['data']
+        self.assertEqual(
+            ['/freezer_container_segments/host_backup_2000_1/0',
+             '/freezer_container_segments/host_backup_2000_1/1',
+             '/freezer_container_segments/host_backup_2000_1/2'],
+            paths.split('\n'))
+
+    def test_remove_orphans_dry_run(self):
+        stats = self.storage.remove_orphans(3600, dry_run=True)
+        self.assertEqual(3, stats['orphan_segments'])
+        self.assertFalse(self.connection.post_account.called)
+
+    def test_stream_backups(self):
+        # nova and cinder backups are streamed as <id>/<timestamp>
+        old = '2016-01-01T10:00:00.000000'
+        self.listings[("freezer_container", None)].append(
+            {'name': 'inst-123/1500000000'})
+        self.listings[("freezer_container_segments", None)].append(
+            {'subdir': 'inst-123/'})
+        self.listings[("freezer_container_segments", 'inst-123/')] = [
+            {'name': u'inst-123/{0}/{1:08d}'.format(timestamp, i),
+             'bytes': 10, 'last_modified': old}
+            for timestamp in (1400000000, 1500000000) for i in range(2)]
+        orphans = self.storage.orphan_prefixes(3600)
+        self.assertEqual(['host_backup_2000_1/', 'inst-123/1400000000/'],
+                         sorted(orphans))
+        self.assertEqual(['inst-123/1400000000/00000000',
+                          'inst-123/1400000000/00000001'],
+                         [x['name'] for x in
+                          orphans['inst-123/1400000000/']])
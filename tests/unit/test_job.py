@@ -65,6 +65,31 @@ class TestAdminJob(TestJob):
         backup_opt = BackupOpt1()
         jobs.AdminJob(backup_opt, backup_opt.storage).execute()
 
+    def test_execute_remove_orphans(self):
+        backup_opt = BackupOpt1()
+        backup_opt.remove_orphans = True
+        backup_opt.remove_older_than = None
+        backup_opt.remove_from_date = False
+        backup_opt.storage = Mock()
+        backup_opt.storage.remove_orphans.return_value = {'orphan_bytes': 10}
+        result = jobs.AdminJob(backup_opt, backup_opt.storage).execute()
+        self.assertEqual({'orphan_bytes': 10}, result)
+        backup_opt.storage.remove_orphans.assert_called_once_with(
+            86400, backup_opt.dry_run)
+        self.assertFalse(backup_opt.storage.remove_older_than.called)
+
+    @patch('freezer.job.dedup_engine.collect_chunks')
+    def test_execute_collect_chunks(self, mock_collect_chunks):
+        backup_opt = BackupOpt1()
+        backup_opt.collect_chunks = True
+        backup_opt.storage = Mock()
+        mock_collect_chunks.return_value = {'unreferenced_chunks': 2}
+        result = jobs.AdminJob(backup_opt, backup_opt.storage).execute()
+        self.assertEqual({'unreferenced_chunks': 2}, result)
+        self.assertTrue(backup_opt.storage.remove_older_than.called)
+        mock_collect_chunks.assert_called_once_with(
+            backup_opt.storage, 86400, backup_opt.dry_run)
+
 
 class TestExecJob(TestJob):
 
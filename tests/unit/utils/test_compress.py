@@ -0,0 +1,116 @@
+# (c) Copyright 2016 Hewlett-Packard Enterprise Development Company, L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from freezer.utils import compress
+from freezer.utils import streaming
+
+
+class TestFrameCompression(unittest.TestCase):
+
+    def compress(self, messages, algo='gzip', frame_size=8, chunk_size=32):
+        compressor = compress.FrameCompressor(algo, 4, chunk_size,
+                                              frame_size=frame_size)
+        return list(compressor.compress(messages))
+
+    def decompress(self, blocks):
+        return b''.join(compress.FrameDecompressor(4).decompress(blocks))
+
+    def test_round_trip(self):
+        data = [os.urandom(20), b"a" * 100, b"", b"bc"]
+        for algo in compress.CODECS:
+            blocks = self.compress(data, algo)
+            self.assertTrue(compress.is_framed(blocks[0]))
+            self.assertEqual(b''.join(data), self.decompress(blocks))
+
+    def test_split_blocks(self):
+        data = b"freezer" * 100
+        stream = b''.join(self.compress([data]))
+        blocks = [stream[i:i + 5] for i in range(0, len(stream), 5)]
+        self.assertEqual(data, self.decompress(blocks))
+
+    def test_releases_messages(self):
+        pool = streaming.BufferPool(16)
+        buf = pool.acquire()
+        buf.buffer[:] = b"x" * 16
+        buf.length = 16
+        self.compress([buf])
+        self.assertEqual(0, buf.refs)
+        self.assertIs(buf, pool.acquire())
+
+    def test_skips_incompressible(self):
+        compressor = compress.FrameCompressor('gzip', 2, 1024,
+                                              frame_size=128 * 1024)
+        random = os.urandom(128 * 1024)
+        text = b"freezer" * 20000
+        blocks = list(compressor.compress([random, text]))
+        self.assertEqual(random + text, self.decompress(blocks))
+        metadata = compressor.metadata()
+        self.assertEqual(3, metadata["compression_frames"])
+        self.assertEqual(1, metadata["compression_skipped_frames"])
+        self.assertEqual(len(random), metadata["compression_skipped_bytes"])
+        self.assertTrue(0.4 < metadata["compression_ratio"] < 0.6)
+
+    def test_compressible(self):
+        self.assertTrue(compress.compressible(b"a" * 200000))
+        self.assertFalse(compress.compressible(os.urandom(200000)))
+        self.assertFalse(compress.compressible(b""))
+
+    def test_not_framed(self):
+        self.assertFalse(compress.is_framed(b"\x1f\x8b\x08\x00"))
+        self.assertRaises(ValueError, self.decompress, [b"0123456789"])
+
+    def test_truncated(self):
+        stream = b''.join(self.compress([b"a" * 100]))
+        self.assertRaises(ValueError, self.decompress, [stream[:-1]])
+
+    def test_unknown_algo(self):
+        self.assertRaises(ValueError, compress.FrameCompressor, 'zip', 1, 16)
+
+
+class TestGzipFile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'meta')
+        with open(self.path, 'wb') as f:
+            f.write(b"GNU tar-1.28-2\n" * 1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_round_trip(self):
+        compressed = os.path.join(self.tmp_dir, 'meta.gz')
+        restored = os.path.join(self.tmp_dir, 'restored')
+        compress.gzip_file(self.path, compressed)
+        self.assertTrue(compress.is_gzip_file(compressed))
+        self.assertTrue(os.path.getsize(compressed) * 10 <
+                        os.path.getsize(self.path))
+        compress.gunzip_file(compressed, restored)
+        self.assertEqual(self.read(self.path), self.read(restored))
+
+    def test_not_compressed(self):
+        restored = os.path.join(self.tmp_dir, 'restored')
+        self.assertFalse(compress.is_gzip_file(self.path))
+        compress.gunzip_file(self.path, restored)
+        self.assertEqual(self.read(self.path), self.read(restored))
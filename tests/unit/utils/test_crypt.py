@@ -0,0 +1,91 @@
+# (c) Copyright 2016 Hewlett-Packard Enterprise Development Company, L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from freezer.utils import crypt
+
+
+@mock.patch('freezer.utils.crypt.KDF_ITERATIONS', 10)
+@mock.patch('freezer.utils.crypt.CHUNK_SIZE', 16)
+class TestChunkEncryption(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.pass_file = self.write_pass_file('secret\nignored')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write_pass_file(self, password):
+        path = os.path.join(self.temp_dir, password.split()[0])
+        with open(path, 'w') as f:
+            f.write(password)
+        return path
+
+    def encrypt(self, data):
+        return list(crypt.ChunkEncryptor(self.pass_file, 4, 64).encrypt(data))
+
+    def decrypt(self, blocks, pass_file=None):
+        decryptor = crypt.ChunkDecryptor(pass_file or self.pass_file, 4)
+        return b''.join(decryptor.decrypt(blocks))
+
+    def test_round_trip(self):
+        for data in ([], [b""], [b"a" * 16], [b"a" * 20, b"b" * 50, b"c"]):
+            blocks = self.encrypt(data)
+            self.assertTrue(crypt.is_encrypted(blocks[0]))
+            self.assertEqual(b''.join(data), self.decrypt(blocks))
+
+    def test_split_blocks(self):
+        data = b"freezer" * 20
+        stream = b''.join(self.encrypt([data]))
+        blocks = [stream[i:i + 5] for i in range(0, len(stream), 5)]
+        self.assertEqual(data, self.decrypt(blocks))
+
+    def test_read_pass_file(self):
+        self.assertEqual(b'secret', crypt.read_pass_file(self.pass_file))
+
+    def test_wrong_key(self):
+        blocks = self.encrypt([b"a" * 40])
+        self.assertRaises(ValueError, self.decrypt, blocks,
+                          self.write_pass_file('other'))
+
+    def test_truncated(self):
+        stream = b''.join(self.encrypt([b"a" * 40]))
+        last = crypt.record_offset(2)
+        self.assertRaises(ValueError, self.decrypt, [stream[:last]])
+
+    def test_reordered(self):
+        stream = b''.join(self.encrypt([b"a" * 16 + b"b" * 16 + b"c"]))
+        first, second = crypt.record_offset(0), crypt.record_offset(1)
+        end = crypt.record_offset(2)
+        reordered = (stream[:first] + stream[second:end] +
+                     stream[first:second] + stream[end:])
+        self.assertRaises(ValueError, self.decrypt, [reordered])
+
+    def test_open_record(self):
+        stream = b''.join(self.encrypt([b"a" * 16 + b"b" * 16 + b"c"]))
+        decryptor = crypt.ChunkDecryptor(self.pass_file, 1)
+        decryptor.set_salt(stream[len(crypt.MAGIC):crypt.HEADER_SIZE])
+        record = stream[crypt.record_offset(1):crypt.record_offset(2)]
+        self.assertEqual((b"b" * 16, False),
+                         decryptor.open_record(1, record))
+        record = stream[crypt.record_offset(2):]
+        self.assertEqual((b"c", True), decryptor.open_record(2, record))
@@ -0,0 +1,167 @@
+# (c) Copyright 2016 Hewlett-Packard Enterprise Development Company, L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import io
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from freezer.utils import streaming
+
+
+class TestRichQueue(unittest.TestCase):
+
+    def test_put_get_messages(self):
+        rich_queue = streaming.RichQueue(10)
+        rich_queue.put_messages(["a", "b", "c"])
+        self.assertEqual(["a", "b", "c"], list(rich_queue.get_messages()))
+
+    def test_get_timeout(self):
+        rich_queue = streaming.RichQueue()
+        self.assertRaises(streaming.Wait, rich_queue.get, 0.01)
+
+    def test_get_finished(self):
+        rich_queue = streaming.RichQueue()
+        rich_queue.finish()
+        self.assertRaises(streaming.Wait, rich_queue.get)
+
+    def test_max_bytes(self):
+        rich_queue = streaming.RichQueue(max_bytes=4)
+        rich_queue.put("abc")
+        self.assertTrue(rich_queue._full(2))
+        self.assertFalse(rich_queue._full(1))
+        rich_queue.get()
+        # a message bigger than the budget fits in an empty queue
+        self.assertFalse(rich_queue._full(100))
+        rich_queue.put("a" * 100)
+        self.assertEqual(100, rich_queue.bytes)
+
+    def test_force_stop_wakes_producer(self):
+        rich_queue = streaming.RichQueue(1)
+        rich_queue.put("a")
+        errors = []
+
+        def produce():
+            try:
+                rich_queue.put("b")
+            except Exception as e:
+                errors.append(e)
+
+        producer = threading.Thread(target=produce)
+        producer.start()
+        rich_queue.force_stop()
+        producer.join(5)
+        self.assertFalse(producer.is_alive())
+        self.assertEqual(1, len(errors))
+
+    def test_force_stop_wakes_consumer(self):
+        rich_queue = streaming.RichQueue()
+        consumer = threading.Thread(
+            target=lambda: self.assertRaises(Exception, list,
+                                             rich_queue.get_messages()))
+        consumer.start()
+        rich_queue.force_stop()
+        consumer.join(5)
+        self.assertFalse(consumer.is_alive())
+
+    def test_producer_consumer(self):
+        rich_queue = streaming.RichQueue(max_bytes=10)
+        messages = [str(i) * 3 for i in range(100)]
+        producer = threading.Thread(target=rich_queue.put_messages,
+                                    args=(messages,))
+        producer.start()
+        self.assertEqual(messages, list(rich_queue.get_messages()))
+        producer.join()
+
+
+class TestSpooledQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    def test_producer_does_not_wait(self):
+        spooled_queue = streaming.SpooledQueue(
+            os.path.join(self.tmp_dir, 'spool'), max_bytes=4)
+        messages = [str(i).encode('ascii') * 3 for i in range(10)]
+        spooled_queue.put_messages(messages)
+        self.assertEqual(27, spooled_queue.spooled_bytes)
+        self.assertEqual(messages, list(spooled_queue.get_messages()))
+        spooled_queue.close()
+
+    def test_force_stop(self):
+        spooled_queue = streaming.SpooledQueue(self.tmp_dir, size=1)
+        spooled_queue.put(b"ab")
+        spooled_queue.put(b"cd")
+        spooled_queue.force_stop()
+        self.assertRaises(Exception, spooled_queue.get)
+        self.assertRaises(Exception, spooled_queue.put, b"ef")
+
+
+class TestBufferPool(unittest.TestCase):
+
+    def test_readinto_and_recycle(self):
+        pool = streaming.BufferPool(4)
+        stream = io.BytesIO(b"abcdefghij")
+        buffers = []
+        pooled = pool.acquire()
+        while pooled.readinto(stream):
+            buffers.append(pooled.view().tobytes())
+            pooled.release()
+            pooled = pool.acquire()
+        pooled.release()
+        self.assertEqual([b"abcd", b"efgh", b"ij"], buffers)
+        self.assertEqual(1, len(pool.free))
+
+    def test_release_after_every_reference(self):
+        pool = streaming.BufferPool(4)
+        pooled = pool.acquire()
+        streaming.retain(pooled)
+        streaming.release(pooled)
+        self.assertEqual([], pool.free)
+        streaming.release(pooled)
+        self.assertEqual([pooled], pool.free)
+
+    def test_message_view(self):
+        self.assertEqual("abc", streaming.message_view("abc"))
+        pooled = streaming.BufferPool(4).acquire()
+        pooled.readinto(io.BytesIO(b"ab"))
+        self.assertEqual(b"ab", streaming.message_view(pooled).tobytes())
+        self.assertEqual(2, len(pooled))
+
+
+class TestViewReader(unittest.TestCase):
+
+    def test_read_seek(self):
+        reader = streaming.ViewReader(memoryview(b"abcdef"))
+        self.assertEqual(b"abcd", reader.read(4).tobytes())
+        self.assertEqual(b"ef", reader.read().tobytes())
+        self.assertEqual(6, reader.tell())
+        reader.seek(0)
+        self.assertEqual(b"abc", reader.read(3).tobytes())
+
+    def test_several_views(self):
+        reader = streaming.ViewReader(memoryview(b"abc"), memoryview(b"def"))
+        # reads stop at the end of a view
+        self.assertEqual(b"ab", reader.read(2).tobytes())
+        self.assertEqual(b"c", reader.read(4).tobytes())
+        self.assertEqual(b"de", reader.read(2).tobytes())
+        reader.seek(1)
+        self.assertEqual(b"bcdef", reader.read())
+        self.assertEqual(b"", reader.read(1))
+        reader.seek(-2, 2)
+        self.assertEqual(b"ef", reader.read(5).tobytes())
@@ -0,0 +1,97 @@
+# (c) Copyright 2016 Hewlett-Packard Enterprise Development Company, L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measures the time and the peak memory of Backup.parse_backups on a
+listing of a storage with many backups, like a swift container shared by
+many agents:
+
+    python tools/benchmark_parse_backups.py --names 1000000
+
+The names are generated while they are parsed, so the peak memory is the
+one of the parser. Peak memory is measured with tracemalloc, on python 2
+the maximum resident size of the process is reported instead.
+"""
+
+from __future__ import print_function
+
+import argparse
+import gc
+import resource
+import time
+
+from freezer.storage import base
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def listing(names, backup_names, levels):
+    """
+    :return: names of a listing with about names objects, backups of
+        backup_names names with levels levels, every backup with its
+        tar_meta
+    """
+    backups = names // 2
+    cycles = max(backups // (backup_names * levels), 1)
+    for name in range(backup_names):
+        hostname_backup_name = 'host{0:04d}_backup'.format(name)
+        timestamp = 1460000000
+        for _ in range(cycles):
+            for level in range(levels):
+                backup = '{0}_{1}_{2}'.format(hostname_backup_name,
+                                              timestamp, level)
+                yield backup
+                yield 'tar_metadata_{0}'.format(backup)
+                timestamp += 3600
+
+
+def parse(args):
+    return base.Backup.parse_backups(
+        listing(args.names, args.backup_names, args.levels), None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--names', type=int, default=1000000)
+    parser.add_argument('--backup-names', type=int, default=1000)
+    parser.add_argument('--levels', type=int, default=10)
+    args = parser.parse_args()
+
+    # tracing slows allocations down, memory is measured by a second run
+    gc.collect()
+    start = time.time()
+    backups = parse(args)
+    elapsed = time.time() - start
+    count = len(backups)
+    increments = sum(len(b.increments) for b in backups)
+    del backups
+    gc.collect()
+    if tracemalloc:
+        tracemalloc.start()
+        parse(args)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    else:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    print('{0} names parsed in {1:.2f}s, peak memory {2:.1f}MB: {3} '
+          'backups, {4} increments'.format(
+              args.names, elapsed, peak / 1024.0 / 1024, count,
+              increments))
+
+
+if __name__ == '__main__':
+    main()